@@ -22,9 +22,11 @@ __version__ = "v0.1"
 #  You should have received a copy of the GNU General Public License along with this program. If not,
 #  see <https://www.gnu.org/licenses/>.
 
-from flask import Flask, redirect
+from flask import Flask, redirect, jsonify
 from .config import API_KEY, THIS_PC, AVAILABLE_DEVICES
 from importlib import import_module
+import configparser
+import os
 
 def create_app():
     """
@@ -39,6 +41,16 @@ def create_app():
     def homepage():
         return redirect('/swagger/')
 
+    # Failed instrument operations (after retries, or while the circuit breaker is open) are returned as JSON errors
+    from .modules.pyResilience import InstrumentError
+    @app.errorhandler(InstrumentError)
+    def instrument_error(error):
+        if not error.attempts:
+            # Circuit breaker is open: the instrument is being reconnected
+            return jsonify(error.to_dict()), 503, {'Retry-After': f'{error.retry_after:.0f}'}
+        timeout = getattr(error.__cause__, 'abbreviation', '') == 'VI_ERROR_TMO'
+        return jsonify(error.to_dict()), 504 if timeout else 502
+
     # Register Swagger blueprint
     from .blueprints.swagger import swagger_blueprint
     app.register_blueprint(swagger_blueprint())
@@ -54,7 +66,8 @@ def create_app():
             blueprint_module = import_module(f'.blueprints.local.{device}', package = __package__)
             # Instantiate device: if in debug mode - device will use mock VISA
             app.local_devices[device] = getattr(device_module, f'{device}')(device_present = properties['device_present'])
-            local_device_blueprint = getattr(blueprint_module, f'local{device}')(app.local_devices[device])
+            # Blueprint shares the device instance with other app components (e.g. Prometheus worker)
+            local_device_blueprint = getattr(blueprint_module, f'local{device}')(device = app.local_devices[device])
             app.register_blueprint(local_device_blueprint.set_routes())
         else:
             # If HOST is remote server, use remote modules forward API calls to respective IPs
@@ -63,4 +76,26 @@ def create_app():
             device_blueprint = module.set_routes(device, properties)
             app.register_blueprint(device_blueprint)
 
+    # Register batch blueprint: several API calls (local and remote devices) in a single request
+    from .blueprints.batch import batch_blueprint
+    app.register_blueprint(batch_blueprint(app.local_devices))
+
+    # Register jobs blueprint: long-running device class methods run asynchronously, one job per device at a time
+    from .modules.pyJobs import JobManager
+    from .blueprints.jobs import jobs_blueprint
+    config = configparser.ConfigParser()
+    config.read(f'{os.path.dirname(__file__)}/modules/config.ini')
+    app.jobs = JobManager(config.getint('Jobs', 'max_workers', fallback=4), config.getint('Jobs', 'history', fallback=200))
+    app.register_blueprint(jobs_blueprint(app.local_devices, app.jobs))
+
+    # Register field scan blueprint: VNA traces stamped with the IPS120 output field during a continuous sweep
+    if 'IPS120' in app.local_devices and 'KeysightE5080A' in app.local_devices:
+        from .blueprints.field_scan import field_scan_blueprint
+        app.register_blueprint(field_scan_blueprint(app.local_devices['IPS120'], app.local_devices['KeysightE5080A'],
+                                                    app.jobs))
+
+    # JSON responses of all routes are re-encoded in the format requested by the Accept header
+    from .blueprints.negotiation import negotiate_response
+    app.after_request(negotiate_response)
+
     return app
@@ -0,0 +1,191 @@
+#!/usr/bin/env python
+
+"""
+
+Flask blueprint for batched API calls: a single POST /batch request carries a list of {device, method, args} calls.
+Calls to local devices run device class methods directly (API endpoint path == class method), calls to remote devices
+are forwarded in one /batch request per remote host. Calls to different devices/hosts run concurrently, calls to the
+same device keep their order.
+
+"""
+
+__author__ = "Ivan Jakovac"
+__email__ = "ivan.jakovac2@gmail.com"
+__version__ = "v0.1"
+
+#  Copyright (C) 2020-2025 Ivan Jakovac
+#
+#  This program is free software: you can redistribute it and/or modify it under the terms of the GNU General Public
+#  License as published by the Free Software Foundation, either version 3 of the License, or (at your option) any
+#  later version.
+#
+#  This program is distributed in the hope that it will be useful, but WITHOUT ANY WARRANTY; without even the implied
+#  warranty of MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License along with this program. If not,
+#  see <https://www.gnu.org/licenses/>.
+
+from flask import Blueprint, request, jsonify, current_app
+from concurrent.futures import ThreadPoolExecutor
+import requests
+import time
+import numpy as np
+from ..config import API_KEY, AVAILABLE_DEVICES
+from hashlib import sha256
+from .remote.session_pool import remote_sessions, get_timeout, DEFAULT_POOL_SIZE
+from .remote.circuit_breaker import remote_breakers, GATEWAY_ERRORS
+
+# Routes of every local device which are not callable through /batch and /jobs
+EXCLUDED_ROUTES = ('connect', 'query', 'write')
+
+def device_routes(url_map, device: str) -> set:
+    """
+        Returns the allowlist of a local device: lowercase names of the API routes registered by its blueprint (the
+        blueprint is named after the device), without connect, query and write
+    """
+    routes = set()
+    for rule in url_map.iter_rules():
+        if rule.endpoint.split('.')[0] == device and '<' not in rule.rule:
+            routes.add(rule.rule.rsplit('/', 1)[-1].lower())
+    return routes - set(EXCLUDED_ROUTES)
+
+def resolve_method(device, method: str, routes: set):
+    """
+        Finds the device class method of a registered API route (routes, see device_routes). Endpoint paths are
+        sometimes lowercase versions of method names (e.g. get_pid -> get_PID), so the match is case-insensitive if
+        there is no exact match.
+    """
+    if method.lower() in routes:
+        if callable(getattr(device, method, None)):
+            return getattr(device, method)
+        for name in dir(device):
+            if name.lower() == method.lower() and callable(getattr(device, name)):
+                return getattr(device, name)
+    raise AttributeError(f'{type(device).__name__} has no API method {method}')
+
+def call_method(device, method: str, args, routes: set):
+    """
+        Calls a device class method with keyword (dict) or positional (list) arguments
+    """
+    function = resolve_method(device, method, routes)
+    if isinstance(args, dict):
+        return function(**args)
+    return function(*(args or []))
+
+def to_jsonable(value):
+    """
+        Converts return values of device class methods to JSON-serializable objects
+    """
+    if isinstance(value, np.ndarray):
+        return to_jsonable(value.tolist())
+    elif isinstance(value, np.generic):
+        return to_jsonable(value.item())
+    elif isinstance(value, complex):
+        return {'real': value.real, 'imag': value.imag}
+    elif isinstance(value, dict):
+        return {str(key): to_jsonable(item) for key, item in value.items()}
+    elif isinstance(value, (list, tuple)):
+        return [to_jsonable(item) for item in value]
+    return value
+
+def batch_blueprint(local_devices: dict):
+    '''
+    Flask blueprint constructor function.
+    '''
+    blueprint = Blueprint('batch', __name__)
+
+    # Authorization check
+    @blueprint.before_request
+    def check_api_key():
+        if ('x-api-key' not in request.headers.keys(lower=True)) or (sha256(request.headers.get('X-API-Key').encode()).hexdigest() != API_KEY):
+            return jsonify({'error': 'Unauthorized'}), 401
+
+    def run_local(device, indexed_calls, routes):
+        # Calls to the same device run sequentially, in order
+        results = []
+        for index, call in indexed_calls:
+            start = time.perf_counter()
+            try:
+                value = call_method(local_devices[device], str(call['method']), call.get('args', {}), routes)
+                result = {'result': to_jsonable(value)}
+            except Exception as error:
+                result = {'error': f'{type(error).__name__}: {error}'}
+            result['duration'] = time.perf_counter() - start
+            results.append((index, result))
+        return results
+
+    def run_remote(host, indexed_calls, api_key):
+        # All calls to a remote host are forwarded in a single /batch request, the remote host keeps their order
+        properties = next(properties for properties in AVAILABLE_DEVICES.values() if properties['host'] == host)
+        session = remote_sessions.get_session(host, int(properties.get('pool_size', DEFAULT_POOL_SIZE)))
+        start = time.perf_counter()
+        # Fail fast while the remote host is down
+        breaker = remote_breakers.breakers.get(host)
+        if breaker is not None and not breaker.allow():
+            return [(index, {'error': f'Remote host {host} is unavailable', 'duration': 0.0})
+                    for index, call in indexed_calls]
+        try:
+            try:
+                response = session.post(f'https://{host}/batch', headers={'X-API-Key': api_key},
+                                        json=[call for index, call in indexed_calls], timeout=get_timeout(properties))
+            except (requests.ConnectionError, requests.Timeout):
+                if breaker is not None:
+                    breaker.record_failure()
+                raise
+            # Same rule as forwarded calls: gateway errors of the remote reverse proxy count as failures
+            if breaker is not None:
+                if response.status_code in GATEWAY_ERRORS:
+                    breaker.record_failure()
+                else:
+                    breaker.record_success()
+            response.raise_for_status()
+            results = response.json()['results']
+            if len(results) != len(indexed_calls):
+                raise ValueError(f'{len(results)} results returned for {len(indexed_calls)} calls')
+            return list(zip([index for index, call in indexed_calls], results))
+        except (requests.RequestException, ValueError, KeyError) as error:
+            duration = time.perf_counter() - start
+            return [(index, {'error': f'{type(error).__name__}: {error}', 'duration': duration})
+                    for index, call in indexed_calls]
+
+    @blueprint.route('/batch', methods=['POST'])
+    def batch():
+        start = time.perf_counter()
+        body = request.get_json(silent=True)
+        calls = body.get('calls') if isinstance(body, dict) else body
+        if not isinstance(calls, list) or not all(isinstance(call, dict) for call in calls):
+            return jsonify({'error': 'Request body must be a list of calls or {"calls": [...]}, every call an object '
+                                     'with device, method and optional args'}), 400
+        results = [None] * len(calls)
+
+        # Group calls into lanes: one lane per local device and one per remote host
+        local_lanes, remote_lanes = dict(), dict()
+        for index, call in enumerate(calls):
+            device = str(call.get('device'))
+            if device in local_devices:
+                local_lanes.setdefault(device, []).append((index, call))
+            elif device in AVAILABLE_DEVICES:
+                remote_lanes.setdefault(AVAILABLE_DEVICES[device]['host'], []).append((index, call))
+            else:
+                results[index] = {'error': f'Unknown device {device}', 'duration': 0.0}
+
+        # Run lanes concurrently
+        lanes = len(local_lanes) + len(remote_lanes)
+        if lanes:
+            with ThreadPoolExecutor(max_workers=lanes) as executor:
+                # Allowlists are built here: lanes run outside of the application context
+                futures = [executor.submit(run_local, device, indexed_calls,
+                                           device_routes(current_app.url_map, device))
+                           for device, indexed_calls in local_lanes.items()]
+                futures += [executor.submit(run_remote, host, indexed_calls, request.headers.get('X-API-Key'))
+                            for host, indexed_calls in remote_lanes.items()]
+                for future in futures:
+                    for index, result in future.result():
+                        results[index] = result
+
+        for call, result in zip(calls, results):
+            result['device'], result['method'] = call.get('device'), call.get('method')
+        return jsonify({'results': results, 'duration': time.perf_counter() - start}), 200
+
+    # Return the blueprint to register in Flask app
+    return blueprint
@@ -0,0 +1,99 @@
+#!/usr/bin/env python
+
+"""
+
+Flask blueprint for field-synchronized VNA acquisition (local IPS120 and KeysightE5080A): POST /field_scan starts a
+continuous field sweep with back-to-back traces as a job, /field_scan/data returns the traces of the latest scan as a
+frequency x field array with the field readings before and after every trace.
+
+"""
+
+__author__ = "Ivan Jakovac"
+__email__ = "ivan.jakovac2@gmail.com"
+__version__ = "v0.1"
+
+#  Copyright (C) 2020-2025 Ivan Jakovac
+#
+#  This program is free software: you can redistribute it and/or modify it under the terms of the GNU General Public
+#  License as published by the Free Software Foundation, either version 3 of the License, or (at your option) any
+#  later version.
+#
+#  This program is distributed in the hope that it will be useful, but WITHOUT ANY WARRANTY; without even the implied
+#  warranty of MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License along with this program. If not,
+#  see <https://www.gnu.org/licenses/>.
+
+import math
+from flask import Blueprint, request, jsonify
+from ..config import API_KEY
+from hashlib import sha256
+from ..modules.pyJobs import JobManager
+from ..modules.pyFieldScan import FieldScan, run_field_scan
+
+def field_scan_blueprint(ips, vna, manager: JobManager):
+    '''
+    Flask blueprint constructor function.
+    '''
+    blueprint = Blueprint('field_scan', __name__)
+    # Latest scan (also while it is running)
+    scans = {'latest': None}
+
+    # Authorization check
+    @blueprint.before_request
+    def check_api_key():
+        if ('x-api-key' not in request.headers.keys(lower=True)) or (sha256(request.headers.get('X-API-Key').encode()).hexdigest() != API_KEY):
+            return jsonify({'error': 'Unauthorized'}), 401
+
+    def number(body: dict, name: str, required: bool = False, minimum: float = None, integer: bool = False):
+        # Numeric scan parameter; raises ValueError with a message for the client
+        value = body.get(name)
+        if value is None:
+            if required:
+                raise ValueError(f'{name} is required')
+            return None
+        if isinstance(value, bool) or not isinstance(value, (int, float, str)):
+            raise ValueError(f'{name} must be a number')
+        try:
+            value = float(value)
+        except ValueError:
+            raise ValueError(f'{name} must be a number')
+        if not math.isfinite(value) or (integer and not value.is_integer()):
+            raise ValueError(f'{name} must be a finite {"integer" if integer else "number"}')
+        if minimum is not None and value < minimum:
+            raise ValueError(f'{name} must be at least {minimum}')
+        return int(value) if integer else value
+
+    @blueprint.route('/field_scan', methods=['POST'])
+    def field_scan():
+        body = request.get_json(silent=True)
+        if not isinstance(body, dict):
+            return jsonify({'error': 'Request body must be an object with target_field and optional rate, tolerance '
+                                     'and max_traces'}), 400
+        try:
+            target_field = number(body, 'target_field', required=True)
+            rate = number(body, 'rate', minimum=0)
+            tolerance = number(body, 'tolerance', minimum=0)
+            max_traces = number(body, 'max_traces', minimum=1, integer=True)
+        except ValueError as error:
+            return jsonify({'error': str(error)}), 400
+        # Runs in the IPS120 job lane: other IPS120 jobs wait until the scan is finished. The frequency axis is read
+        # when the scan starts
+        scan = FieldScan()
+        job = manager.submit('IPS120', 'field_scan', run_field_scan, ips, vna, scan, target_field, rate or None,
+                             tolerance, max_traces)
+        scans['latest'] = scan
+        return jsonify(job.to_dict()), 202
+
+    @blueprint.route('/field_scan/data', methods=['GET', 'POST'])
+    def field_scan_data():
+        if scans['latest'] is None:
+            return jsonify({'error': 'No field scan'}), 404
+        scan = scans['latest'].to_dict()
+        data = scan.pop('data')
+        # Rows of real and imaginary parts: one row per trace (field), one column per frequency
+        return jsonify({**{key: value.tolist() for key, value in scan.items()},
+                        'real': data.real.tolist(), 'imag': data.imag.tolist()}), 200
+
+    # Return the blueprint to register in Flask app
+    return blueprint
@@ -0,0 +1,131 @@
+#!/usr/bin/env python
+
+"""
+
+Flask blueprint for asynchronous jobs: POST /jobs starts a long-running device class method ({device, method, args},
+as in /batch) and returns the job at once. Clients poll GET /jobs/<id> (long poll with wait and version), follow
+/jobs/<id>/progress (one JSON line per change), fetch /jobs/<id>/result and cancel with /jobs/<id>/cancel.
+
+"""
+
+__author__ = "Ivan Jakovac"
+__email__ = "ivan.jakovac2@gmail.com"
+__version__ = "v0.1"
+
+#  Copyright (C) 2020-2025 Ivan Jakovac
+#
+#  This program is free software: you can redistribute it and/or modify it under the terms of the GNU General Public
+#  License as published by the Free Software Foundation, either version 3 of the License, or (at your option) any
+#  later version.
+#
+#  This program is distributed in the hope that it will be useful, but WITHOUT ANY WARRANTY; without even the implied
+#  warranty of MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License along with this program. If not,
+#  see <https://www.gnu.org/licenses/>.
+
+import inspect
+from flask import Blueprint, Response, request, jsonify, json, current_app
+from ..config import API_KEY
+from hashlib import sha256
+from .batch import device_routes, resolve_method, to_jsonable
+from ..modules.pyJobs import JobManager
+
+# Longest long poll [s], waitress threads are not held longer
+MAX_WAIT = 60
+
+def jobs_blueprint(local_devices: dict, manager: JobManager):
+    '''
+    Flask blueprint constructor function.
+    '''
+    blueprint = Blueprint('jobs', __name__)
+
+    # Authorization check
+    @blueprint.before_request
+    def check_api_key():
+        if ('x-api-key' not in request.headers.keys(lower=True)) or (sha256(request.headers.get('X-API-Key').encode()).hexdigest() != API_KEY):
+            return jsonify({'error': 'Unauthorized'}), 401
+
+    def get_job(job_id: str):
+        try:
+            return manager.get(job_id)
+        except KeyError:
+            return None
+
+    @blueprint.route('/jobs', methods=['GET', 'POST'])
+    def jobs():
+        if request.method == 'GET':
+            return jsonify({'jobs': [job.to_dict() for job in manager.list()]}), 200
+        body = request.get_json(silent=True)
+        if not isinstance(body, dict):
+            return jsonify({'error': 'Request body must be an object with device, method and optional args'}), 400
+        device, method, args = str(body.get('device')), str(body.get('method')), body.get('args', {})
+        if device not in local_devices:
+            return jsonify({'error': f'Unknown device {device}'}), 404
+        try:
+            function = resolve_method(local_devices[device], method, device_routes(current_app.url_map, device))
+        except AttributeError as error:
+            return jsonify({'error': str(error)}), 400
+        if args is not None and not isinstance(args, (dict, list)):
+            return jsonify({'error': 'args must be an object (keyword arguments) or a list (positional arguments)'}), 400
+        # Reject a call which does not match the method now instead of failing the job later
+        try:
+            if isinstance(args, dict):
+                inspect.signature(function).bind(**args)
+            else:
+                inspect.signature(function).bind(*(args or []))
+        except TypeError as error:
+            return jsonify({'error': f'Invalid arguments of {method}: {error}'}), 400
+        if isinstance(args, dict):
+            job = manager.submit(device, method, function, **args)
+        else:
+            job = manager.submit(device, method, function, *(args or []))
+        return jsonify(job.to_dict()), 202
+
+    @blueprint.route('/jobs/<job_id>', methods=['GET'])
+    def job_status(job_id):
+        job = get_job(job_id)
+        if job is None:
+            return jsonify({'error': f'Unknown job {job_id}'}), 404
+        if 'wait' in request.args:
+            # Long poll: return when the job changes after version (or finishes)
+            version = int(request.args['version']) if 'version' in request.args else None
+            manager.wait(job, version, min(float(request.args['wait']), MAX_WAIT))
+        return jsonify(job.to_dict()), 200
+
+    @blueprint.route('/jobs/<job_id>/result', methods=['GET'])
+    def job_result(job_id):
+        job = get_job(job_id)
+        if job is None:
+            return jsonify({'error': f'Unknown job {job_id}'}), 404
+        if not job.done:
+            return jsonify({**job.to_dict(), 'error': 'Job is not finished'}), 409
+        return jsonify({**job.to_dict(), 'result': to_jsonable(job.result)}), 200
+
+    @blueprint.route('/jobs/<job_id>/progress', methods=['GET'])
+    def job_progress(job_id):
+        job = get_job(job_id)
+        if job is None:
+            return jsonify({'error': f'Unknown job {job_id}'}), 404
+
+        def generate():
+            # One JSON line per change until the job is finished
+            version = -1
+            while True:
+                manager.wait(job, version, MAX_WAIT)
+                state = job.to_dict()
+                if state['version'] != version:
+                    version = state['version']
+                    yield json.dumps(state) + '\n'
+                if state['status'] in job.FINISHED:
+                    return
+        return Response(generate(), mimetype='application/x-ndjson')
+
+    @blueprint.route('/jobs/<job_id>/cancel', methods=['POST', 'DELETE'])
+    def cancel_job(job_id):
+        if get_job(job_id) is None:
+            return jsonify({'error': f'Unknown job {job_id}'}), 404
+        return jsonify(manager.cancel(job_id).to_dict()), 202
+
+    # Return the blueprint to register in Flask app
+    return blueprint
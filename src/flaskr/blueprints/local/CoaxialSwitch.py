@@ -32,9 +32,9 @@ from ...modules.pyCoaxialSwitch import CoaxialSwitch
 blueprint = Blueprint('CoaxialSwitch', __name__, url_prefix='/coaxial_switch')
 
 class localCoaxialSwitch():
-    def __init__(self, device_present: bool = True):
-        # Instantiate a ParallelPort resource
-        self.switch = CoaxialSwitch()
+    def __init__(self, device_present: bool = True, device: CoaxialSwitch = None):
+        # Use the shared device instance or instantiate a ParallelPort resource
+        self.switch = device if device is not None else CoaxialSwitch()
 
     # Authorization check
     @blueprint.before_request
@@ -26,15 +26,17 @@ __version__ = "v0.1"
 from flask import Blueprint, request, jsonify
 from ...config import API_KEY
 from hashlib import sha256
+from .helpers import requested_max_age, age_header
 from ...modules.pyILM import ILM
 
 # Blueprint is a global variable
 blueprint = Blueprint('ILM', __name__, url_prefix='/ilm')
 
 class localILM():
-    def __init__(self, device_present: bool = False):
-        # Instantiate a VISA resource; ILM class implements various VISA queries as class methods
-        self.ilm = ILM(device_present=device_present)
+    def __init__(self, device_present: bool = False, device: ILM = None):
+        # Use the shared device instance (one I/O worker per instrument) or instantiate a VISA resource;
+        # ILM class implements various VISA queries as class methods
+        self.ilm = device if device is not None else ILM(device_present=device_present)
         
     # Authorization check
     @blueprint.before_request
@@ -75,19 +77,19 @@ class localILM():
         
         @blueprint.route('/get_lhe_level', methods=['GET', 'POST'])
         def get_LHe_level():
-            response_value = self.ilm.get_LHe_level()
+            response_value, age = self.ilm.cache.fetch(self.ilm.get_LHe_level, requested_max_age())
             if request.method == 'POST':            
-                return jsonify({'LHe_level': response_value}), 200
+                return jsonify({'LHe_level': response_value, 'age': age}), 200, age_header(age)
             elif request.method == 'GET':
-                return str(response_value), 200
+                return str(response_value), 200, age_header(age)
             
         @blueprint.route('/get_ln2_level', methods=['GET', 'POST'])
         def get_LN2_level():
-            response_value = self.ilm.get_LN2_level()
+            response_value, age = self.ilm.cache.fetch(self.ilm.get_LN2_level, requested_max_age())
             if request.method == 'POST':
-                return jsonify({'LN2_level': response_value}), 200
+                return jsonify({'LN2_level': response_value, 'age': age}), 200, age_header(age)
             elif request.method == 'GET':
-                return str(response_value), 200         
+                return str(response_value), 200, age_header(age)
 
         # Return blueprint to register in Flask app
         return blueprint
@@ -23,18 +23,21 @@ __version__ = "v0.1"
 #  You should have received a copy of the GNU General Public License along with this program. If not,
 #  see <https://www.gnu.org/licenses/>.
 
-from flask import Blueprint, request, jsonify
+from flask import Blueprint, request, jsonify, current_app
 from ...config import API_KEY
 from hashlib import sha256
-from ...modules.pyIPS120 import IPS120
+from .helpers import requested_max_age, age_header
+from ..negotiation import preferred_format, columns_response, JSON
+from ...modules.pyIPS120 import IPS120, SESSION_METHODS
 
 # Blueprint is a global variable
 blueprint = Blueprint('IPS120', __name__, url_prefix='/ips120')
 
 class localIPS120():
-    def __init__(self, device_present: bool = False):
-        # Instantiate a VISA resource; IPS120 class implements various VISA queries as class methods
-        self.ips = IPS120(device_present=device_present)
+    def __init__(self, device_present: bool = False, device: IPS120 = None):
+        # Use the shared device instance (one I/O worker per instrument) or instantiate a VISA resource;
+        # IPS120 class implements various VISA queries as class methods
+        self.ips = device if device is not None else IPS120(device_present=device_present)
         
     # Authorization check
     @blueprint.before_request
@@ -75,131 +78,139 @@ class localIPS120():
 
         @blueprint.route('/get_output_current', methods=['GET', 'POST'])
         def get_output_current():
-            response_value = self.ips.get_output_current()
+            response_value, age = self.ips.cache.fetch(self.ips.get_output_current, requested_max_age())
             if request.method == 'POST':            
-                return jsonify({'output_current': response_value}), 200
+                return jsonify({'output_current': response_value, 'age': age}), 200, age_header(age)
             elif request.method == 'GET':
-                return str(response_value), 200
+                return str(response_value), 200, age_header(age)
             
         @blueprint.route('/get_magnet_current', methods=['GET', 'POST'])
         def get_magnet_current():
-            response_value = self.ips.get_magnet_current()
+            response_value, age = self.ips.cache.fetch(self.ips.get_magnet_current, requested_max_age())
             if request.method == 'POST':
-                return jsonify({'magnet_current': response_value}), 200
+                return jsonify({'magnet_current': response_value, 'age': age}), 200, age_header(age)
             elif request.method == 'GET':
-                return str(response_value), 200
+                return str(response_value), 200, age_header(age)
             
         @blueprint.route('/get_setpoint_current', methods=['GET', 'POST'])
         def get_setpoint_current():
-            response_value = self.ips.get_setpoint_current()
+            response_value, age = self.ips.cache.fetch(self.ips.get_setpoint_current, requested_max_age())
             if request.method == 'POST':
-                return jsonify({'setpoint_current': response_value}), 200
+                return jsonify({'setpoint_current': response_value, 'age': age}), 200, age_header(age)
             elif request.method == 'GET':
-                return str(response_value), 200
+                return str(response_value), 200, age_header(age)
 
         @blueprint.route('/get_sweep_rate_current', methods=['GET', 'POST'])
         def get_sweep_rate_current():
-            response_value = self.ips.get_sweep_rate_current()
+            response_value, age = self.ips.cache.fetch(self.ips.get_sweep_rate_current, requested_max_age())
             if request.method == 'POST':
-                return jsonify({'sweep_rate_current': response_value}), 200
+                return jsonify({'sweep_rate_current': response_value, 'age': age}), 200, age_header(age)
             elif request.method == 'GET':
-                return str(response_value), 200
+                return str(response_value), 200, age_header(age)
 
         @blueprint.route('/get_output_field', methods=['GET', 'POST'])
         def get_output_field():
-            response_value = self.ips.get_output_field()
+            response_value, age = self.ips.cache.fetch(self.ips.get_output_field, requested_max_age())
             if request.method == 'POST':
-                return jsonify({"output_field": response_value}), 200
+                return jsonify({"output_field": response_value, 'age': age}), 200, age_header(age)
             elif request.method == 'GET':
-                return str(response_value), 200
+                return str(response_value), 200, age_header(age)
     
         @blueprint.route('/get_setpoint_field', methods=['GET', 'POST'])
         def get_setpoint_field():
-            response_value = self.ips.get_setpoint_field()
+            response_value, age = self.ips.cache.fetch(self.ips.get_setpoint_field, requested_max_age())
             if request.method == 'POST':
-                return jsonify({"setpoint_field": response_value}), 200
+                return jsonify({"setpoint_field": response_value, 'age': age}), 200, age_header(age)
             elif request.method == 'GET':
-                return str(response_value), 200
+                return str(response_value), 200, age_header(age)
         
         @blueprint.route('/get_sweep_rate_field', methods=['GET', 'POST'])
         def get_sweep_rate_field():
-            response_value = self.ips.get_sweep_rate_field()
+            response_value, age = self.ips.cache.fetch(self.ips.get_sweep_rate_field, requested_max_age())
             if request.method == 'POST':
-                return jsonify({"sweep_rate_field": response_value}), 200
+                return jsonify({"sweep_rate_field": response_value, 'age': age}), 200, age_header(age)
             elif request.method == 'GET':
-                return str(response_value), 200
+                return str(response_value), 200, age_header(age)
             
         @blueprint.route('/get_persistent_current', methods=['GET', 'POST'])
         def get_persistent_current():
-            response_value = self.ips.get_persistent_current()
+            response_value, age = self.ips.cache.fetch(self.ips.get_persistent_current, requested_max_age())
             if request.method == 'POST':
-                return jsonify({"persistent_current": response_value}), 200
+                return jsonify({"persistent_current": response_value, 'age': age}), 200, age_header(age)
             elif request.method == 'GET':
-                return str(response_value), 200
+                return str(response_value), 200, age_header(age)
             
         @blueprint.route('/get_persistent_field', methods=['GET', 'POST'])
         def get_persistent_field():
-            response_value = self.ips.get_persistent_field()
+            response_value, age = self.ips.cache.fetch(self.ips.get_persistent_field, requested_max_age())
             if request.method == 'POST':
-                return jsonify({"persistent_current": response_value}), 200
+                return jsonify({"persistent_current": response_value, 'age': age}), 200, age_header(age)
             elif request.method == 'GET':
-                return str(response_value), 200
+                return str(response_value), 200, age_header(age)
             
         @blueprint.route('/get_heater_current', methods=['GET', 'POST'])
         def get_heater_current():
-            response_value = self.ips.get_heater_current()
+            response_value, age = self.ips.cache.fetch(self.ips.get_heater_current, requested_max_age())
             if request.method == 'POST':
-                return jsonify({"heater_current": response_value}), 200
+                return jsonify({"heater_current": response_value, 'age': age}), 200, age_header(age)
             elif request.method == 'GET':
-                return str(response_value), 200
+                return str(response_value), 200, age_header(age)
             
         @blueprint.route('/get_status', methods=['GET', 'POST'])
         def get_status():
-            response_value = self.ips.get_status()
+            response_value, age = self.ips.cache.fetch(self.ips.get_status, requested_max_age())
             if request.method == 'POST':
-                return jsonify(response_value), 200
+                return jsonify(dict(response_value, age=age)), 200, age_header(age)
             elif request.method == 'GET':
-                return '\n'.join([f'{key}: {value}' for key, value in response_value.items()]), 200
+                return '\n'.join([f'{key}: {value}' for key, value in response_value.items()]), 200, age_header(age)
         
+        @blueprint.route('/get_snapshot', methods=['GET', 'POST'])
+        def get_snapshot():
+            response_value, age = self.ips.cache.fetch(self.ips.get_snapshot, requested_max_age())
+            if request.method == 'POST':
+                return jsonify(dict(response_value, age=age)), 200, age_header(age)
+            elif request.method == 'GET':
+                return '\n'.join([f'{key}: {value}' for key, value in response_value.items()]), 200, age_header(age)
+
         @blueprint.route('/get_is_heater_on', methods=['GET', 'POST'])
         def get_is_heater_on():
-            response_value = self.ips.get_is_heater_on()
+            response_value, age = self.ips.cache.fetch(self.ips.get_is_heater_on, requested_max_age())
             if request.method == 'POST':
-                return jsonify({"is_heater_on": response_value}), 200
+                return jsonify({"is_heater_on": response_value, 'age': age}), 200, age_header(age)
             elif request.method == 'GET':
-                return str(response_value), 200
+                return str(response_value), 200, age_header(age)
             
         @blueprint.route('/get_is_on_hold', methods=['GET', 'POST'])
         def get_is_on_hold():
-            response_value = self.ips.get_is_on_hold()
+            response_value, age = self.ips.cache.fetch(self.ips.get_is_on_hold, requested_max_age())
             if request.method == 'POST':
-                return jsonify({"is_on_hold": response_value}), 200
+                return jsonify({"is_on_hold": response_value, 'age': age}), 200, age_header(age)
             elif request.method == 'GET':
-                return str(response_value), 200
+                return str(response_value), 200, age_header(age)
             
         @blueprint.route('/get_is_going_to_setpoint', methods=['GET', 'POST'])
         def get_is_going_to_setpoint():
-            response_value = self.ips.get_is_going_to_setpoint()
+            response_value, age = self.ips.cache.fetch(self.ips.get_is_going_to_setpoint, requested_max_age())
             if request.method == 'POST':
-                return jsonify({"is_going_to_setpoint": response_value}), 200
+                return jsonify({"is_going_to_setpoint": response_value, 'age': age}), 200, age_header(age)
             elif request.method == 'GET':
-                return str(response_value), 200
+                return str(response_value), 200, age_header(age)
             
         @blueprint.route('/get_is_going_to_zero', methods=['GET', 'POST'])
         def get_is_going_to_zero():
-            response_value = self.ips.get_is_going_to_zero()
+            response_value, age = self.ips.cache.fetch(self.ips.get_is_going_to_zero, requested_max_age())
             if request.method == 'POST':
-                return jsonify({"is_going_to_zero": response_value}), 200
+                return jsonify({"is_going_to_zero": response_value, 'age': age}), 200, age_header(age)
             elif request.method == 'GET':
-                return str(response_value), 200
+                return str(response_value), 200, age_header(age)
             
         @blueprint.route('/get_is_clamped', methods=['GET', 'POST'])
         def get_is_clamped():
-            response_value = self.ips.get_is_clamped()
+            response_value, age = self.ips.cache.fetch(self.ips.get_is_clamped, requested_max_age())
             if request.method == 'POST':
-                return jsonify({"is_clamped": response_value}), 200
+                return jsonify({"is_clamped": response_value, 'age': age}), 200, age_header(age)
             elif request.method == 'GET':
-                return str(response_value), 200
+                return str(response_value), 200, age_header(age)
             
         @blueprint.route('/set_heater', methods=['GET', 'PUT', 'POST'])
         def set_heater():
@@ -288,6 +299,17 @@ class localIPS120():
                 self.ips.set_sweep_rate_field(float(request.args['sweep_rate_field']))
                 return str(), 200
             
+        @blueprint.route('/apply_session', methods=['POST'])
+        def apply_session():
+            # Ordered setters applied in one remote control session (one C1 ... C0)
+            steps = request.json['steps']
+            unknown = [step.get('method') for step in steps if step.get('method') not in SESSION_METHODS]
+            if unknown:
+                return jsonify({'error': f'Not allowed in a session: {", ".join(map(str, unknown))}',
+                                'allowed': list(SESSION_METHODS)}), 400
+            self.ips.apply_session(steps)
+            return jsonify({}), 200
+
         @blueprint.route('/set_magnet_field', methods=['GET', 'PUT', 'POST'])
         def set_magnet_field():
             if request.method == 'POST':
@@ -310,5 +332,26 @@ class localIPS120():
                                                      float(request.args['ramp_rate']))
                 return str(), 200
             
+        @blueprint.route('/run_field_profile', methods=['POST'])
+        def run_field_profile():
+            # Runs as a job (see /jobs): returns at once, the job reports the running segment and can be cancelled
+            job = current_app.jobs.submit('IPS120', 'run_field_profile', self.ips.run_field_profile,
+                                          list(request.json['segments']), request.json.get('tolerance'),
+                                          request.json.get('sample_interval'))
+            return jsonify(job.to_dict()), 202
+
+        @blueprint.route('/get_profile_log', methods=['GET', 'POST'])
+        def get_profile_log():
+            # Samples of the last (or running) field profile from sample index start on
+            parameters = (request.json or {}) if request.method == 'POST' else request.args
+            columns = self.ips.profile_log.columns(int(parameters.get('start', 0)))
+            if preferred_format() != JSON:
+                return columns_response(columns)
+            if request.method == 'POST':
+                return jsonify({name: column.tolist() for name, column in columns.items()}), 200
+            elif request.method == 'GET':
+                rows = zip(*[column.tolist() for column in columns.values()])
+                return '\n'.join(['\t'.join(columns.keys())] + ['\t'.join(str(value) for value in row) for row in rows]), 200
+
         # Return blueprint to register in Flask app
         return blueprint
@@ -23,18 +23,107 @@ __version__ = "v0.1"
 #  You should have received a copy of the GNU General Public License along with this program. If not,
 #  see <https://www.gnu.org/licenses/>.
 
-from flask import Blueprint, request, jsonify
+from flask import Blueprint, Response, request, jsonify
+from prometheus_client import Counter
+from threading import Thread, Event
+import queue
+import struct
+import time
 from ...config import API_KEY
 from hashlib import sha256
-from ...modules.pyKeysightE5080A import KeysightE5080A
+from .helpers import requested_max_age, age_header
+from ..negotiation import preferred_format, columns_response, JSON
+from ...modules.pyKeysightE5080A import KeysightE5080A, sweep_windows
 
 # Blueprint is a global variable
 blueprint = Blueprint('KeysightE5080A', __name__, url_prefix='/keysighte5080a')
 
+streamed_frames = Counter('vna_stream_frames', 'Traces sent to streaming clients')
+dropped_frames = Counter('vna_stream_dropped_frames', 'Traces dropped because a streaming client was too slow')
+
+# Stream frame header: kind, number of points, sequence number, timestamp; followed by float64 frequencies [MHz]
+# (kind b'FREQ'), complex128 S11 data (b'DATA') or a UTF-8 error message (b'ERR ', number of bytes), all little-endian
+FRAME_HEADER = struct.Struct('<4sIQd')
+
+def trace_frame(kind: bytes, sequence: int, values) -> bytes:
+    data = values.astype(values.dtype.newbyteorder('<'), copy=False).tobytes()
+    return FRAME_HEADER.pack(kind, len(values), sequence, time.time()) + data
+
+def error_frame(sequence: int, error: Exception) -> bytes:
+    message = f'{type(error).__name__}: {error}'.encode()
+    return FRAME_HEADER.pack(b'ERR ', len(message), sequence, time.time()) + message
+
+class TraceStream:
+    """ Acquires triggered sweeps on a background thread and keeps only the latest trace for a streaming client """
+    def __init__(self, VNA: KeysightE5080A, max_frames: int = None):
+        self.VNA = VNA
+        self.max_frames = max_frames
+        # Latest trace only: a slow client drops frames instead of stalling the instrument
+        self.frames = queue.Queue(maxsize=1)
+        self.stopped = Event()
+
+    def produce(self):
+        try:
+            sequence = 1
+            while not self.stopped.is_set() and (self.max_frames is None or sequence <= self.max_frames):
+                frame = (sequence, self.VNA.acquire_trace())
+                try:
+                    self.frames.put_nowait(frame)
+                except queue.Full:
+                    try:
+                        self.frames.get_nowait()
+                        dropped_frames.inc()
+                    except queue.Empty:
+                        pass
+                    self.frames.put_nowait(frame)
+                sequence += 1
+        except Exception as error:
+            # Error replaces an unsent trace
+            try:
+                self.frames.get_nowait()
+            except queue.Empty:
+                pass
+            self.frames.put(error)
+        else:
+            # End of stream after the last trace is sent (or the client disconnects)
+            while not self.stopped.is_set():
+                try:
+                    self.frames.put(None, timeout=1)
+                    return
+                except queue.Full:
+                    pass
+
+    def start(self):
+        # Sweep configuration is read once per stream, frames carry only the trace
+        self.frequencies = self.VNA.read_frequencies()
+
+    def generate(self):
+        # Triggered sweeps only once the response is actually streamed: finally below always releases them
+        self.VNA.hold_single_sweeps()
+        try:
+            yield trace_frame(b'FREQ', 0, self.frequencies)
+            Thread(target=self.produce, name='VNA trace stream', daemon=True).start()
+            sequence = 0
+            while True:
+                item = self.frames.get()
+                if item is None:
+                    break
+                elif isinstance(item, Exception):
+                    yield error_frame(sequence + 1, item)
+                    break
+                sequence, trace = item
+                streamed_frames.inc()
+                yield trace_frame(b'DATA', sequence, trace)
+        finally:
+            # Client disconnected or stream finished
+            self.stopped.set()
+            self.VNA.release_single_sweeps()
+
 class localKeysightE5080A():
-    def __init__(self, device_present: bool = False):
-        # Instantiate a VISA resource; KeysightE5080A class implements various VISA queries as class methods
-        self.VNA = KeysightE5080A(device_present=device_present)
+    def __init__(self, device_present: bool = False, device: KeysightE5080A = None):
+        # Use the shared device instance (one I/O worker per instrument) or instantiate a VISA resource;
+        # KeysightE5080A class implements various VISA queries as class methods
+        self.VNA = device if device is not None else KeysightE5080A(device_present=device_present)
         
     # Authorization check
     @blueprint.before_request
@@ -76,92 +165,170 @@ class localKeysightE5080A():
         @blueprint.route('/get_marker_X', methods=['GET', 'POST'])
         def get_marker_X():
             if request.method == 'POST':
-                response_value = self.VNA.get_marker_X(int(request.json['marker_index']))
-                return jsonify({'frequency': response_value}), 200
+                response_value, age = self.VNA.cache.fetch(self.VNA.get_marker_X, requested_max_age(), int(request.json['marker_index']))
+                return jsonify({'frequency': response_value, 'age': age}), 200, age_header(age)
             elif request.method == 'GET':
-                response_value = self.VNA.get_marker_X(int(request.args['marker_index']))
-                return str(response_value), 200
+                response_value, age = self.VNA.cache.fetch(self.VNA.get_marker_X, requested_max_age(), int(request.args['marker_index']))
+                return str(response_value), 200, age_header(age)
             
         @blueprint.route('/get_marker_Y', methods=['GET', 'POST'])
         def get_marker_Y():
             if request.method == 'POST':
-                response_value = self.VNA.get_marker_Y(int(request.json['marker_index']))
-                return jsonify({'amplitude': response_value}), 200
+                response_value, age = self.VNA.cache.fetch(self.VNA.get_marker_Y, requested_max_age(), int(request.json['marker_index']))
+                return jsonify({'amplitude': response_value, 'age': age}), 200, age_header(age)
             elif request.method == 'GET':
-                response_value = self.VNA.get_marker_Y(int(request.args['marker_index']))
-                return str(response_value), 200
+                response_value, age = self.VNA.cache.fetch(self.VNA.get_marker_Y, requested_max_age(), int(request.args['marker_index']))
+                return str(response_value), 200, age_header(age)
             
         @blueprint.route('/get_marker_Y_at', methods=['GET', 'POST'])
         def get_marker_Y_at():
             if request.method == 'POST':
-                response_value = self.VNA.get_marker_Y_at(int(request.json['marker_index']),
-                                                          float(request.json['frequency']))
-                return jsonify({'amplitude': response_value}), 200
+                response_value, age = self.VNA.cache.fetch(self.VNA.get_marker_Y_at, requested_max_age(), int(request.json['marker_index']),
+                                                           float(request.json['frequency']))
+                return jsonify({'amplitude': response_value, 'age': age}), 200, age_header(age)
             elif request.method == 'GET':
-                response_value = self.VNA.get_marker_Y_at(int(request.args['marker_index']),
-                                                          float(request.args['frequency']))
-                return str(response_value), 200
+                response_value, age = self.VNA.cache.fetch(self.VNA.get_marker_Y_at, requested_max_age(), int(request.args['marker_index']),
+                                                           float(request.args['frequency']))
+                return str(response_value), 200, age_header(age)
 
         @blueprint.route('/get_minimum', methods=['GET', 'POST'])
         def get_minimum():
             if request.method == 'POST':
-                response_value = self.VNA.get_minimum(int(request.json['marker_index']))
-                return jsonify({'frequency': response_value}), 200
+                response_value, age = self.VNA.cache.fetch(self.VNA.get_minimum, requested_max_age(), int(request.json['marker_index']))
+                return jsonify({'frequency': response_value, 'age': age}), 200, age_header(age)
             elif request.method == 'GET':
-                response_value = self.VNA.get_minimum(int(request.args['marker_index']))
-                return str(response_value), 200
+                response_value, age = self.VNA.cache.fetch(self.VNA.get_minimum, requested_max_age(), int(request.args['marker_index']))
+                return str(response_value), 200, age_header(age)
 
         @blueprint.route('/get_sweep_points', methods=['GET', 'POST'])
         def get_sweep_points():
-            response_value = self.VNA.get_sweep_points()
+            response_value, age = self.VNA.cache.fetch(self.VNA.get_sweep_points, requested_max_age())
             if request.method == 'POST':
-                return jsonify({"points": response_value}), 200
+                return jsonify({"points": response_value, 'age': age}), 200, age_header(age)
             elif request.method == 'GET':
-                return str(response_value), 200
+                return str(response_value), 200, age_header(age)
     
         @blueprint.route('/get_Q', methods=['GET', 'POST'])
         def get_Q():
             if request.method == 'POST':
-                response_value = self.VNA.get_Q(int(request.json['marker_index']))
-                return jsonify({"q": response_value}), 200
+                response_value, age = self.VNA.cache.fetch(self.VNA.get_Q, requested_max_age(), int(request.json['marker_index']))
+                return jsonify({"q": response_value, 'age': age}), 200, age_header(age)
             elif request.method == 'GET':
-                response_value = self.VNA.get_Q(int(request.args['marker_index']))
-                return str(response_value), 200
+                response_value, age = self.VNA.cache.fetch(self.VNA.get_Q, requested_max_age(), int(request.args['marker_index']))
+                return str(response_value), 200, age_header(age)
         
         @blueprint.route('/get_sweep_range', methods=['GET', 'POST'])
         def get_sweep_range():
-            response_value = self.VNA.get_sweep_range()
+            response_value, age = self.VNA.cache.fetch(self.VNA.get_sweep_range, requested_max_age())
             if request.method == 'POST':
                 return jsonify({"start": response_value[0],
-                                "stop": response_value[1]}), 200
+                                "stop": response_value[1], 'age': age}), 200, age_header(age)
             elif request.method == 'GET':
-                return str(response_value), 200
+                return str(response_value), 200, age_header(age)
             
         @blueprint.route('/get_filter', methods=['GET', 'POST'])
         def get_filter():
             if request.method == 'POST':
-                response_value = self.VNA.get_filter(int(request.json['marker_index']),
-                                                     float(request.json['threshold']))
+                response_value, age = self.VNA.cache.fetch(self.VNA.get_filter, requested_max_age(), int(request.json['marker_index']),
+                                                           float(request.json['threshold']))
                 return jsonify({"bandwidth": response_value[0],
                                 "center": response_value[1],
                                 "q": response_value[2],
-                                "insertion_loss": response_value[3]}), 200
+                                "insertion_loss": response_value[3], 'age': age}), 200, age_header(age)
             elif request.method == 'GET':
-                response_value = self.VNA.get_filter(int(request.args['marker_index']),
-                                                     float(request.args['threshold']))
-                return str(response_value), 200
+                response_value, age = self.VNA.cache.fetch(self.VNA.get_filter, requested_max_age(), int(request.args['marker_index']),
+                                                           float(request.args['threshold']))
+                return str(response_value), 200, age_header(age)
             
         @blueprint.route('/get_complex_data', methods=['GET', 'POST'])
         def get_complex_data():
-            response_value = self.VNA.get_complex_data()
+            if preferred_format() != JSON:
+                # MessagePack, columnar JSON or .npy: columns straight from NumPy arrays
+                (frequencies, complex_data), age = self.VNA.cache.fetch(self.VNA.get_complex_array, requested_max_age())
+                return columns_response({'frequency': frequencies,
+                                         'real': complex_data.real,
+                                         'imag': complex_data.imag}, 200, age_header(age))
+            response_value, age = self.VNA.cache.fetch(self.VNA.get_complex_data, requested_max_age())
             if request.method == 'POST':
                 return jsonify([{'frequency': point[0],
                                  'real': point[1].real,
-                                 'imag': point[1].imag} for point in response_value]), 200
+                                 'imag': point[1].imag} for point in response_value]), 200, age_header(age)
             elif request.method == 'GET':
                 output_string = '\n'.join([f"{point[0]:.2f}\t{point[1]}" for point in response_value])
-                return output_string, 200
+                return output_string, 200, age_header(age)
         
+        @blueprint.route('/get_averaged_data', methods=['GET', 'POST'])
+        def get_averaged_data():
+            # Average of count triggered sweeps, optionally binned: one array instead of count full traces
+            parameters = request.json if request.method == 'POST' else request.args
+            # Fresh sweeps every time: large traces with arbitrary arguments are not kept in the telemetry cache
+            frequencies, complex_data = self.VNA.get_averaged_array(int(parameters['count']),
+                                                                    int(parameters.get('bin_size', 1)))
+            age = 0.0
+            if preferred_format() != JSON:
+                return columns_response({'frequency': frequencies,
+                                         'real': complex_data.real,
+                                         'imag': complex_data.imag}, 200, age_header(age))
+            if request.method == 'POST':
+                return jsonify([{'frequency': frequency,
+                                 'real': value.real,
+                                 'imag': value.imag} for frequency, value in zip(frequencies.tolist(),
+                                                                                 complex_data.tolist())]), 200, age_header(age)
+            elif request.method == 'GET':
+                output_string = '\n'.join([f"{frequency:.2f}\t{value}" for frequency, value in zip(frequencies.tolist(),
+                                                                                                complex_data.tolist())])
+                return output_string, 200, age_header(age)
+
+        @blueprint.route('/get_stitched_data', methods=['GET', 'POST'])
+        def get_stitched_data():
+            # Wide-band scan: explicit segments [[start, stop, points], ...] (POST) or equal windows
+            parameters = request.json if request.method == 'POST' else request.args
+            if 'segments' in parameters and not isinstance(parameters['segments'], (str, int)):
+                segments = [(float(start), float(stop), int(points)) for start, stop, points in parameters['segments']]
+            else:
+                segments = sweep_windows(float(parameters['start']), float(parameters['stop']),
+                                         int(parameters['segments']), int(parameters['points']))
+            frequencies, complex_data = self.VNA.get_stitched_array(segments)
+            age = 0.0
+            if preferred_format() != JSON:
+                return columns_response({'frequency': frequencies,
+                                         'real': complex_data.real,
+                                         'imag': complex_data.imag}, 200, age_header(age))
+            if request.method == 'POST':
+                return jsonify([{'frequency': frequency,
+                                 'real': value.real,
+                                 'imag': value.imag} for frequency, value in zip(frequencies.tolist(),
+                                                                                 complex_data.tolist())]), 200, age_header(age)
+            elif request.method == 'GET':
+                output_string = '\n'.join([f"{frequency:.2f}\t{value}" for frequency, value in zip(frequencies.tolist(),
+                                                                                                complex_data.tolist())])
+                return output_string, 200, age_header(age)
+
+        @blueprint.route('/analyze_trace', methods=['GET', 'POST'])
+        def analyze_trace():
+            # Minimum, notch, filter and virtual markers computed from one (cached) trace
+            parameters = request.json if request.method == 'POST' else request.args
+            markers = parameters.get('markers', [])
+            if isinstance(markers, str):
+                markers = [marker for marker in markers.split(',') if marker.strip()]
+            analysis, age = self.VNA.get_trace_analysis(requested_max_age())
+            response_value = analysis.analyze([float(marker) for marker in markers],
+                                              float(parameters.get('notch_threshold', -13)),
+                                              float(parameters.get('filter_threshold', 0.5)))
+            if request.method == 'POST':
+                return jsonify({**response_value, 'age': age}), 200, age_header(age)
+            elif request.method == 'GET':
+                return str(response_value), 200, age_header(age)
+
+        @blueprint.route('/stream_traces', methods=['GET', 'POST'])
+        def stream_traces():
+            # Chunked binary stream of triggered sweeps (see FRAME_HEADER), optionally limited to max_frames traces
+            parameters = request.json if request.method == 'POST' else request.args
+            max_frames = int(parameters['max_frames']) if parameters.get('max_frames') is not None else None
+            stream = TraceStream(self.VNA, max_frames)
+            stream.start()
+            return Response(stream.generate(), mimetype='application/octet-stream')
+
         @blueprint.route('/set_marker_X', methods=['GET', 'PUT', 'POST'])
         def set_marker_X():
             if request.method == 'POST':
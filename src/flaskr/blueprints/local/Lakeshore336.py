@@ -27,15 +27,17 @@ from flask import Blueprint, request, jsonify
 from prometheus_client import Gauge, Enum
 from ...config import API_KEY
 from hashlib import sha256
+from .helpers import requested_max_age, age_header
 from ...modules.pyLakeshore336 import Lakeshore336
 
 # Blueprint is a global variable
 blueprint = Blueprint('Lakeshore336', __name__, url_prefix='/lakeshore336')
 
 class localLakeshore336():
-    def __init__(self, device_present: bool = False):
-        # Instantiate a VISA resource; KeysightE5080A class implements various VISA queries as class methods
-        self.ls = Lakeshore336(device_present=device_present)
+    def __init__(self, device_present: bool = False, device: Lakeshore336 = None):
+        # Use the shared device instance (one I/O worker per instrument) or instantiate a VISA resource;
+        # Lakeshore336 class implements various VISA queries as class methods
+        self.ls = device if device is not None else Lakeshore336(device_present=device_present)
 
     # Authorization check
     @blueprint.before_request
@@ -77,88 +79,96 @@ class localLakeshore336():
         @blueprint.route('/get_temperature', methods=['GET', 'POST'])
         def get_temperature():
             if request.method == 'POST':
-                response_value = self.ls.get_temperature(str(request.json['control_channel']))
-                return jsonify({'temperature': response_value}), 200
+                response_value, age = self.ls.cache.fetch(self.ls.get_temperature, requested_max_age(), str(request.json['control_channel']))
+                return jsonify({'temperature': response_value, 'age': age}), 200, age_header(age)
             elif request.method == 'GET':
-                response_value = self.ls.get_temperature(str(request.args['control_channel']))
-                return str(response_value), 200
+                response_value, age = self.ls.cache.fetch(self.ls.get_temperature, requested_max_age(), str(request.args['control_channel']))
+                return str(response_value), 200, age_header(age)
             
             
         @blueprint.route('/get_sensor', methods=['GET', 'POST'])
         def get_sensor():
             if request.method == 'POST':
-                response_value = self.ls.get_sensor(str(request.json['control_channel']))
-                return jsonify({'sensor': response_value}), 200
+                response_value, age = self.ls.cache.fetch(self.ls.get_sensor, requested_max_age(), str(request.json['control_channel']))
+                return jsonify({'sensor': response_value, 'age': age}), 200, age_header(age)
             elif request.method == 'GET':
-                response_value = self.ls.get_sensor(str(request.args['control_channel']))
-                return str(response_value), 200
+                response_value, age = self.ls.cache.fetch(self.ls.get_sensor, requested_max_age(), str(request.args['control_channel']))
+                return str(response_value), 200, age_header(age)
             
         @blueprint.route('/get_setpoint', methods=['GET', 'POST'])
         def get_setpoint():
             if request.method == 'POST':
-                response_value = self.ls.set_setpoint(int(request.json['control_loop']))
-                return jsonify({'setpoint': response_value}), 200
+                response_value, age = self.ls.cache.fetch(self.ls.get_setpoint, requested_max_age(), int(request.json['control_loop']))
+                return jsonify({'setpoint': response_value, 'age': age}), 200, age_header(age)
             elif request.method == 'GET':
-                response_value = self.ls.get_setpoint(int(request.args['control_loop']))
-                return str(response_value), 200
+                response_value, age = self.ls.cache.fetch(self.ls.get_setpoint, requested_max_age(), int(request.args['control_loop']))
+                return str(response_value), 200, age_header(age)
 
         @blueprint.route('/get_heater_range', methods=['GET', 'POST'])
         def get_heater_range():
             sdict = {0: 'Off', 1: 'Low', 2: 'Medium', 3: 'High'}
             if request.method == 'POST':
-                response_value = self.ls.get_heater_range(int(request.json['control_loop']))
-                return jsonify({'range_index': response_value}), 200
+                response_value, age = self.ls.cache.fetch(self.ls.get_heater_range, requested_max_age(), int(request.json['control_loop']))
+                return jsonify({'range_index': response_value, 'age': age}), 200, age_header(age)
             elif request.method == 'GET':
-                response_value = self.ls.get_heater_range(int(request.args['control_loop']))
-                return str(response_value), 200
+                response_value, age = self.ls.cache.fetch(self.ls.get_heater_range, requested_max_age(), int(request.args['control_loop']))
+                return str(response_value), 200, age_header(age)
 
         @blueprint.route('/get_heater_percent', methods=['GET', 'POST'])
         def get_heater_percent():
             if request.method == 'POST':
-                response_value = self.ls.get_heater_percent(int(request.json['control_loop']))
-                return jsonify({"percent": response_value}), 200
+                response_value, age = self.ls.cache.fetch(self.ls.get_heater_percent, requested_max_age(), int(request.json['control_loop']))
+                return jsonify({"percent": response_value, 'age': age}), 200, age_header(age)
             elif request.method == 'GET':
-                response_value = self.ls.get_heater_percent(int(request.args['control_loop']))
-                return str(response_value), 200
+                response_value, age = self.ls.cache.fetch(self.ls.get_heater_percent, requested_max_age(), int(request.args['control_loop']))
+                return str(response_value), 200, age_header(age)
     
         @blueprint.route('/get_heater_percent_fullrange', methods=['GET', 'POST'])
         def get_heater_percent_fullrange():
             if request.method == 'POST':
-                response_value = self.ls.get_heater_percent_fullrange(int(request.json['control_loop']))
-                return jsonify({"percent_fullrange": response_value}), 200
+                response_value, age = self.ls.cache.fetch(self.ls.get_heater_percent_fullrange, requested_max_age(), int(request.json['control_loop']))
+                return jsonify({"percent_fullrange": response_value, 'age': age}), 200, age_header(age)
             elif request.method == 'GET':
-                response_value = self.ls.get_heater_percent_fullrange(int(request.args['control_loop']))
-                return str(response_value), 200
+                response_value, age = self.ls.cache.fetch(self.ls.get_heater_percent_fullrange, requested_max_age(), int(request.args['control_loop']))
+                return str(response_value), 200, age_header(age)
         
         @blueprint.route('/get_pid', methods=['GET', 'POST'])
         def get_pid():
             if request.method == 'POST':
-                response_value = self.ls.get_PID(int(request.json['control_loop']))
+                response_value, age = self.ls.cache.fetch(self.ls.get_PID, requested_max_age(), int(request.json['control_loop']))
                 return jsonify({"P": response_value[0],
                                 "I": response_value[1],
-                                "D": response_value[2]}), 200
+                                "D": response_value[2], 'age': age}), 200, age_header(age)
             elif request.method == 'GET':
-                response_value = self.ls.get_PID(int(request.args['control_loop']))
-                return f'{response_value[0]:.2f}, {response_value[1]:.2f}, {response_value[2]:.2f}', 200
+                response_value, age = self.ls.cache.fetch(self.ls.get_PID, requested_max_age(), int(request.args['control_loop']))
+                return f'{response_value[0]:.2f}, {response_value[1]:.2f}, {response_value[2]:.2f}', 200, age_header(age)
             
         @blueprint.route('/get_ramp_rate', methods=['GET', 'POST'])
         def get_ramp_rate():
             if request.method == 'POST':
-                response_value = self.ls.get_ramp_rate(int(request.json['control_loop']))
-                return jsonify({"ramp_rate": response_value}), 200
+                response_value, age = self.ls.cache.fetch(self.ls.get_ramp_rate, requested_max_age(), int(request.json['control_loop']))
+                return jsonify({"ramp_rate": response_value, 'age': age}), 200, age_header(age)
             elif request.method == 'GET':
-                response_value = self.ls.get_ramp_rate(int(request.args['control_loop']))
-                return str(response_value), 200
+                response_value, age = self.ls.cache.fetch(self.ls.get_ramp_rate, requested_max_age(), int(request.args['control_loop']))
+                return str(response_value), 200, age_header(age)
             
         @blueprint.route('/get_manual_output', methods=['GET', 'POST'])
         def get_manual_output():
             if request.method == 'POST':
-                response_value = self.ls.get_manual_output(int(request.json['control_loop']))
-                return jsonify({"manual_output": response_value}), 200
+                response_value, age = self.ls.cache.fetch(self.ls.get_manual_output, requested_max_age(), int(request.json['control_loop']))
+                return jsonify({"manual_output": response_value, 'age': age}), 200, age_header(age)
             elif request.method == 'GET':
-                response_value = self.ls.get_manual_output(int(request.args['control_loop']))
-                return str(response_value), 200
+                response_value, age = self.ls.cache.fetch(self.ls.get_manual_output, requested_max_age(), int(request.args['control_loop']))
+                return str(response_value), 200, age_header(age)
         
+        @blueprint.route('/get_snapshot', methods=['GET', 'POST'])
+        def get_snapshot():
+            response_value, age = self.ls.cache.fetch(self.ls.get_snapshot, requested_max_age())
+            if request.method == 'POST':
+                return jsonify(dict(response_value, age=age)), 200, age_header(age)
+            elif request.method == 'GET':
+                return str(response_value), 200, age_header(age)
+
         @blueprint.route('/set_setpoint', methods=['GET', 'PUT', 'POST'])
         def set_setpoint():
             if request.method == 'POST':
@@ -32,9 +32,9 @@ from ...modules.pyNanotecSMC import NanotecSMC
 blueprint = Blueprint('NanotecSMC', __name__, url_prefix='/nanotec_smc')
 
 class localNanotecSMC():
-    def __init__(self, device_present: bool = True):
-        # Instantiate a ParallelPort resource
-        self.smc = NanotecSMC()
+    def __init__(self, device_present: bool = True, device: NanotecSMC = None):
+        # Use the shared device instance or instantiate a ParallelPort resource
+        self.smc = device if device is not None else NanotecSMC()
 
     # Authorization check
     @blueprint.before_request
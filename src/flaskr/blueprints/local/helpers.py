@@ -0,0 +1,50 @@
+#!/usr/bin/env python
+
+"""
+
+Helper functions shared by local device blueprints.
+
+"""
+
+__author__ = "Ivan Jakovac"
+__email__ = "ivan.jakovac2@gmail.com"
+__version__ = "v0.1"
+
+#  Copyright (C) 2020-2025 Ivan Jakovac
+#
+#  This program is free software: you can redistribute it and/or modify it under the terms of the GNU General Public
+#  License as published by the Free Software Foundation, either version 3 of the License, or (at your option) any
+#  later version.
+#
+#  This program is distributed in the hope that it will be useful, but WITHOUT ANY WARRANTY; without even the implied
+#  warranty of MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License along with this program. If not,
+#  see <https://www.gnu.org/licenses/>.
+
+from flask import request, jsonify, make_response, abort
+
+def requested_max_age():
+    '''
+        Returns the oldest cached value age [s] accepted by the client (max_age parameter); None means that the
+        device is always queried. An invalid max_age aborts the request with 400.
+    '''
+    if request.method == 'POST' and request.is_json and isinstance(request.json, dict):
+        max_age = request.json.get('max_age')
+    else:
+        max_age = request.args.get('max_age')
+    if max_age is None:
+        return None
+    try:
+        max_age = float(max_age)
+    except (TypeError, ValueError):
+        max_age = float('nan')
+    if not max_age >= 0:
+        abort(make_response(jsonify({'error': 'max_age must be a non-negative number of seconds'}), 400))
+    return max_age
+
+def age_header(age: float) -> dict:
+    '''
+        Returns the HTTP header with the age [s] of the returned value
+    '''
+    return {'X-Data-Age': f'{age:.3f}'}
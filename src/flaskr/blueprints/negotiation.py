@@ -0,0 +1,110 @@
+#!/usr/bin/env python
+
+"""
+
+Content negotiation for all API responses. JSON responses are re-encoded in the format requested by the Accept header:
+MessagePack, columnar JSON (lists of records as parallel arrays) or NumPy .npy (array payloads only). Routes returning
+large arrays (e.g. VNA traces) can skip JSON entirely and pass their columns to columns_response().
+
+"""
+
+__author__ = "Ivan Jakovac"
+__email__ = "ivan.jakovac2@gmail.com"
+__version__ = "v0.1"
+
+#  Copyright (C) 2020-2025 Ivan Jakovac
+#
+#  This program is free software: you can redistribute it and/or modify it under the terms of the GNU General Public
+#  License as published by the Free Software Foundation, either version 3 of the License, or (at your option) any
+#  later version.
+#
+#  This program is distributed in the hope that it will be useful, but WITHOUT ANY WARRANTY; without even the implied
+#  warranty of MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License along with this program. If not,
+#  see <https://www.gnu.org/licenses/>.
+
+from flask import Response, request, json, jsonify
+import io
+import msgpack
+import numpy as np
+
+JSON = 'application/json'
+MSGPACK = 'application/msgpack'
+COLUMNAR = 'application/vnd.labapi.columnar+json'
+NPY = 'application/x-npy'
+FORMATS = [JSON, MSGPACK, COLUMNAR, NPY]
+
+def preferred_format() -> str:
+    """
+        Returns the response format requested by the Accept header (JSON if none of the supported formats is requested)
+    """
+    return request.accept_mimetypes.best_match(FORMATS, default=JSON)
+
+def to_columns(value):
+    """
+        Converts lists of records (dicts with the same keys) to dicts of parallel arrays, recursively
+    """
+    if isinstance(value, list) and value and all(isinstance(item, dict) for item in value) and \
+            all(item.keys() == value[0].keys() for item in value):
+        return {key: to_columns([item[key] for item in value]) for key in value[0].keys()}
+    elif isinstance(value, dict):
+        return {key: to_columns(item) for key, item in value.items()}
+    return value
+
+def to_array(value) -> np.ndarray:
+    """
+        Converts an array payload to a NumPy array: a list of numbers or columns of equal length (structured array).
+        Raises ValueError for other payloads.
+    """
+    value = to_columns(value)
+    if isinstance(value, dict):
+        if not value or not all(isinstance(column, (list, np.ndarray)) for column in value.values()):
+            raise ValueError('Payload is not an array')
+        columns = [np.asarray(column) for column in value.values()]
+        if any(column.dtype == object or column.ndim != 1 or len(column) != len(columns[0]) for column in columns):
+            raise ValueError('Payload columns are not numeric arrays of equal length')
+        return np.rec.fromarrays(columns, names=list(value.keys()))
+    array = np.asarray(value)
+    if array.dtype.kind not in 'biufc':
+        raise ValueError('Payload is not a numeric array')
+    return array
+
+def encode(value, mimetype: str) -> bytes:
+    if mimetype == MSGPACK:
+        return msgpack.packb(value)
+    elif mimetype == COLUMNAR:
+        return json.dumps(to_columns(value)).encode()
+    elif mimetype == NPY:
+        buffer = io.BytesIO()
+        np.save(buffer, to_array(value), allow_pickle=False)
+        return buffer.getvalue()
+    return json.dumps(value).encode()
+
+def columns_response(columns: dict, status: int = 200, headers: dict = None) -> Response:
+    """
+        Returns NumPy columns (e.g. frequency, real, imag) in the requested format without building per-point objects
+    """
+    mimetype = preferred_format()
+    if mimetype != NPY:
+        columns = {key: column.tolist() for key, column in columns.items()}
+    return Response(encode(columns, mimetype), status=status, headers=headers, mimetype=mimetype)
+
+def negotiate_response(response: Response) -> Response:
+    """
+        Flask after_request handler: re-encodes JSON responses in the format requested by the Accept header
+    """
+    if response.mimetype != JSON or response.is_streamed or response.direct_passthrough:
+        return response
+    mimetype = preferred_format()
+    if mimetype == JSON:
+        return response
+    try:
+        body = encode(response.get_json(), mimetype)
+    except ValueError as error:
+        response = jsonify({'error': f'Response cannot be encoded as {mimetype}: {error}'})
+        response.status_code = 406
+        return response
+    response.set_data(body)
+    response.mimetype = mimetype
+    return response
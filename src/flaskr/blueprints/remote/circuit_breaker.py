@@ -0,0 +1,67 @@
+#!/usr/bin/env python
+
+"""
+
+Per-host circuit breakers for forwarded API calls (CircuitBreaker of modules/pyResilience.py, shared with the
+instrument drivers). After a number of consecutive failures the breaker opens and calls to that host fail fast; a
+background thread probes the host and closes the breaker once it responds again.
+
+"""
+
+__author__ = "Ivan Jakovac"
+__email__ = "ivan.jakovac2@gmail.com"
+__version__ = "v0.1"
+
+#  Copyright (C) 2020-2025 Ivan Jakovac
+#
+#  This program is free software: you can redistribute it and/or modify it under the terms of the GNU General Public
+#  License as published by the Free Software Foundation, either version 3 of the License, or (at your option) any
+#  later version.
+#
+#  This program is distributed in the hope that it will be useful, but WITHOUT ANY WARRANTY; without even the implied
+#  warranty of MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License along with this program. If not,
+#  see <https://www.gnu.org/licenses/>.
+
+from prometheus_client import Enum, Histogram, Counter
+from threading import Lock
+from ...modules.pyResilience import CircuitBreaker
+
+breaker_state = Enum('remote_breaker_state', 'Circuit breaker state of a remote host', ['host'],
+                     states=['closed', 'open', 'half_open'])
+remote_latency = Histogram('remote_request_latency_seconds', 'Time until a remote host responds to a forwarded call',
+                           ['host'])
+remote_retries = Counter('remote_retries', 'Forwarded calls retried after a connection error or timeout', ['host'])
+
+# Defaults used when a device in AVAILABLE_DEVICES does not define its own breaker parameters
+DEFAULT_RETRIES = 2
+DEFAULT_BACKOFF = 0.2
+DEFAULT_FAILURE_THRESHOLD = 3
+DEFAULT_PROBE_INTERVAL = 5
+# Gateway errors of the remote reverse proxy mean that the LabAPI server behind it is down
+GATEWAY_ERRORS = (502, 504)
+
+
+class RemoteBreakers:
+    """ Class holds one circuit breaker per remote host """
+    def __init__(self):
+        self.breakers = dict()
+        self.lock = Lock()
+
+    def get_breaker(self, host: str, probe, properties: dict) -> CircuitBreaker:
+        """
+        Returns the breaker for a given host; devices on the same host share a breaker.
+        """
+        with self.lock:
+            if host not in self.breakers:
+                self.breakers[host] = CircuitBreaker(host, probe,
+                                                     int(properties.get('failure_threshold',
+                                                                        DEFAULT_FAILURE_THRESHOLD)),
+                                                     float(properties.get('probe_interval', DEFAULT_PROBE_INTERVAL)),
+                                                     breaker_state)
+            return self.breakers[host]
+
+
+# Breakers are shared by all remote blueprints
+remote_breakers = RemoteBreakers()
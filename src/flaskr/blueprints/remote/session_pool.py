@@ -0,0 +1,131 @@
+#!/usr/bin/env python
+
+"""
+
+Pool of keep-alive HTTP sessions used to forward API calls to remote LabAPI hosts. Every remote host gets a single
+requests.Session (shared by all devices on that host) so TCP/TLS connections are reused between forwarded calls.
+
+"""
+
+__author__ = "Ivan Jakovac"
+__email__ = "ivan.jakovac2@gmail.com"
+__version__ = "v0.1"
+
+#  Copyright (C) 2020-2025 Ivan Jakovac
+#
+#  This program is free software: you can redistribute it and/or modify it under the terms of the GNU General Public
+#  License as published by the Free Software Foundation, either version 3 of the License, or (at your option) any
+#  later version.
+#
+#  This program is distributed in the hope that it will be useful, but WITHOUT ANY WARRANTY; without even the implied
+#  warranty of MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License along with this program. If not,
+#  see <https://www.gnu.org/licenses/>.
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.connection import HTTPConnection, HTTPSConnection
+from urllib3.connectionpool import HTTPConnectionPool, HTTPSConnectionPool
+from prometheus_client import Counter
+from threading import Lock
+
+# Pool statistics: a hit is a forwarded call sent over an already open connection
+pool_hits = Counter('remote_pool_hits', 'Forwarded API calls sent over a reused keep-alive connection', ['host'])
+pool_misses = Counter('remote_pool_misses', 'Forwarded API calls which needed a new connection', ['host'])
+pool_handshakes = Counter('remote_pool_handshakes', 'TCP (and TLS) handshakes made with remote hosts', ['host'])
+
+# Defaults used when a device in AVAILABLE_DEVICES does not define its own pool parameters
+DEFAULT_POOL_SIZE = 10
+DEFAULT_CONNECT_TIMEOUT = 5
+DEFAULT_READ_TIMEOUT = 60
+
+
+class CountingHTTPConnection(HTTPConnection):
+    """ HTTP connection which counts every (re)connect to the remote host """
+    def connect(self):
+        pool_handshakes.labels(self.host).inc()
+        super().connect()
+
+
+class CountingHTTPSConnection(HTTPSConnection):
+    """ HTTPS connection which counts every (re)connect, i.e. TCP+TLS handshake, to the remote host """
+    def connect(self):
+        pool_handshakes.labels(self.host).inc()
+        super().connect()
+
+
+class CountingPoolMixin:
+    """ Connection pool mixin which counts pool hits (open connection reused) and misses (new connection needed) """
+    def _get_conn(self, timeout=None):
+        conn = super()._get_conn(timeout)
+        if getattr(conn, 'sock', None) is not None:
+            pool_hits.labels(self.host).inc()
+        else:
+            pool_misses.labels(self.host).inc()
+        return conn
+
+
+class CountingHTTPConnectionPool(CountingPoolMixin, HTTPConnectionPool):
+    ConnectionCls = CountingHTTPConnection
+
+
+class CountingHTTPSConnectionPool(CountingPoolMixin, HTTPSConnectionPool):
+    ConnectionCls = CountingHTTPSConnection
+
+
+class CountingHTTPAdapter(HTTPAdapter):
+    """ Transport adapter which uses counting connection pools """
+    def init_poolmanager(self, *args, **kwargs):
+        super().init_poolmanager(*args, **kwargs)
+        self.poolmanager.pool_classes_by_scheme = {'http': CountingHTTPConnectionPool,
+                                                   'https': CountingHTTPSConnectionPool}
+
+
+class RemoteSessionPool:
+    """ Class holds one keep-alive session per remote host """
+    def __init__(self):
+        self.sessions = dict()
+        self.pool_sizes = dict()
+        self.lock = Lock()
+
+    def get_session(self, host: str, pool_size: int = DEFAULT_POOL_SIZE) -> requests.Session:
+        """
+        Returns the session for a given host. Devices on the same host share a session; if a larger pool is
+        requested the session is replaced and the old one closed.
+        """
+        with self.lock:
+            if host not in self.sessions or self.pool_sizes[host] < pool_size:
+                session = requests.Session()
+                adapter = CountingHTTPAdapter(pool_connections=1, pool_maxsize=pool_size, pool_block=False)
+                session.mount('https://', adapter)
+                session.mount('http://', adapter)
+                replaced = self.sessions.get(host)
+                self.sessions[host] = session
+                self.pool_sizes[host] = pool_size
+                if replaced is not None:
+                    # Idle connections are closed now; connections of calls in progress are closed by urllib3 when
+                    # those calls release them (the closed pool does not take them back)
+                    replaced.close()
+            return self.sessions[host]
+
+    def close(self):
+        with self.lock:
+            for session in self.sessions.values():
+                session.close()
+            self.sessions.clear()
+            self.pool_sizes.clear()
+
+
+def get_timeout(properties: dict) -> tuple:
+    """
+    Returns (connect, read) timeout tuple for a device defined in AVAILABLE_DEVICES. Read timeout set to None
+    waits for the remote response indefinitely.
+    """
+    read_timeout = properties.get('read_timeout', DEFAULT_READ_TIMEOUT)
+    return (float(properties.get('connect_timeout', DEFAULT_CONNECT_TIMEOUT)),
+            float(read_timeout) if read_timeout is not None else None)
+
+
+# Sessions are shared by all remote blueprints
+remote_sessions = RemoteSessionPool()
@@ -22,11 +22,58 @@ __version__ = "v0.1"
 #  You should have received a copy of the GNU General Public License along with this program. If not,
 #  see <https://www.gnu.org/licenses/>.
 
-from flask import Blueprint, request, jsonify
+from flask import Blueprint, Response, request, jsonify
 import requests
+import time
 from ...config import API_KEY
 from hashlib import sha256
-        
+from .session_pool import remote_sessions, get_timeout, DEFAULT_POOL_SIZE
+from .circuit_breaker import (remote_breakers, remote_latency, remote_retries, DEFAULT_RETRIES, DEFAULT_BACKOFF,
+                              GATEWAY_ERRORS)
+from ...modules.pyResilience import jittered_backoff
+
+# Size of chunks relayed between the remote host and the client (streaming mode)
+CHUNK_SIZE = 64 * 1024
+# Headers describing the remote response body; passed back to the client unchanged
+RELAYED_HEADERS = ['Content-Type', 'Content-Length', 'Content-Encoding']
+
+class RequestBodyStream:
+    """ File-like wrapper of the incoming request body: requests streams it upstream with a known Content-Length """
+    def __init__(self, stream, length: int):
+        self.stream = stream
+        self.length = length
+
+    def __len__(self):
+        return self.length
+
+    def read(self, size: int = -1) -> bytes:
+        return self.stream.read(size)
+
+def request_body():
+    """
+        Returns the incoming request body in a form which requests streams upstream without buffering it
+    """
+    if request.content_length:
+        return RequestBodyStream(request.stream, request.content_length)
+    elif request.headers.get('Transfer-Encoding', '').lower() == 'chunked':
+        return iter(lambda: request.stream.read(CHUNK_SIZE), b'')
+    return None
+
+def relay_response(response):
+    """
+        Relays the remote response chunk by chunk without decoding the body
+    """
+    def generate():
+        try:
+            for chunk in response.raw.stream(CHUNK_SIZE, decode_content=False):
+                yield chunk
+        finally:
+            # Return the connection to the pool (also when the client disconnects)
+            response.close()
+
+    headers = {name: response.headers[name] for name in RELAYED_HEADERS if name in response.headers}
+    return Response(generate(), status=response.status_code, headers=headers)
+
 def set_routes(device, properties):
     """
         Sets routes for remote API calls
@@ -34,7 +81,29 @@ def set_routes(device, properties):
     # Instantiate blueprint for a new device - new prefix
     blueprint = Blueprint(device, __name__, url_prefix=f'/{device.lower()}')
     # Construct an URL template knowing the device's host and port
-    request_url_template = f'https://{properties["host"]}/{device.lower()}/'
+    host = properties['host']
+    request_url_template = f'https://{host}/{device.lower()}/'
+    # Connection pool size and (connect, read) timeouts for this device
+    pool_size = int(properties.get('pool_size', DEFAULT_POOL_SIZE))
+    timeout = get_timeout(properties)
+    # Relay responses as raw byte streams unless buffered forwarding is requested
+    streaming = properties.get('streaming', True)
+    # Idempotent GET calls are retried with jittered exponential backoff
+    retries = int(properties.get('retries', DEFAULT_RETRIES))
+    backoff = float(properties.get('backoff', DEFAULT_BACKOFF))
+
+    def probe():
+        # Any HTTP response (homepage redirects to Swagger) except a gateway error means that the host is up again
+        try:
+            response = remote_sessions.get_session(host, pool_size).get(f'https://{host}/', allow_redirects=False,
+                                                                        timeout=timeout)
+            response.close()
+            return response.status_code not in GATEWAY_ERRORS
+        except requests.RequestException:
+            return False
+
+    # Circuit breaker shared by all devices on the same host
+    breaker = remote_breakers.get_breaker(host, probe, properties)
 
     # Authorization check
     @blueprint.before_request
@@ -45,20 +114,51 @@ def set_routes(device, properties):
     # Catch every call and forward it
     @blueprint.route('/<path:path>', methods=['GET', 'PUT', 'POST'])
     def forward_api_call(path):
+        # Fail fast while the remote host is down
+        if not breaker.allow():
+            return jsonify({'error': f'Remote host {host} is unavailable'}), 503, {'Retry-After': f'{breaker.probe_interval:.0f}'}
+
         request_url = f'{request_url_template}{path}?{request.query_string.decode()}'
-        if request.method == 'GET':
-            # For GET call forward full request URL with queries and HTTP headers
-            response = requests.get(request_url, headers=request.headers)
-            return response.text, response.status_code
-        elif request.method == 'PUT':
-            # For PUT call forward full request URL with queries and HTTP headers
-            response = requests.put(request_url, headers=request.headers)
-            return response.text, response.status_code
+        if streaming:
+            # Stream request body upstream and response body back to the client
+            data = request_body()
         elif request.method == 'POST':
             # For POST call forward request URL, HTTP headers and JSON payload
             request_url = request_url_template + path
-            response = requests.post(request_url, headers=request.headers, data=request.data)
+            data = request.data
+        else:
+            # For GET and PUT call forward full request URL with queries and HTTP headers
+            data = None
+
+        # Only getters called with GET are safe to repeat
+        attempts = 1 + retries if request.method == 'GET' and path.split('/')[-1].startswith('get_') else 1
+        for attempt in range(attempts):
+            # Keep-alive session shared by all devices on the same host
+            session = remote_sessions.get_session(host, pool_size)
+            try:
+                start = time.perf_counter()
+                response = session.request(request.method, request_url, headers=request.headers, data=data,
+                                           stream=streaming, timeout=timeout)
+            except (requests.ConnectionError, requests.Timeout) as error:
+                breaker.record_failure()
+                if attempt + 1 < attempts and breaker.allow():
+                    remote_retries.labels(host).inc()
+                    time.sleep(jittered_backoff(backoff, attempt))
+                    continue
+                return jsonify({'error': f'Remote host {host} did not respond: {error}'}), 504 if isinstance(error, requests.Timeout) else 502
+            remote_latency.labels(host).observe(time.perf_counter() - start)
+            if response.status_code in GATEWAY_ERRORS:
+                breaker.record_failure()
+            else:
+                breaker.record_success()
+            break
+
+        if streaming:
+            return relay_response(response)
+        elif request.method == 'POST':
             return jsonify(response.json()), response.status_code
+        else:
+            return response.text, response.status_code
         
     # Return a blueprint to register in the Flask app        
-    return blueprint
\ No newline at end of file
+    return blueprint
@@ -60,9 +60,14 @@ def swagger_constructor():
     with open('flaskr/static/swagger/base.yaml', 'r') as base_file:
         swagger_base = base_file.read()+'\n'
 
-    # Add each device only if device.yaml exists
+    # Server-wide endpoints (not bound to a single device) are always listed
     swagger_tags = 'tags:\n'
-    swagger_paths = 'paths:\n'
+    swagger_tags += f'  - name: LabAPI\n'
+    swagger_tags += f'    description: Server-wide endpoints\n'
+    with open('flaskr/static/swagger/server.yaml') as server_file:
+        swagger_paths = 'paths:\n' + server_file.read()
+
+    # Add each device only if device.yaml exists
     for device, properties in AVAILABLE_DEVICES.items():
         if os.path.exists(os.path.abspath(f'flaskr/static/swagger/{device}.yaml')):     
             swagger_tags += f'  - name: {properties["name"]}\n'
@@ -5,6 +5,12 @@ API_KEY = ''
 # What is this computer's IP or domain?
 THIS_PC = '127.0.0.1:5000' # host:port
 # Which devices are connected and where? Provide a json-like dictionary {device: {name, description, host, port, mode}}
+# Remote devices (host is not this PC) can optionally set: 'pool_size' (keep-alive connections per host, default 10),
+# 'connect_timeout' and 'read_timeout' (seconds, default 5 and 60; read_timeout None waits indefinitely) and
+# 'streaming' (relay request/response bodies as raw byte streams, default True; False buffers and re-encodes them),
+# 'retries' and 'backoff' (retries of GET getters after connection errors/timeouts, default 2 and 0.2 s doubling),
+# 'failure_threshold' (consecutive failures which open the host's circuit breaker, default 3) and 'probe_interval'
+# (seconds between background probes of a host while its breaker is open, default 5)
 AVAILABLE_DEVICES = {'KeysightE5080A': {'name': 'Keysight E5080A',
                                         'description': 'VNA analyzer',
                                         'host': '127.0.0.1',
@@ -0,0 +1,162 @@
+#!/usr/bin/env python
+
+"""
+
+Adaptive query delay for slow serial instruments. Instead of a fixed query_delay for every command, the delay between
+writing a query and reading the response is learned per command type: it is lowered step by step while responses
+come back valid and raised again (with a retry) on timeouts or garbled responses. Learned delays are saved to a JSON
+file and loaded on the next start.
+
+"""
+
+__author__ = "Ivan Jakovac"
+__email__ = "ivan.jakovac2@gmail.com"
+__version__ = "v0.1"
+
+#  Copyright (C) 2020-2025 Ivan Jakovac
+#
+#  This program is free software: you can redistribute it and/or modify it under the terms of the GNU General Public
+#  License as published by the Free Software Foundation, either version 3 of the License, or (at your option) any
+#  later version.
+#
+#  This program is distributed in the hope that it will be useful, but WITHOUT ANY WARRANTY; without even the implied
+#  warranty of MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License along with this program. If not,
+#  see <https://www.gnu.org/licenses/>.
+
+import json
+import os
+import re
+import time
+from threading import Lock
+from pyvisa import VisaIOError
+from prometheus_client import Gauge, Histogram, Counter
+
+query_delay = Gauge('visa_query_delay_seconds', 'Learned delay between a query and reading its response',
+                    ['device', 'command'])
+response_latency = Histogram('visa_response_latency_seconds', 'Time from writing a query to reading a valid response',
+                             ['device', 'command'])
+query_failures = Counter('visa_query_failures', 'Queries which timed out or returned a garbled response',
+                         ['device', 'command'])
+
+# Learned delays of all devices, the file is shared by all devices
+DEFAULT_PATH = f'{os.path.dirname(__file__)}/query_delays.json'
+file_lock = Lock()
+
+def command_type(command: str) -> str:
+    """
+    Returns the command type used as the delay key: command headers without arguments, e.g. 'KRDG? A' -> 'KRDG?',
+    'R 7' -> 'R', 'KRDG? A;SETP? 2' -> 'KRDG?;SETP?'.
+    """
+    return ';'.join(re.match(r'[^\s\d+\-.,]*', part.strip()).group() for part in command.split(';'))
+
+
+class AdaptiveDelay:
+    # Delay tuning: lower the delay after a number of consecutive valid responses, raise it on failure
+    SUCCESSES_TO_DECREASE = 10
+    DECREASE_FACTOR = 0.8
+    INCREASE_FACTOR = 2.0
+    # Never go back below a delay which failed (times this margin)...
+    SAFETY_MARGIN = 1.25
+    # ...unless this many consecutive valid responses show that the slow response was transient: the floor decays
+    FLOOR_DECAY_SUCCESSES = 100
+
+    def __init__(self, device: str, initial_delay: float, max_delay: float = 2.0, min_delay: float = 0.0,
+                 retries: int = 2, validate=None, path: str = DEFAULT_PATH) -> None:
+        """
+        Class learns query delays of a single device. validate(command, response) returns False for garbled
+        responses.
+        """
+        self.device = device
+        self.initial_delay = initial_delay
+        self.max_delay = max_delay
+        self.min_delay = min_delay
+        self.retries = retries
+        self.validate = validate or (lambda command, response: True)
+        self.path = path
+        self.delays = dict()
+        self.floors = dict()
+        self.successes = dict()
+        self.clean = dict()
+        self.load()
+
+    def load(self):
+        if os.path.exists(self.path):
+            try:
+                with open(self.path) as json_file:
+                    learned = json.load(json_file).get(self.device, {})
+                self.delays = learned.get('delays', {})
+                self.floors = learned.get('floors', {})
+            except (OSError, ValueError):
+                # Corrupted file: start from the initial delay
+                self.delays, self.floors = dict(), dict()
+        for command, delay in self.delays.items():
+            query_delay.labels(self.device, command).set(delay)
+
+    def save(self):
+        # Several devices share the file: update only this device's entry
+        with file_lock:
+            learned = dict()
+            if os.path.exists(self.path):
+                try:
+                    with open(self.path) as json_file:
+                        learned = json.load(json_file)
+                except (OSError, ValueError):
+                    pass
+            learned[self.device] = {'delays': self.delays, 'floors': self.floors}
+            with open(f'{self.path}.tmp', 'w') as json_file:
+                json.dump(learned, json_file, indent=2)
+            os.replace(f'{self.path}.tmp', self.path)
+
+    def set_delay(self, key: str, delay: float):
+        self.delays[key] = delay
+        query_delay.labels(self.device, key).set(delay)
+        self.save()
+
+    def record_success(self, key: str, delay: float, latency: float):
+        response_latency.labels(self.device, key).observe(latency)
+        self.successes[key] = self.successes.get(key, 0) + 1
+        self.clean[key] = self.clean.get(key, 0) + 1
+        if self.clean[key] >= self.FLOOR_DECAY_SUCCESSES and key in self.floors:
+            self.clean[key] = 0
+            self.floors[key] *= self.DECREASE_FACTOR
+        if self.successes[key] >= self.SUCCESSES_TO_DECREASE:
+            self.successes[key] = 0
+            lower = max(delay * self.DECREASE_FACTOR, self.floors.get(key, 0.0), self.min_delay)
+            if lower < delay:
+                self.set_delay(key, lower)
+
+    def record_failure(self, key: str, delay: float):
+        query_failures.labels(self.device, key).inc()
+        self.successes[key] = 0
+        self.clean[key] = 0
+        self.floors[key] = min(max(self.floors.get(key, 0.0), delay * self.SAFETY_MARGIN), self.max_delay)
+        self.set_delay(key, min(max(delay * self.INCREASE_FACTOR, self.floors[key], 0.01), self.max_delay))
+
+    def query(self, resource, command: str) -> str:
+        """
+        Writes a query, waits for the learned delay and reads the response. Timeouts and garbled responses raise
+        the delay and the query is retried.
+        """
+        key = command_type(command)
+        for attempt in range(self.retries + 1):
+            delay = self.delays.get(key, self.initial_delay)
+            start = time.perf_counter()
+            resource.write(command)
+            time.sleep(delay)
+            try:
+                response = resource.read()
+                if self.validate(command, response):
+                    self.record_success(key, delay, time.perf_counter() - start)
+                    return response
+                error = ValueError(f'Garbled response {response!r} to {command!r}')
+            except VisaIOError as visa_error:
+                error = visa_error
+            self.record_failure(key, delay)
+            # Discard the rest of a late or garbled response before retrying
+            try:
+                resource.clear()
+            except (VisaIOError, NotImplementedError):
+                pass
+        raise error
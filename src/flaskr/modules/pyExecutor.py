@@ -0,0 +1,204 @@
+#!/usr/bin/env python
+
+"""
+
+Per-instrument command executor: every instrument gets a dedicated I/O worker thread which takes commands from a
+bounded priority queue. Control commands (e.g. hold, heater off) jump ahead of setters, setters jump ahead of
+telemetry reads, and the serial (USB) port sees strictly serialized traffic regardless of the calling thread.
+
+"""
+
+__author__ = "Ivan Jakovac"
+__email__ = "ivan.jakovac2@gmail.com"
+__version__ = "v0.1"
+
+#  Copyright (C) 2020-2025 Ivan Jakovac
+#
+#  This program is free software: you can redistribute it and/or modify it under the terms of the GNU General Public
+#  License as published by the Free Software Foundation, either version 3 of the License, or (at your option) any
+#  later version.
+#
+#  This program is distributed in the hope that it will be useful, but WITHOUT ANY WARRANTY; without even the implied
+#  warranty of MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License along with this program. If not,
+#  see <https://www.gnu.org/licenses/>.
+
+import itertools
+import queue
+import time
+from concurrent.futures import Future
+from contextlib import contextmanager
+from functools import wraps
+from threading import Thread, Lock, current_thread, local
+from prometheus_client import Gauge, Histogram, Counter
+
+queue_depth = Gauge('executor_queue_depth', 'Commands waiting for the instrument I/O worker', ['device'])
+queue_wait = Histogram('executor_wait_seconds', 'Time a command waits in the queue before the I/O worker runs it',
+                       ['device'])
+coalesced_queries = Counter('executor_coalesced_queries', 'Queries answered from an earlier identical query in the same '
+                            'coalescing window', ['device'])
+
+class DeviceExecutor:
+    # Command priorities: lower value runs first
+    CONTROL = 0
+    WRITE = 1
+    READ = 2
+
+    def __init__(self, name: str, maxsize: int = 100, put_timeout: float = 30) -> None:
+        """
+        Class runs commands for a single instrument on a dedicated I/O worker thread
+        """
+        self.name = name
+        self.put_timeout = put_timeout
+        self.queue = queue.PriorityQueue(maxsize)
+        # Sequence number keeps commands with the same priority in FIFO order
+        self.sequence = itertools.count()
+        # Coalescing windows: every window memoizes query results; a window belongs to the thread which opened it
+        # and travels with its commands to the I/O worker
+        self.local = local()
+        self.active_memo = None
+        self.open_memos = []
+        self.memo_lock = Lock()
+        # Called whenever a write or control command may change the instrument state (e.g. telemetry cache)
+        self.state_listeners = []
+
+        self.worker = Thread(target=self.run, name=f'{name} I/O worker', daemon=True)
+        self.worker.start()
+
+    def in_worker(self) -> bool:
+        """
+        Returns True if called from the I/O worker thread (nested commands run directly).
+        """
+        return current_thread() is self.worker
+
+    def submit(self, priority: int, function, *args, **kwargs) -> Future:
+        """
+        Queues a command and returns its Future. Raises queue.Full if the queue stays full for put_timeout seconds.
+        """
+        future = Future()
+        self.queue.put((priority, next(self.sequence), time.perf_counter(), future, function, args, kwargs,
+                        self.memo()), timeout=self.put_timeout)
+        queue_depth.labels(self.name).set(self.queue.qsize())
+        return future
+
+    def call(self, priority: int, function, *args, **kwargs):
+        """
+        Runs a command on the I/O worker and waits for its result.
+        """
+        if self.in_worker():
+            if priority != self.READ:
+                # Nested write (e.g. a marker command inside a getter) changes the instrument state as well
+                self.state_changed()
+            return function(*args, **kwargs)
+        return self.submit(priority, function, *args, **kwargs).result()
+
+    @contextmanager
+    def coalescing(self):
+        """
+        Coalescing window: identical queries (e.g. PID? 2 for P, I and D metrics) issued by this thread inside the
+        window are sent to the instrument once. Any write or control command, including one nested in a read and a
+        non-query sent through query(), clears all open windows.
+        """
+        if self.memo() is not None:
+            # Nested window reuses the outer one
+            yield
+            return
+        memo = dict()
+        with self.memo_lock:
+            self.open_memos.append(memo)
+        self.local.memo = memo
+        try:
+            yield
+        finally:
+            self.local.memo = None
+            with self.memo_lock:
+                self.open_memos.remove(memo)
+
+    def invalidate_memos(self):
+        """
+        Clears all open coalescing windows (and the one of the running command): instrument state may have changed,
+        memoized query results are no longer valid.
+        """
+        with self.memo_lock:
+            for open_memo in self.open_memos:
+                open_memo.clear()
+        if self.in_worker() and self.active_memo is not None:
+            self.active_memo.clear()
+
+    def add_state_listener(self, callback):
+        """
+        Registers a callback (no arguments) run on the I/O worker before every command which may change the
+        instrument state.
+        """
+        self.state_listeners.append(callback)
+
+    def state_changed(self):
+        """
+        Instrument state may change: clears the coalescing windows and notifies the state listeners.
+        """
+        self.invalidate_memos()
+        for callback in self.state_listeners:
+            callback()
+
+    def memo(self):
+        """
+        Returns the query memo of the current coalescing window, None outside of a window.
+        """
+        if self.in_worker():
+            return self.active_memo
+        return getattr(self.local, 'memo', None)
+
+    def run(self):
+        # I/O worker loop
+        while True:
+            priority, sequence, queued_at, future, function, args, kwargs, memo = self.queue.get()
+            queue_depth.labels(self.name).set(self.queue.qsize())
+            queue_wait.labels(self.name).observe(time.perf_counter() - queued_at)
+            if not future.set_running_or_notify_cancel():
+                continue
+            if priority != self.READ:
+                self.state_changed()
+            # Only reads are coalesced, commands sent by setters always reach the instrument
+            self.active_memo = memo if priority == self.READ else None
+            try:
+                future.set_result(function(*args, **kwargs))
+            except BaseException as error:
+                future.set_exception(error)
+            finally:
+                self.active_memo = None
+
+def execute(priority: int):
+    """
+    Decorator for device class methods: the method runs on the device's executor (self.executor) with a given priority.
+    """
+    def decorator(function):
+        @wraps(function)
+        def wrapper(self, *args, **kwargs):
+            return self.executor.call(priority, function, self, *args, **kwargs)
+        return wrapper
+    return decorator
+
+def coalesce(is_read):
+    """
+    Decorator for device class query methods: inside a coalescing window (self.executor.coalescing()) identical
+    read-only queries (is_read(command) returns True) are sent to the instrument once and the response is reused.
+    """
+    def decorator(function):
+        @wraps(function)
+        def wrapper(self, command, *args, **kwargs):
+            memo = self.executor.memo()
+            if memo is None:
+                return function(self, command, *args, **kwargs)
+            if not is_read(command):
+                # Command sent through query() may change the instrument state
+                self.executor.state_changed()
+                return function(self, command, *args, **kwargs)
+            key = (function.__name__, command, args, tuple(sorted(kwargs.items())))
+            if key in memo:
+                coalesced_queries.labels(self.executor.name).inc()
+            else:
+                memo[key] = function(self, command, *args, **kwargs)
+            return memo[key]
+        return wrapper
+    return decorator
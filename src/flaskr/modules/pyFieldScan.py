@@ -0,0 +1,130 @@
+#!/usr/bin/env python
+
+"""
+
+Field-synchronized VNA acquisition: the IPS120 sweeps the field continuously while the VNA takes triggered traces back
+to back. Every trace is stamped on the server with output field readings taken right before and right after it, so the
+field skew of a trace is bounded by its own sweep time instead of the latency of a client. Traces are stored in one
+frequency x field array.
+
+"""
+
+__author__ = "Ivan Jakovac"
+__email__ = "ivan.jakovac2@gmail.com"
+__version__ = "v0.1"
+
+#  Copyright (C) 2020-2025 Ivan Jakovac
+#
+#  This program is free software: you can redistribute it and/or modify it under the terms of the GNU General Public
+#  License as published by the Free Software Foundation, either version 3 of the License, or (at your option) any
+#  later version.
+#
+#  This program is distributed in the hope that it will be useful, but WITHOUT ANY WARRANTY; without even the implied
+#  warranty of MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License along with this program. If not,
+#  see <https://www.gnu.org/licenses/>.
+
+import time
+import numpy as np
+from threading import Lock
+
+try:
+    from .pyJobs import cancelled, report_progress, JobCancelled
+except ImportError:
+    # Imported as a top-level module (tests)
+    from pyJobs import cancelled, report_progress, JobCancelled
+
+class FieldScan:
+    def __init__(self, capacity: int = 64) -> None:
+        """
+        Class holds the traces of a field scan: one row of complex S11 data per trace and the time [s since epoch] and
+        output field [T] before and after it. Rows are preallocated and the buffers grow by doubling. The frequency
+        axis is set when the scan starts (see set_frequencies).
+        """
+        self.frequencies = np.empty(0, dtype=np.float64)
+        self.traces = np.empty((capacity, 0), dtype=np.complex128)
+        # time before, field before, time after, field after
+        self.stamps = np.empty((capacity, 4), dtype=np.float64)
+        self.count = 0
+        self.lock = Lock()
+
+    def __len__(self) -> int:
+        return self.count
+
+    def set_frequencies(self, frequencies: np.ndarray):
+        """
+        Sets the frequency axis [MHz] of the traces; only before the first trace is stored.
+        """
+        with self.lock:
+            if self.count:
+                raise ValueError('Frequency axis of a field scan with traces cannot change')
+            self.frequencies = np.asarray(frequencies, dtype=np.float64)
+            self.traces = np.empty((len(self.traces), len(self.frequencies)), dtype=np.complex128)
+
+    def append(self, trace: np.ndarray, before: tuple, after: tuple):
+        """
+        Stores a trace and its field readings before and after it, (timestamp, output field, ...) each
+        """
+        with self.lock:
+            if self.count == len(self.traces):
+                self.traces = np.concatenate([self.traces, np.empty_like(self.traces)])
+                self.stamps = np.concatenate([self.stamps, np.empty_like(self.stamps)])
+            self.traces[self.count] = trace
+            self.stamps[self.count] = (before[0], before[1], after[0], after[1])
+            self.count += 1
+
+    def to_dict(self) -> dict:
+        """
+        Returns copies of the stored traces (frequency x field array) and stamps; field is the mean of the readings
+        before and after each trace.
+        """
+        with self.lock:
+            traces, stamps = self.traces[:self.count].copy(), self.stamps[:self.count].copy()
+        return {'frequency': self.frequencies,
+                'field': (stamps[:, 1] + stamps[:, 3])/2,
+                'time_before': stamps[:, 0],
+                'field_before': stamps[:, 1],
+                'time_after': stamps[:, 2],
+                'field_after': stamps[:, 3],
+                'data': traces}
+
+def run_field_scan(ips, vna, scan: FieldScan, target_field: float, rate: float = None, tolerance: float = None,
+                   max_traces: int = None) -> dict:
+    """
+    Sweeps the IPS120 output field to target_field [T] (at rate [T/min] if given) and acquires VNA traces into scan
+    until the field is within tolerance [T] of the target (or max_traces are taken). The switch heater must be on.
+    The VNA holds triggered sweeps for the whole scan and a change of its sweep settings fails the scan (traces would
+    not share the frequency axis). The IPS is put on hold and the VNA sweep released at the end, also if the scan
+    fails or is cancelled. Returns a summary; meant to run as a job.
+    """
+    tolerance = ips.field_tolerance if tolerance is None else float(tolerance)
+    start_field = ips.read_field_sample()[1]
+    steps = [{'method': 'set_sweep_rate_field', 'args': [rate]}] if rate else []
+    with vna.single_sweeps():
+        # Frequency axis of the sweep the scan actually runs with
+        sweep = (vna.get_sweep_range(), vna.get_sweep_points())
+        scan.set_frequencies(vna.read_frequencies())
+        try:
+            ips.apply_session(steps + [{'method': 'set_setpoint_field', 'args': [target_field]},
+                                       {'method': 'set_go_to_setpoint'}])
+            report_progress(0.0, f'Scanning from {start_field} T to {target_field} T')
+            arrived = False
+            while not arrived and (max_traces is None or len(scan) < max_traces):
+                if cancelled():
+                    raise JobCancelled()
+                before = ips.read_field_sample()
+                trace = vna.acquire_trace()
+                after = ips.read_field_sample()
+                if len(trace) != len(scan.frequencies) or (vna.get_sweep_range(), vna.get_sweep_points()) != sweep:
+                    raise ValueError('VNA sweep settings changed during the field scan')
+                scan.append(trace, before, after)
+                arrived = abs(after[1] - target_field) <= tolerance
+                if target_field != start_field:
+                    report_progress(abs(after[1] - start_field)/abs(target_field - start_field),
+                                    f'{len(scan)} traces')
+        finally:
+            ips.set_hold()
+    report_progress(1.0, f'{len(scan)} traces from {start_field} T to {target_field} T')
+    return {'traces': len(scan), 'points': len(scan.frequencies), 'start_field': start_field,
+            'stop_field': float(scan.stamps[len(scan) - 1, 3]) if len(scan) else start_field}
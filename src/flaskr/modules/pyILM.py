@@ -28,6 +28,18 @@ import configparser
 import re
 import time
 
+try:
+    from .pyExecutor import DeviceExecutor, execute
+    from .pyTelemetryCache import TelemetryCache, cached
+    from .pyResilience import Resilience, resilient, close_resources
+    from .pyAdaptiveDelay import AdaptiveDelay
+except ImportError:
+    # Imported as a top-level module (tests)
+    from pyExecutor import DeviceExecutor, execute
+    from pyTelemetryCache import TelemetryCache, cached
+    from pyResilience import Resilience, resilient, close_resources
+    from pyAdaptiveDelay import AdaptiveDelay
+
 class ILM:
     def __init__(self, address: str = None, device_present: bool = False) -> None:
         """
@@ -37,6 +49,23 @@ class ILM:
         path = os.path.dirname(__file__)
         config = configparser.ConfigParser()
         config.read(f'{path}/config.ini')
+        # Dedicated I/O worker serializes all communication with the device
+        self.executor = DeviceExecutor('ILM', config.getint('ILM', 'queue_size', fallback=100))
+        # Last value of every getter call, shared by the Prometheus worker and HTTP clients
+        self.cache = TelemetryCache(config.getint('ILM', 'cache_size', fallback=256))
+        # Any write or reconnect may change what the getters return
+        self.executor.add_state_listener(self.cache.invalidate)
+        # Bounded retries of instrument errors; consecutive failures open a circuit breaker which reconnects
+        self.resilience = Resilience('ILM', config, self.connect)
+        # Query delay: fixed, or learned per command type if adaptive_delay is enabled
+        self.query_delay = config.getfloat('ILM', 'query_delay', fallback=0.0)
+        if config.getboolean('ILM', 'adaptive_delay', fallback=False):
+            # Valid response starts with the command letter (errors start with '?')
+            # No retries of its own: @resilient on query() already retries the whole exchange
+            self.adaptive_delay = AdaptiveDelay('ILM', self.query_delay, retries=0,
+                                                validate=lambda command, response: response.startswith(command[0]))
+        else:
+            self.adaptive_delay = None
 
         # Handle resource address
         if address is not None:
@@ -54,43 +83,53 @@ class ILM:
         self.connect()
         
     # Connector
+    @execute(DeviceExecutor.WRITE)
     def connect(self):
+        # Reconnect (e.g. breaker probe): release the previous session first
+        close_resources(getattr(self, 'ilm', None), getattr(self, 'rm', None))
         if self.device_present:
             self.rm = visa.ResourceManager()
         else:
             # Mock VISA
             self.rm = visa.ResourceManager(f'{os.path.dirname(__file__)}/pyvisa-sim.yaml@sim')
         # Initialize communication
-        self.ilm = self.rm.open_resource(self.address, read_termination = '\r\n', write_termination = '\r\n')
+        self.ilm = self.rm.open_resource(self.address, read_termination = '\r\n', write_termination = '\r\n',
+                                           query_delay=self.query_delay)
         # Set non-typical parameters
         # Set termination to /r/n
         self.ilm.write('Q2')
 
     # Query/Write functions to issue a direct query/write command and receive raw response
+    @execute(DeviceExecutor.READ)
+    @resilient
     def query(self, argument):
+        if self.adaptive_delay is not None:
+            return self.adaptive_delay.query(self.ilm, argument)
         return self.ilm.query(argument)
 
+    @execute(DeviceExecutor.WRITE)
+    @resilient(retry=False)
     def write(self, argument):
         self.ilm.write(argument)
 
 
     # SIMPLE GETTERS (one value)
+    @cached
+    @execute(DeviceExecutor.READ)
+    @resilient
     def get_LHe_level(self) -> float:
         """
         This method gets the current liquid helium level.
         """
-        while True:
-            try:
-                return float(self.query('R 1').strip('R'))/10
-            except:
-                pass
+        # Garbled responses (ValueError) are retried like the query
+        return float(self.query('R 1').strip('R'))/10
     
+    @cached
+    @execute(DeviceExecutor.READ)
+    @resilient
     def get_LN2_level(self) -> float:
         """
         This method gets the current liquid nitrogen level.
         """
-        while True:
-            try:
-                return float(self.query('R 2').strip('R'))/10
-            except:
-                pass
+        # Garbled responses (ValueError) are retried like the query
+        return float(self.query('R 2').strip('R'))/10
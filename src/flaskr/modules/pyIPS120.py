@@ -25,8 +25,63 @@ __version__ = "v0.1"
 import pyvisa as visa
 import os
 import configparser
-import re
 import time
+import re
+from contextlib import contextmanager
+
+try:
+    from .pyExecutor import DeviceExecutor, execute, coalesce
+    from .pyTelemetryCache import TelemetryCache, cached
+    from .pyResilience import Resilience, resilient, close_resources
+    from .pyAdaptiveDelay import AdaptiveDelay
+    from .pyJobs import sleep, report_progress
+    from .pySampleLog import SampleLog
+except ImportError:
+    # Imported as a top-level module (tests)
+    from pyExecutor import DeviceExecutor, execute, coalesce
+    from pyTelemetryCache import TelemetryCache, cached
+    from pyResilience import Resilience, resilient, close_resources
+    from pyAdaptiveDelay import AdaptiveDelay
+    from pyJobs import sleep, report_progress
+    from pySampleLog import SampleLog
+
+# Precompiled response parsers: status string (X) and parameter readings (R n, e.g. 'R+7.7700')
+STATUS_PATTERN = re.compile(r'X(\d)(\d)A(\d)C(\d)H(\d)M(\d)(\d)P(\d)(\d)')
+READING_PATTERN = re.compile(r'R?\s*([-+]?(?:\d+\.?\d*|\.\d+)(?:[eE][-+]?\d+)?)')
+
+# Snapshot readings: record field (getter name without get_) and R parameter number
+SNAPSHOT_READINGS = [('output_current', 0),
+                     ('magnet_current', 2),
+                     ('setpoint_current', 5),
+                     ('sweep_rate_current', 6),
+                     ('output_field', 7),
+                     ('setpoint_field', 8),
+                     ('sweep_rate_field', 9),
+                     ('persistent_current', 16),
+                     ('persistent_field', 18),
+                     ('heater_current', 20)]
+
+# Boolean helpers (getter name without get_): status field and the value which makes them True
+STATUS_FLAGS = {'is_heater_on': ('heater_status', 'On'),
+                'is_on_hold': ('activity_status', 'Hold'),
+                'is_going_to_setpoint': ('activity_status', 'To setpoint'),
+                'is_going_to_zero': ('activity_status', 'To zero'),
+                'is_clamped': ('activity_status', 'Clamped')}
+
+# Setters which can be applied in one remote control session (apply_session)
+SESSION_METHODS = ('set_hold', 'set_go_to_setpoint', 'set_go_to_zero', 'set_clamped', 'set_heater_off',
+                   'set_heater_on', 'set_setpoint_current', 'set_setpoint_field', 'set_sweep_rate_current',
+                   'set_sweep_rate_field')
+
+# Columns of the field profile log: time [s since epoch], segment index, target field [T], output field [T] and
+# output current [A]
+PROFILE_LOG_COLUMNS = ['time', 'segment', 'target_field', 'output_field', 'output_current']
+
+def status_flags(status: dict) -> dict:
+    """
+    Returns the boolean helper values of a get_status() record
+    """
+    return {flag: status[field] == value for flag, (field, value) in STATUS_FLAGS.items()}
 
 class IPS120:
     def __init__(self, address: str = None, device_present: bool = False) -> None:
@@ -37,6 +92,28 @@ class IPS120:
         path = os.path.dirname(__file__)
         config = configparser.ConfigParser()
         config.read(f'{path}/config.ini')
+        # Dedicated I/O worker serializes all communication with the device
+        self.executor = DeviceExecutor('IPS120', config.getint('IPS120', 'queue_size', fallback=100))
+        # Last value of every getter call, shared by the Prometheus worker and HTTP clients
+        self.cache = TelemetryCache(config.getint('IPS120', 'cache_size', fallback=256))
+        # Any write or reconnect may change what the getters return
+        self.executor.add_state_listener(self.cache.invalidate)
+        # Bounded retries of instrument errors; consecutive failures open a circuit breaker which reconnects
+        self.resilience = Resilience('IPS120', config, self.connect)
+        # Query delay: fixed, or learned per command type if adaptive_delay is enabled
+        self.query_delay = config.getfloat('IPS120', 'query_delay', fallback=0.0)
+        if config.getboolean('IPS120', 'adaptive_delay', fallback=False):
+            # Valid response starts with the command letter (errors start with '?')
+            # No retries of its own: @resilient on query() already retries the whole exchange
+            self.adaptive_delay = AdaptiveDelay('IPS120', self.query_delay, retries=0,
+                                                validate=lambda command, response: response.startswith(command[0]))
+        else:
+            self.adaptive_delay = None
+        # Field [T] within which a sweep has arrived at its target and interval [s] between field profile log samples
+        self.field_tolerance = config.getfloat('IPS120', 'field_tolerance', fallback=0.0005)
+        self.profile_sample_interval = config.getfloat('IPS120', 'profile_sample_interval', fallback=1.0)
+        # Log of the last (or running) field profile
+        self.profile_log = SampleLog(PROFILE_LOG_COLUMNS)
 
         # Handle resource address
         if address is not None:
@@ -49,6 +126,9 @@ class IPS120:
             else:
                 raise Exception('Resource address not provided!')
 
+        # Nesting depth of remote control sessions (only changed on the I/O worker)
+        self.remote_depth = 0
+
         # Test a connection
         self.device_present = device_present
         self.connect()
@@ -75,96 +155,155 @@ class IPS120:
                               8: 'No switch present'}
         
     # Connector
+    @execute(DeviceExecutor.WRITE)
     def connect(self):
+        # Reconnect (e.g. breaker probe): release the previous session first
+        close_resources(getattr(self, 'ips', None), getattr(self, 'rm', None))
         if self.device_present:
             self.rm = visa.ResourceManager()
         else:
             # Mock VISA
             self.rm = visa.ResourceManager(f'{os.path.dirname(__file__)}/pyvisa-sim.yaml@sim')
         # Initialize communication
-        self.ips = self.rm.open_resource(self.address, read_termination = '\r\n', write_termination = '\r\n')
+        self.ips = self.rm.open_resource(self.address, read_termination = '\r\n', write_termination = '\r\n',
+                                           query_delay=self.query_delay)
         # Set non-typical parameters
         # Set termination to /r/n
         self.ips.write('Q2')
 
     # Query/Write functions to issue a direct query/write command and receive raw response
+    # Only read (R) and examine (X) commands are coalesced
+    @coalesce(lambda command: command.startswith(('R', 'X')))
+    @execute(DeviceExecutor.READ)
+    @resilient
     def query(self, argument):
+        if self.adaptive_delay is not None:
+            return self.adaptive_delay.query(self.ips, argument)
         return self.ips.query(argument)
 
+    @execute(DeviceExecutor.WRITE)
+    @resilient(retry=False)
     def write(self, argument):
         self.ips.write(argument)
 
 
+    def read_parameter(self, parameter: int) -> float:
+        """
+        This method reads the R parameter number parameter (consult IPS manual for the list).
+        """
+        response = self.query(f'R {parameter:d}')
+        match = READING_PATTERN.match(response.strip())
+        if match is None:
+            raise ValueError(f'Unexpected response {response!r} to R {parameter:d}')
+        return float(match.group(1))
+
     # SIMPLE GETTERS (one value)
+    @cached
+    @execute(DeviceExecutor.READ)
+    @resilient
     def get_output_current(self) -> float:
         """
         This method gets the current output current.
         """
-        return float(self.query('R 0').strip('R'))
+        return self.read_parameter(0)
     
+    @cached
+    @execute(DeviceExecutor.READ)
+    @resilient
     def get_magnet_current(self) -> float:
         """
         This method gets the current magnet current.
         """
-        return float(self.query('R 2').strip('R'))
+        return self.read_parameter(2)
         
+    @cached
+    @execute(DeviceExecutor.READ)
+    @resilient
     def get_setpoint_current(self) -> float:
         """
         This method gets the current target current.
         """
-        return float(self.query('R 5').strip('R'))
+        return self.read_parameter(5)
         
+    @cached
+    @execute(DeviceExecutor.READ)
+    @resilient
     def get_sweep_rate_current(self) -> float:
         """
         This method gets the current sweep rate in amp/minute.
         """
-        return float(self.query('R 6').strip('R'))
+        return self.read_parameter(6)
     
+    @cached
+    @execute(DeviceExecutor.READ)
+    @resilient
     def get_output_field(self) -> float:
         """
         This method gets the output field (in sweep) in Teslas.
         """
-        return float(self.query('R 7').strip('R'))
+        return self.read_parameter(7)
         
+    @cached
+    @execute(DeviceExecutor.READ)
+    @resilient
     def get_setpoint_field(self) -> float:
         """
         This method gets the target field (setpoint) in Teslas.
         """
-        return float(self.query('R 8').strip('R'))
+        return self.read_parameter(8)
     
+    @cached
+    @execute(DeviceExecutor.READ)
+    @resilient
     def get_sweep_rate_field(self) -> float:
         """
         This method gets the field sweep rate Tesla/min.
         """
-        return float(self.query('R 9').strip('R'))
+        return self.read_parameter(9)
         
+    @cached
+    @execute(DeviceExecutor.READ)
+    @resilient
     def get_persistent_current(self) -> float:
         """
         This method gets the persistent current (no sweeping) in Amps.
         """
-        return float(self.query('R 16').strip('R'))
+        return self.read_parameter(16)
     
+    @cached
+    @execute(DeviceExecutor.READ)
+    @resilient
     def get_persistent_field(self) -> float:
         """
         This method gets the persistent field (no sweeping) in Teslas.
         """
-        return float(self.query('R 18').strip('R'))
+        return self.read_parameter(18)
     
+    @cached
+    @execute(DeviceExecutor.READ)
+    @resilient
     def get_heater_current(self) -> float:
         """
         This method gets the heater current in miliAmps.
         """
-        return float(self.query('R 20').strip('R'))
+        return self.read_parameter(20)
     
     #STATUS STRING HANDLING
+    @cached
+    @execute(DeviceExecutor.READ)
+    @resilient
     def get_status(self) -> str:
         """
         This method reads the IPS status string and returs list of 9 integers.
         Each integer represents a status of a different subsystem (consult IPS manual for more details)
         """
-        response_raw = self.query('X')
-        response_pattern = re.compile(r'X(\d)(\d)A(\d)C(\d)H(\d)M(\d)(\d)P(\d)(\d)')
-        response = [int(r) for r in response_pattern.search(response_raw).groups()]
+        return self.decode_status(self.query('X'))
+
+    def decode_status(self, response_raw: str) -> dict:
+        match = STATUS_PATTERN.search(response_raw)
+        if match is None:
+            raise ValueError(f'Unexpected status response {response_raw!r}')
+        response = [int(r) for r in match.groups()]
 
         system_status = f'{self.system_status_m[response[0]]}, {self.system_status_n[response[1]]}'
         activity_status = self.activity_status[response[2]]
@@ -174,121 +313,198 @@ class IPS120:
                 'activity_status': activity_status,
                 'heater_status': heater_status}
     
+    @cached
     def get_is_heater_on(self) -> bool:
         """
         This method returns a bool value if the heater is turned on.
         """
-        return self.get_status()['heater_status'] == 'On'
+        return status_flags(self.get_status())['is_heater_on']
 
+    @cached
     def get_is_on_hold(self) -> bool:
         """
         This method returns a bool value if the IPS is on hold
         """
-        return self.get_status()['activity_status'] == 'Hold'
+        return status_flags(self.get_status())['is_on_hold']
     
+    @cached
     def get_is_going_to_setpoint(self) -> bool:
         """
         This method returns a bool value is the IPS going to setpoint.
         """
-        return self.get_status()['activity_status'] == 'To setpoint'
+        return status_flags(self.get_status())['is_going_to_setpoint']
     
+    @cached
     def get_is_going_to_zero(self) -> bool:
         """
         This method returns a bool value is the IPS going to zero.
         """
-        return self.get_status()['activity_status'] == 'To zero'
+        return status_flags(self.get_status())['is_going_to_zero']
     
+    @cached
     def get_is_clamped(self) -> bool:
         """
         This method checks whether the output is clamped.
         """
-        return self.get_status()['activity_status'] == 'Clamped'
+        return status_flags(self.get_status())['is_clamped']
+
+    # MULTI-READING GETTERS
+    @cached
+    @execute(DeviceExecutor.READ)
+    @resilient
+    def get_snapshot(self) -> dict:
+        """
+        This method reads the status string and all snapshot readings in one I/O worker operation (no other
+        command is interleaved) and returns them as one timestamped record with the boolean helper values.
+        """
+        status = self.decode_status(self.query('X'))
+        readings = {name: self.read_parameter(parameter) for name, parameter in SNAPSHOT_READINGS}
+        flags = status_flags(status)
+        snapshot = dict(readings, **status, **flags, timestamp=time.time())
+
+        # Seed the cache: single-value getters and boolean helpers can be answered from the snapshot
+        self.cache.put(self.get_status, status)
+        for name, value in list(readings.items()) + list(flags.items()):
+            self.cache.put(getattr(self, f'get_{name}'), value)
+        return snapshot
     
+    @execute(DeviceExecutor.READ)
+    @resilient
+    def read_field_sample(self) -> tuple:
+        """
+        This method reads output field [T] and output current [A] in one I/O worker operation and returns
+        (timestamp, output field, output current); timestamp is the middle of the two readings.
+        """
+        start = time.time()
+        output_field = self.read_parameter(7)
+        output_current = self.read_parameter(0)
+        return (start + time.time())/2, output_field, output_current
+
+    # REMOTE CONTROL SESSIONS
+    @contextmanager
+    def remote_control(self):
+        """
+        This method puts the IPS in remote control (C1) for the block and back to local (C0) after it. Nested blocks
+        (setters called inside apply_session) reuse the outer session.
+        """
+        self.remote_depth += 1
+        try:
+            if self.remote_depth == 1:
+                self.query('C1')
+            yield
+        finally:
+            self.remote_depth -= 1
+            if self.remote_depth == 0:
+                self.query('C0')
+
+    @execute(DeviceExecutor.WRITE)
+    def apply_session(self, steps: list):
+        """
+        This method applies an ordered list of setters in one remote control session: C1 is sent once before the
+        first and C0 once after the last step, and no other command is interleaved. Every step is a dict with the
+        setter name (method, one of SESSION_METHODS) and its keyword (dict) or positional (list) arguments (args),
+        e.g. [{'method': 'set_sweep_rate_field', 'args': {'sweep_rate': 0.1}},
+              {'method': 'set_setpoint_field', 'args': [2.5]}, {'method': 'set_go_to_setpoint'}].
+        """
+        calls = []
+        # Validate all steps before the IPS is put in remote control
+        for step in steps:
+            if step.get('method') not in SESSION_METHODS:
+                raise ValueError(f'{step.get("method")} cannot be applied in a remote control session')
+            calls.append((getattr(self, step['method']), step.get('args') or []))
+        with self.remote_control():
+            for function, args in calls:
+                if isinstance(args, dict):
+                    function(**args)
+                else:
+                    function(*args)
+
     # SIMPLE SETTERS
+    @execute(DeviceExecutor.CONTROL)
     def set_hold(self):
         """
         This method sends the HOLD command.
         """
-        self.query('C1')
-        self.query('A0')
-        self.query('C0')
+        with self.remote_control():
+            self.query('A0')
 
+    @execute(DeviceExecutor.WRITE)
     def set_go_to_setpoint(self):
         """
         This method sends the GO TO SETPOINT command.
         """
-        self.query('C1')
-        self.query('A1')
-        self.query('C0')
+        with self.remote_control():
+            self.query('A1')
 
+    @execute(DeviceExecutor.CONTROL)
     def set_go_to_zero(self):
         """
         This method sends the GO TO ZERO command.
         """
-        self.query('C1')
-        self.query('A2')
-        self.query('C0')
+        with self.remote_control():
+            self.query('A2')
     
+    @execute(DeviceExecutor.CONTROL)
     def set_clamped(self):
         """
         This method clamps the output.
         """
-        self.query('C1')
-        self.query('A4')
-        self.query('C0')
+        with self.remote_control():
+            self.query('A4')
 
+    @execute(DeviceExecutor.CONTROL)
     def set_heater_off(self):
         """
         This method turns off the heater.
         """
-        self.query('C1')
-        self.query('H0')
-        self.query('C0')
+        with self.remote_control():
+            self.query('H0')
 
+    @execute(DeviceExecutor.WRITE)
     def set_heater_on(self):
         """
         This method turns on the heater.
         """
-        self.query('C1')
-        self.query('H1')
-        self.query('C0')
+        with self.remote_control():
+            self.query('H1')
         
+    @execute(DeviceExecutor.WRITE)
     def set_setpoint_current(self, setpoint_current: float):
         """
         This method sets the current [Amps] setpoint. Current can be negative and the method
         will handle the polarity change.
         """
-        self.query('C1')
-        self.query(f'I{setpoint_current:.3f}')
-        self.query('C0')
+        with self.remote_control():
+            self.query(f'I{setpoint_current:.3f}')
         self.ips.clear()
 
+    @execute(DeviceExecutor.WRITE)
     def set_setpoint_field(self, setpoint_field: float):
         """
         This method set the field [Tesla] setpoint. Field can be negative and the method
         will handle the polarity change.
         """
-        self.query('C1')
-        self.query(f'J{setpoint_field:.4f}')
-        self.query('C0')
+        with self.remote_control():
+            self.query(f'J{setpoint_field:.4f}')
 
+    @execute(DeviceExecutor.WRITE)
     def set_sweep_rate_current(self, sweep_rate: float):
         """
         This method set the current sweep rate [Amps/min].
         """
-        self.query('C1')
-        self.query(f'S{abs(sweep_rate):.2f}')
-        self.query('C0')
+        with self.remote_control():
+            self.query(f'S{abs(sweep_rate):.2f}')
 
+    @execute(DeviceExecutor.WRITE)
     def set_sweep_rate_field(self, sweep_rate: float):
         """
         This method set the field sweep rate [Teslas/min].
         """
-        self.query('C1')
-        self.query(f'T{abs(sweep_rate):.3f}')
-        self.query('C0')
+        with self.remote_control():
+            self.query(f'T{abs(sweep_rate):.3f}')
 
     ### HIGHER LEVEL COMMANDS ###
+    # Long-running: meant to run as jobs (/jobs), which follow their progress and can cancel them while waiting
     def set_magnet_field(self, magnet_field: float, ramp_rate: float = None):
         """
         This method changes the field in magnet but does NOT go to persistent mode. This method can be used for
@@ -296,24 +512,34 @@ class IPS120:
         """
         if ramp_rate:
             self.set_sweep_rate_field(ramp_rate)
-        time.sleep(1)
+        sleep(1)
 
         # Go to the current field and turn on heater
         if self.get_persistent_field() != self.get_output_field() and not self.get_is_heater_on():
-            self.set_setpoint_field(self.get_persistent_field())
-            self.set_go_to_setpoint()
-            while self.get_persistent_field() != self.get_output_field():
-                time.sleep(5)
-            self.set_hold()
-            self.set_heater_on()
-            time.sleep(60)
+            report_progress(message='Matching output field to persistent field')
+            self.apply_session([{'method': 'set_setpoint_field', 'args': [self.get_persistent_field()]},
+                                {'method': 'set_go_to_setpoint'}])
+            while abs(self.get_persistent_field() - self.get_output_field()) > self.field_tolerance:
+                sleep(5)
+            self.apply_session([{'method': 'set_hold'}, {'method': 'set_heater_on'}])
+            report_progress(message='Waiting for the switch heater')
+            sleep(60)
 
         # Go to setpoint field
-        self.set_setpoint_field(magnet_field)
-        self.set_go_to_setpoint()
-        while self.get_output_field() != self.get_setpoint_field():
-            time.sleep(5)
-        self.set_hold()
+        start_field = self.get_output_field()
+        report_progress(0.0, f'Sweeping from {start_field} T to {magnet_field} T')
+        self.apply_session([{'method': 'set_setpoint_field', 'args': [magnet_field]}, {'method': 'set_go_to_setpoint'}])
+        try:
+            output_field = start_field
+            while abs(output_field - magnet_field) > self.field_tolerance:
+                if magnet_field != start_field:
+                    report_progress(abs(output_field - start_field)/abs(magnet_field - start_field))
+                sleep(5)
+                output_field = self.get_output_field()
+        finally:
+            # Also stop the sweep if cancelled
+            self.set_hold()
+        report_progress(1.0, f'Field {magnet_field} T reached')
 
     def set_persistent_magnet_field(self, magnet_field: float, ramp_rate: float = None):
         """
@@ -325,10 +551,63 @@ class IPS120:
             current_setpoint = magnet_field - (current_field - magnet_field) / 2
             self.set_magnet_field(magnet_field, ramp_rate)
             current_field = self.get_output_field()
-            time.sleep(1)
+            sleep(1)
         self.set_magnet_field(magnet_field)
         self.set_heater_off()
-        time.sleep(60)
-        self.set_go_to_zero()
-        self.set_hold()
-        self.set_clamped()
+        report_progress(message='Waiting for the switch heater to cool down')
+        sleep(60)
+        self.apply_session([{'method': 'set_go_to_zero'}, {'method': 'set_hold'}, {'method': 'set_clamped'}])
+
+    def run_field_profile(self, segments: list, tolerance: float = None, sample_interval: float = None) -> dict:
+        """
+        This method sweeps the field through a profile of segments, each a dict with the target field [T], an
+        optional sweep rate [T/min] and an optional dwell time [s] at the target, e.g.
+        [{'field': 1.0, 'rate': 0.1}, {'field': 2.0, 'dwell': 600}, {'field': 0.0, 'rate': 0.2}].
+        A segment ends when the output field is within tolerance [T] of its target and the dwell time has passed.
+        Output field and current are logged every sample_interval [s] into profile_log, which can be read while the
+        profile runs. The switch heater must be on (e.g. after set_magnet_field); the IPS is put on hold at the end,
+        also if the profile fails or is cancelled. Returns a summary; meant to run as a job.
+        """
+        tolerance = self.field_tolerance if tolerance is None else float(tolerance)
+        sample_interval = self.profile_sample_interval if sample_interval is None else float(sample_interval)
+        # Validate the whole profile before the first sweep
+        profile = [(float(segment['field']), float(segment['rate']) if segment.get('rate') else None,
+                    float(segment.get('dwell', 0))) for segment in segments]
+        if any(rate is not None and rate <= 0 for field, rate, dwell in profile) or \
+                any(dwell < 0 for field, rate, dwell in profile):
+            raise ValueError('Sweep rates must be positive and dwell times non-negative')
+
+        self.profile_log = log = SampleLog(PROFILE_LOG_COLUMNS)
+        started = time.monotonic()
+        next_sample = started
+
+        def sample(index: int, field: float) -> float:
+            timestamp, output_field, output_current = self.read_field_sample()
+            log.append(timestamp, index, field, output_field, output_current)
+            return output_field
+
+        def wait():
+            # Fixed sample rate, independent of the query time
+            nonlocal next_sample
+            next_sample = max(next_sample + sample_interval, time.monotonic())
+            sleep(max(0.0, next_sample - time.monotonic()))
+
+        try:
+            for index, (field, rate, dwell) in enumerate(profile):
+                report_progress(index/len(profile), f'Segment {index + 1}/{len(profile)}: sweeping to {field} T')
+                steps = [{'method': 'set_sweep_rate_field', 'args': [rate]}] if rate is not None else []
+                self.apply_session(steps + [{'method': 'set_setpoint_field', 'args': [field]},
+                                            {'method': 'set_go_to_setpoint'}])
+                # Arrival: output field within tolerance of the target
+                while abs(sample(index, field) - field) > tolerance:
+                    wait()
+                if dwell:
+                    report_progress(message=f'Segment {index + 1}/{len(profile)}: dwelling {dwell} s at {field} T')
+                    dwell_end = time.monotonic() + dwell
+                    while time.monotonic() < dwell_end:
+                        wait()
+                        sample(index, field)
+        finally:
+            self.set_hold()
+        report_progress(1.0, f'Profile of {len(profile)} segments finished')
+        return {'segments': len(profile), 'samples': len(log), 'duration': time.monotonic() - started}
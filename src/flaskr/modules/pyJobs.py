@@ -0,0 +1,220 @@
+#!/usr/bin/env python
+
+"""
+
+Asynchronous jobs for long-running device operations (magnet field sweeps, stepper motor moves, ...). A job runs a
+device class method on a worker pool and the HTTP request returns its id at once; clients poll (or long-poll) the job
+status, follow its progress and cancel it. Jobs of the same device run one at a time, in submission order. Device
+classes report progress and honour cancellation through sleep(), report_progress() and cancelled(), which behave as
+plain calls outside of jobs.
+
+"""
+
+__author__ = "Ivan Jakovac"
+__email__ = "ivan.jakovac2@gmail.com"
+__version__ = "v0.1"
+
+#  Copyright (C) 2020-2025 Ivan Jakovac
+#
+#  This program is free software: you can redistribute it and/or modify it under the terms of the GNU General Public
+#  License as published by the Free Software Foundation, either version 3 of the License, or (at your option) any
+#  later version.
+#
+#  This program is distributed in the hope that it will be useful, but WITHOUT ANY WARRANTY; without even the implied
+#  warranty of MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License along with this program. If not,
+#  see <https://www.gnu.org/licenses/>.
+
+import time
+import uuid
+from collections import OrderedDict, defaultdict, deque
+from concurrent.futures import ThreadPoolExecutor
+from threading import Condition, Event, local
+from prometheus_client import Gauge, Counter
+
+running_jobs = Gauge('jobs_running', 'Jobs currently running', ['device'])
+finished_jobs = Counter('jobs_finished', 'Finished jobs by final status', ['device', 'status'])
+
+# Job of the current worker thread
+context = local()
+
+class JobCancelled(Exception):
+    pass
+
+class Job:
+    QUEUED = 'queued'
+    RUNNING = 'running'
+    SUCCEEDED = 'succeeded'
+    FAILED = 'failed'
+    CANCELLED = 'cancelled'
+    FINISHED = (SUCCEEDED, FAILED, CANCELLED)
+
+    def __init__(self, device: str, method: str, function, args: tuple, kwargs: dict, condition: Condition) -> None:
+        """
+        Class holds the state of a single job. Every change increments version and wakes up long-polling clients.
+        """
+        self.id = uuid.uuid4().hex
+        self.device = device
+        self.method = method
+        self.function = function
+        self.args = args
+        self.kwargs = kwargs
+        self.condition = condition
+        self.cancel_event = Event()
+        self.status = Job.QUEUED
+        self.progress = None
+        self.message = ''
+        self.result = None
+        self.error = None
+        self.submitted = time.time()
+        self.started = None
+        self.finished = None
+        self.version = 0
+
+    @property
+    def done(self) -> bool:
+        return self.status in Job.FINISHED
+
+    def update(self, **changes):
+        with self.condition:
+            for name, value in changes.items():
+                setattr(self, name, value)
+            self.version += 1
+            self.condition.notify_all()
+
+    def to_dict(self) -> dict:
+        with self.condition:
+            return {'id': self.id, 'device': self.device, 'method': self.method, 'status': self.status,
+                    'progress': self.progress, 'message': self.message, 'error': self.error,
+                    'submitted': self.submitted, 'started': self.started, 'finished': self.finished,
+                    'version': self.version}
+
+class JobManager:
+    def __init__(self, max_workers: int = 4, history: int = 200) -> None:
+        """
+        Class runs jobs on a worker pool, one job per device at a time, and keeps the last history jobs
+        """
+        self.pool = ThreadPoolExecutor(max_workers, thread_name_prefix='job')
+        self.history = history
+        self.jobs = OrderedDict()
+        # Jobs waiting for their device and devices with a running job
+        self.pending = defaultdict(deque)
+        self.busy = set()
+        self.condition = Condition()
+
+    def submit(self, device: str, method: str, function, *args, **kwargs) -> Job:
+        job = Job(device, method, function, args, kwargs, self.condition)
+        with self.condition:
+            self.jobs[job.id] = job
+            self.trim()
+            if device in self.busy:
+                self.pending[device].append(job)
+            else:
+                self.busy.add(device)
+                self.pool.submit(self.run, job)
+        return job
+
+    def trim(self):
+        # Forget the oldest finished jobs (running and queued jobs are always kept)
+        finished = [job_id for job_id, job in self.jobs.items() if job.done]
+        for job_id in finished[:max(0, len(self.jobs) - self.history)]:
+            del self.jobs[job_id]
+
+    def run(self, job: Job):
+        try:
+            with self.condition:
+                # Job may have been cancelled while queued
+                start = job.status == Job.QUEUED
+                if start:
+                    job.update(status=Job.RUNNING, started=time.time())
+            if start:
+                self.execute(job)
+        finally:
+            # Start the next job of the device
+            with self.condition:
+                self.trim()
+                if self.pending[job.device]:
+                    self.pool.submit(self.run, self.pending[job.device].popleft())
+                else:
+                    self.busy.discard(job.device)
+
+    def execute(self, job: Job):
+        running_jobs.labels(job.device).inc()
+        context.job = job
+        try:
+            result = job.function(*job.args, **job.kwargs)
+            job.update(status=Job.SUCCEEDED, result=result, progress=1.0, finished=time.time())
+        except JobCancelled:
+            job.update(status=Job.CANCELLED, finished=time.time())
+        except Exception as error:
+            job.update(status=Job.FAILED, error=f'{type(error).__name__}: {error}', finished=time.time())
+        finally:
+            context.job = None
+            running_jobs.labels(job.device).dec()
+            finished_jobs.labels(job.device, job.status).inc()
+
+    def get(self, job_id: str) -> Job:
+        """
+        Returns a job by its id. Raises KeyError for unknown (or forgotten) jobs.
+        """
+        with self.condition:
+            return self.jobs[job_id]
+
+    def list(self) -> list:
+        with self.condition:
+            return list(self.jobs.values())
+
+    def cancel(self, job_id: str) -> Job:
+        """
+        Cancels a job: a queued job does not start, a running job stops at its next sleep() or cancelled() check.
+        """
+        job = self.get(job_id)
+        job.cancel_event.set()
+        with self.condition:
+            if job.status == Job.QUEUED:
+                if job in self.pending[job.device]:
+                    self.pending[job.device].remove(job)
+                job.update(status=Job.CANCELLED, finished=time.time())
+                finished_jobs.labels(job.device, Job.CANCELLED).inc()
+        return job
+
+    def wait(self, job: Job, version: int = None, timeout: float = 30) -> Job:
+        """
+        Long poll: waits until the job changes after version (or finishes) or timeout [s] passes
+        """
+        with self.condition:
+            self.condition.wait_for(lambda: job.done or (version is not None and job.version > version), timeout)
+        return job
+
+# HELPERS FOR DEVICE CLASSES
+def current_job() -> Job:
+    """
+    Returns the job running on this thread, None outside of jobs
+    """
+    return getattr(context, 'job', None)
+
+def cancelled() -> bool:
+    job = current_job()
+    return job is not None and job.cancel_event.is_set()
+
+def sleep(seconds: float):
+    """
+    time.sleep() which raises JobCancelled as soon as the current job is cancelled
+    """
+    job = current_job()
+    if job is None:
+        time.sleep(seconds)
+    elif job.cancel_event.wait(seconds):
+        raise JobCancelled()
+
+def report_progress(progress: float = None, message: str = None):
+    """
+    Reports progress (0-1) and/or a status message of the current job, no-op outside of jobs
+    """
+    job = current_job()
+    if job is not None:
+        changes = {'progress': min(max(progress, 0.0), 1.0)} if progress is not None else {}
+        if message is not None:
+            changes['message'] = message
+        job.update(**changes)
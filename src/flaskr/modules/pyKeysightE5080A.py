@@ -23,9 +23,34 @@ __version__ = "v0.1"
 #  see <https://www.gnu.org/licenses/>.
 
 import pyvisa as visa
+import numpy as np
 import os
 import configparser
 import time
+from contextlib import nullcontext, contextmanager
+
+try:
+    from .pyExecutor import DeviceExecutor, execute, coalesce
+    from .pyTelemetryCache import TelemetryCache, cached
+    from .pyResilience import Resilience, resilient, close_resources
+    from .pyStateShadow import StateShadow, raw_command
+    from .pyWritePipeline import WritePipeline, pipelined
+    from .pyTraceAnalysis import TraceAnalysis, stitch
+except ImportError:
+    # Imported as a top-level module (tests)
+    from pyExecutor import DeviceExecutor, execute, coalesce
+    from pyTelemetryCache import TelemetryCache, cached
+    from pyResilience import Resilience, resilient, close_resources
+    from pyStateShadow import StateShadow, raw_command
+    from pyWritePipeline import WritePipeline, pipelined
+    from pyTraceAnalysis import TraceAnalysis, stitch
+
+def sweep_windows(start: float, stop: float, count: int, points: int) -> list:
+    """
+    Returns a frequency plan of count equal, adjacent sweep windows [(start, stop [in MHz], points), ...]
+    """
+    edges = np.linspace(start, stop, count + 1)
+    return [(float(edges[index]), float(edges[index + 1]), points) for index in range(count)]
 
 class KeysightE5080A:
     def __init__(self, address: str = None, device_present: bool = False) -> None:
@@ -36,6 +61,21 @@ class KeysightE5080A:
         path = os.path.dirname(__file__)
         config = configparser.ConfigParser()
         config.read(f'{path}/config.ini')
+        # Dedicated I/O worker serializes all communication with the device
+        self.executor = DeviceExecutor('KeysightE5080A', config.getint('KeysightE5080A', 'queue_size', fallback=100))
+        # Last value of every getter call, shared by the Prometheus worker and HTTP clients
+        self.cache = TelemetryCache(config.getint('KeysightE5080A', 'cache_size', fallback=256))
+        # Any write or reconnect may change what the getters return
+        self.executor.add_state_listener(self.cache.invalidate)
+        # Bounded retries of instrument errors; consecutive failures open a circuit breaker which reconnects
+        self.resilience = Resilience('KeysightE5080A', config, self.connect)
+        # Number of operations (averaging, stitching, trace streams, field scans) holding triggered sweeps
+        self.single_sweep_holders = 0
+        # Analysis of the last trace read by get_trace_analysis(): (trace, TraceAnalysis)
+        self.analysis = (None, None)
+        # Known settings (markers, display format, ...), used to skip commands which would not change anything
+        self.shadow = StateShadow('KeysightE5080A',
+                                  config.getfloat('KeysightE5080A', 'state_shadow_max_age', fallback=None))
 
         # since Python 3.8 Agilent visa32.dll fails to load because it cannot find its .dll dependencies.
         # These two folders should be added manually to the search path
@@ -55,11 +95,22 @@ class KeysightE5080A:
                 raise Exception('Resource address not provided!')
         
         self.device_present = device_present
+        # Trace transfer: binary blocks (REAL,64) decoded straight into NumPy arrays, or ASCII (mock VISA does not
+        # support binary blocks)
+        self.binary_transfer = device_present and config.getboolean('KeysightE5080A', 'binary_transfer', fallback=False)
+        # Write pipelining: consecutive writes are joined with ';' and sent with the next query (mock VISA splits
+        # joined messages)
+        self.pipeline_writes = device_present and config.getboolean('KeysightE5080A', 'pipeline_writes', fallback=False)
+        self.pipeline_opc_barrier = config.getboolean('KeysightE5080A', 'pipeline_opc_barrier', fallback=False)
+        self.pipeline_max_length = config.getint('KeysightE5080A', 'pipeline_max_length', fallback=1024)
         # Initialize communication
         self.connect()
         
     # Connector
+    @execute(DeviceExecutor.WRITE)
     def connect(self):
+        # Reconnect (e.g. breaker probe): release the previous session first
+        close_resources(getattr(self, 'VNA', None), getattr(self, 'rm', None))
         if self.device_present:
             self.rm = visa.ResourceManager()
         else:
@@ -67,39 +118,84 @@ class KeysightE5080A:
             self.rm = visa.ResourceManager(f'{os.path.dirname(__file__)}/pyvisa-sim.yaml@sim')
         # Initialize communication
         self.VNA = self.rm.open_resource(self.address, read_termination = '\r\n', write_termination = '\r\n')
+        if self.pipeline_writes:
+            self.VNA = WritePipeline(self.VNA, 'KeysightE5080A', self.pipeline_max_length, self.pipeline_opc_barrier)
         # Set non-typical parameters
         self.VNA.write(':CALC1:PAR:SEL "CH1_S11_1"')
+        # Settings may have changed while disconnected
+        self.shadow.invalidate()
+
+    def write_pipeline(self):
+        """
+        Returns the context in which writes are buffered and sent with the next query (no-op if disabled)
+        """
+        return self.VNA.pipelined() if isinstance(self.VNA, WritePipeline) else nullcontext()
 
     # Query/Write functions to issue a direct query/write command and receive raw response
+    # Only queries (commands with '?') are coalesced
+    @raw_command
+    @coalesce(lambda command: '?' in command)
+    @execute(DeviceExecutor.READ)
+    @resilient
     def query(self, argument):
-        try:
-            return self.VNA.query(argument)
-        except Exception as e:
-            print(e)
-            return ""
+        return self.VNA.query(argument)
 
+    @raw_command
+    @execute(DeviceExecutor.WRITE)
+    @resilient(retry=False)
     def write(self, argument):
-        try:
-            return self.VNA.write(argument)
-        except Exception as e:
-            print(e)
-            return ""
+        return self.VNA.write(argument)
+
+    # SETTINGS (sent only if the instrument does not have them already)
+    @execute(DeviceExecutor.WRITE)
+    def set_marker_on(self, marker_index: int):
+        """
+        Turns on Marker [marker_index]
+        """
+        self.shadow.apply(('marker', marker_index), 'ON', self.write, f':CALC1:MARK{marker_index} ON')
+
+    @execute(DeviceExecutor.WRITE)
+    def set_display_format(self, display_format: str):
+        """
+        Sets the display format of the measurement, e.g. MLOG [dB] or MLIN
+        """
+        self.shadow.apply('format', display_format, self.write, f':CALC1:FORM {display_format}')
 
     # SIMPLE GETTERS (one value)
+    @cached
+    @execute(DeviceExecutor.READ)
+    @pipelined
+    @resilient
     def get_marker_X(self, marker_index: int) -> float:
         """
         Gets the position [in MHz] Marker [marker_index]
         """
-        self.write(f':CALC1:MARK{marker_index} ON')
+        self.set_marker_on(marker_index)
         return float(self.query(f':CALC1:MARK{marker_index}:X?'))/1000000 
 
+    @cached
+    @execute(DeviceExecutor.READ)
+    @resilient
     def get_marker_Y(self, marker_index: int) -> float:
         """
         Gets the S11 value [in dB] for Marker [marker_index]
         """
-        self.write(f':CALC1:MARK{marker_index} ON')
+        self.set_display_format('MLOG')
+        return self.read_marker_Y(marker_index)
+
+    @execute(DeviceExecutor.READ)
+    @pipelined
+    @resilient
+    def read_marker_Y(self, marker_index: int) -> float:
+        """
+        Reads the value of Marker [marker_index] in the current display format
+        """
+        self.set_marker_on(marker_index)
         return float(self.query(f':CALC1:MARK{marker_index}:Y?').split(',')[0])
     
+    @cached
+    @execute(DeviceExecutor.READ)
+    @resilient
     def get_marker_Y_at(self, marker_index: int, frequency: float) -> float:
         """
         Sets the position [in MHz] of a Marker [marker_index] and then returns its S11 value.
@@ -107,6 +203,10 @@ class KeysightE5080A:
         self.set_marker_X(marker_index, frequency)
         return float(self.get_marker_Y(marker_index))
         
+    @cached
+    @execute(DeviceExecutor.READ)
+    @pipelined
+    @resilient
     def get_minimum(self, marker_index: int) -> float:
         """
         Gets the position [in MHz] of the S11 minimum in current sweep range
@@ -114,12 +214,19 @@ class KeysightE5080A:
         self.write(f':CALC1:MARK{marker_index}:FUNC:EXEC MIN')
         return self.get_marker_X(marker_index)
     
+    @cached
+    @execute(DeviceExecutor.READ)
+    @resilient
     def get_sweep_points(self) -> int:
         """
         Get the number of sweep points
         """
         return int(self.query(f':SENS1:SWE:POIN?'))
     
+    @cached
+    @execute(DeviceExecutor.READ)
+    @pipelined
+    @resilient
     def get_Q(self, marker_index: int) -> float:
         """
         Returns "the NMR Q-value" measured at 13 dB.
@@ -129,16 +236,25 @@ class KeysightE5080A:
         self.write(f':SENS1:FREQ:CENT {frequency*1e6:.0f}')
 
         # Turn on bandwidth search and set threshold to 13 dB
+        self.set_display_format('MLOG')
         self.write(f':CALC1:MEAS1:MARK{marker_index}:NOTC ON')
-        self.write(f':CALC1:MEAS1:MARK{marker_index}:NOTC:REF PEAK')
-        self.write(f':CALC1:MEAS1:MARK{marker_index}:NOTC:THR -13')
+        self.shadow.apply(('notch_reference', marker_index), 'PEAK', self.write,
+                          f':CALC1:MEAS1:MARK{marker_index}:NOTC:REF PEAK')
+        self.shadow.apply(('notch_threshold', marker_index), -13, self.write,
+                          f':CALC1:MEAS1:MARK{marker_index}:NOTC:THR -13')
 
         # Query and return the data
         data = self.query(f':CALC1:MEAS1:MARK{marker_index}:NOTC:DATA?')
         self.write(f':CALC1:MEAS1:MARK{marker_index}:NOTC OFF')
-        return float(data.strip('\n').split(',')[2])
+        fields = data.strip('\n').split(',')
+        if len(fields) < 3:
+            raise ValueError(f'Notch data {data!r} has no Q value')
+        return float(fields[2])
     
     # COMPLEX GETTERS (list of values)
+    @cached
+    @execute(DeviceExecutor.READ)
+    @resilient
     def get_sweep_range(self) -> list:
         """
         Gets the sweep range [in MHz]
@@ -147,6 +263,10 @@ class KeysightE5080A:
         stop = float(self.query(':SENS1:FREQ:STOP?'))/1e6
         return start, stop
 
+    @cached
+    @execute(DeviceExecutor.READ)
+    @pipelined
+    @resilient
     def get_filter(self, marker_index: int, threshold: float = 0.5) -> list:
         """
         Gets the filter data [bandwidth, center, Q value, insertion loss] for a Marker [marker_index].
@@ -155,55 +275,232 @@ class KeysightE5080A:
         frequency = self.get_minimum(marker_index)
         self.write(f':SENS1:FREQ:CENT {frequency*1e6:.0f}')
 
-        # Set display format to linear
-        self.write(':CALC1:FORM MLIN')
+        # Set display format to linear. It is not reset afterwards: getters which need dB (MLOG) set it themselves,
+        # so repeated filter measurements do not switch the format back and forth
+        self.set_display_format('MLIN')
         
         # Turn on bandwidth search and set threshold to half-maximum
-        value = self.get_marker_Y_at(marker_index, frequency)
+        self.set_marker_X(marker_index, frequency)
+        value = self.read_marker_Y(marker_index)
         self.write(f':CALC1:MEAS1:MARK{marker_index}:BWID ON')
         self.write(f':CALC1:MEAS1:MARK{marker_index}:BWID:THR {(1-value)/2:.2f}')
 
         # Query and return the data
         data = self.query(f':CALC1:MEAS1:MARK{marker_index}:BWID:DATA?')
 
-        # Reset display format
         self.write(f':CALC1:MEAS1:MARK{marker_index}:BWID OFF')
-        self.write(':CALC1:FORM MLOG')
         return [float(value) for value in data.strip('\n').split(',')]
     
-    def get_complex_data(self) -> list:
+    @execute(DeviceExecutor.READ)
+    @resilient
+    def read_frequencies(self) -> np.ndarray:
         """
-        Reads corrected data from the CALC1. Output data is formatted as (Freq, Complex)
+        Reads the sweep frequencies [in MHz]: the instrument's x-axis (binary transfer) or a linear sweep computed from
+        the sweep range and number of points.
+        """
+        if self.binary_transfer:
+            return self.read_binary_block(':CALC1:MEAS1:X?')/1e6
+        start, stop = self.get_sweep_range()
+        return np.linspace(start, stop, self.get_sweep_points())
+
+    @execute(DeviceExecutor.READ)
+    @resilient
+    def read_trace(self) -> np.ndarray:
+        """
+        Reads corrected data from the CALC1 as a complex NumPy array.
+        """
+        if self.binary_transfer:
+            raw_data = self.read_binary_block(':CALC1:MEAS1:DATA:SDAT?')
+        else:
+            # VNA returns data as string "real,imag,real,imag,..."
+            raw_data = np.array(self.query(':CALC1:MEAS1:DATA:SDAT?').split(','), dtype=np.float64)
+        if len(raw_data) % 2:
+            # Truncated or garbled reply: not a sequence of (real, imag) pairs
+            raise ValueError(f'Trace of {len(raw_data)} values is not a sequence of (real, imag) pairs')
+        # Interleaved (real, imag) pairs are a complex128 array
+        return raw_data.view(np.complex128)
+
+    @execute(DeviceExecutor.READ)
+    @pipelined
+    @resilient
+    def read_binary_block(self, command: str) -> np.ndarray:
+        """
+        Queries a REAL,64 binary block and decodes it straight into a NumPy array.
+        """
+        # 64-bit floats in little-endian byte order (no byte swapping needed on the PC)
+        self.write(':FORM:DATA REAL,64')
+        self.shadow.apply('byte_order', 'SWAP', self.write, ':FORM:BORD SWAP')
+        try:
+            return self.VNA.query_binary_values(command, datatype='d', is_big_endian=False, container=np.array)
+        finally:
+            # Other queries expect ASCII responses
+            self.write(':FORM:DATA ASCII,0')
+
+    @cached
+    @execute(DeviceExecutor.READ)
+    @resilient
+    def get_complex_array(self) -> tuple:
+        """
+        Reads corrected data from the CALC1 as NumPy arrays: (frequencies [in MHz], complex S11 data).
+        """
+        return self.read_frequencies(), self.read_trace()
+
+    # TRACE ANALYSIS (figures of merit computed from one trace, without the marker and bandwidth search engine)
+    def get_trace_analysis(self, max_age: float = None) -> tuple:
+        """
+        Returns (TraceAnalysis, age) of the latest trace. A new trace is read only if the cached one is older than
+        max_age [s]; analyses of the same trace share their results.
+        """
+        trace, age = self.cache.fetch(self.get_complex_array, max_age)
+        analysed_trace, analysis = self.analysis
+        if analysed_trace is not trace:
+            analysis = TraceAnalysis(*trace)
+            self.analysis = (trace, analysis)
+        return analysis, age
+
+    def forget_trace(self):
+        """
+        Drops the cached trace and its analysis: after a sweep change the frequency axis is no longer valid.
+        """
+        self.cache.discard(self.get_complex_array)
+        self.cache.discard(self.get_complex_data)
+        self.analysis = (None, None)
+
+    def analyze_trace(self, markers: list = (), notch_threshold: float = -13, filter_threshold: float = 0.5,
+                      max_age: float = None) -> dict:
+        """
+        Returns the minimum [in MHz, dB], notch and filter data [bandwidth, center, Q value, loss] and S11 [in dB] at
+        marker frequencies [in MHz] of the latest trace.
+        """
+        return self.get_trace_analysis(max_age)[0].analyze(markers, notch_threshold, filter_threshold)
+
+    # TRIGGERED SWEEPS
+    @execute(DeviceExecutor.WRITE)
+    def set_single_sweeps(self, enabled: bool = True):
+        """
+        Switches between single triggered sweeps (hold, see acquire_trace) and continuous sweeps.
+        """
+        self.write(f':INIT1:CONT {"OFF" if enabled else "ON"}')
+
+    @execute(DeviceExecutor.WRITE)
+    def hold_single_sweeps(self):
+        """
+        Switches to single triggered sweeps unless another operation already holds them. Runs on the I/O worker, so
+        holders are counted without a lock.
+        """
+        self.single_sweep_holders += 1
+        if self.single_sweep_holders == 1:
+            self.set_single_sweeps(True)
+
+    @execute(DeviceExecutor.WRITE)
+    def release_single_sweeps(self):
+        """
+        Resumes continuous sweeps when the last holder releases triggered sweeps.
+        """
+        self.single_sweep_holders = max(self.single_sweep_holders - 1, 0)
+        if self.single_sweep_holders == 0:
+            self.set_single_sweeps(False)
+
+    @contextmanager
+    def single_sweeps(self):
+        """
+        Holds single triggered sweeps for the duration of a with block (see hold_single_sweeps).
+        """
+        self.hold_single_sweeps()
+        try:
+            yield
+        finally:
+            self.release_single_sweeps()
+
+    @execute(DeviceExecutor.READ)
+    @pipelined
+    @resilient
+    def acquire_trace(self) -> np.ndarray:
+        """
+        Triggers a single sweep, waits until it is finished (*OPC?) and reads the trace as a complex NumPy array.
+        """
+        self.write(':INIT1:IMM')
+        self.query('*OPC?')
+        return self.read_trace()
+
+    @execute(DeviceExecutor.READ)
+    def get_averaged_array(self, count: int, bin_size: int = 1) -> tuple:
+        """
+        Acquires count triggered sweeps and returns their average as NumPy arrays: (frequencies [in MHz], complex S11
+        data). With bin_size > 1 every bin_size adjacent points are averaged into one (the last bin may be smaller).
+        """
+        if count < 1 or bin_size < 1:
+            raise ValueError('count and bin_size must be positive')
+        frequencies = self.read_frequencies()
+        # Traces are accumulated in place, one buffer for the whole average
+        average = np.zeros(len(frequencies), dtype=np.complex128)
+        with self.single_sweeps():
+            for _ in range(count):
+                np.add(average, self.acquire_trace(), out=average)
+        average /= count
+        if bin_size > 1:
+            starts = np.arange(0, len(average), bin_size)
+            sizes = np.diff(np.append(starts, len(average)))
+            frequencies = np.add.reduceat(frequencies, starts)/sizes
+            average = np.add.reduceat(average, starts)/sizes
+        return frequencies, average
+
+    @execute(DeviceExecutor.READ)
+    def get_stitched_array(self, segments: list) -> tuple:
+        """
+        Acquires a scan of sequential sweep windows [(start, stop [in MHz], points), ...] and returns it as one pair
+        of NumPy arrays: (frequencies [in MHz], complex S11 data), overlapping points counted once. The sweep range
+        and number of points are restored afterwards.
         """
-        # Find range and number of points to construct a list of frequencies
         start, stop = self.get_sweep_range()
         points = self.get_sweep_points()
-        frequencies = [start+i*(stop-start)/(points-1) for i in range(points)]
+        traces = []
+        with self.single_sweeps():
+            try:
+                for segment_start, segment_stop, segment_points in segments:
+                    self.set_sweep_range(segment_start, segment_stop)
+                    self.set_sweep_points(int(segment_points))
+                    traces.append((self.read_frequencies(), self.acquire_trace()))
+            finally:
+                self.set_sweep_range(start, stop)
+                self.set_sweep_points(points)
+        return stitch(traces)
 
-        # VNA returns data as string "real,imag,real,imag,...", format it and return
-        raw_data = self.query(':CALC1:MEAS1:DATA:SDAT?').split(',')
-        complex_data = [float(raw_data[2*i])+float(raw_data[2*i+1])*1j for i in range(points)]
-        return list(zip(frequencies, complex_data))     
+    @cached
+    @execute(DeviceExecutor.READ)
+    @resilient
+    def get_complex_data(self) -> list:
+        """
+        Reads corrected data from the CALC1. Output data is formatted as (Freq, Complex)
+        """
+        frequencies, complex_data = self.get_complex_array()
+        return list(zip(frequencies.tolist(), complex_data.tolist()))
 
     # SETTERS
+    @execute(DeviceExecutor.WRITE)
     def set_marker_X(self, marker_index: int, frequency: float):
         """
         Sets the frequency [in MHz] of a Marker [marker_index]
         """
         self.write(f':CALC1:MARK{marker_index}:X {frequency*1e6:.0f}')
 
+    @execute(DeviceExecutor.WRITE)
     def set_sweep_points(self, points: int):
         """
         Set the number of sweep points
         """
         self.write(f':SENS1:SWE:POIN {points:d}')
+        self.forget_trace()
 
+    @execute(DeviceExecutor.WRITE)
+    @pipelined
     def set_sweep_range(self, start, stop):
         """
         Sets the sweep range [in MHz]
         """
         self.write(f':SENS1:FREQ:STAR {start*1e6:.0f}')
         self.write(f':SENS1:FREQ:STOP {stop*1e6:.0f}')
+        self.forget_trace()
 
 if __name__=="__main__":
     ks = KeysightE5080A()
@@ -25,8 +25,32 @@ __version__ = "v0.1"
 
 import pyvisa as visa
 import os
+import time
 import configparser
-from threading import Lock
+
+try:
+    from .pyExecutor import DeviceExecutor, execute, coalesce
+    from .pyTelemetryCache import TelemetryCache, cached
+    from .pyResilience import Resilience, resilient, close_resources
+    from .pyAdaptiveDelay import AdaptiveDelay
+    from .pyStateShadow import StateShadow, raw_command
+except ImportError:
+    # Imported as a top-level module (tests)
+    from pyExecutor import DeviceExecutor, execute, coalesce
+    from pyTelemetryCache import TelemetryCache, cached
+    from pyResilience import Resilience, resilient, close_resources
+    from pyAdaptiveDelay import AdaptiveDelay
+    from pyStateShadow import StateShadow, raw_command
+
+# Snapshot queries: record field, query command and response type
+SNAPSHOT_CHANNEL_QUERIES = [('temperature', 'KRDG? {}', float),
+                            ('sensor', 'SRDG? {}', float)]
+SNAPSHOT_LOOP_QUERIES = [('setpoint', 'SETP? {}', float),
+                         ('heater_percent', 'HTR? {}', float),
+                         ('heater_range', 'RANGE? {}', int),
+                         ('ramp', 'RAMP? {}', lambda response: [float(value) for value in response.split(',')]),
+                         ('manual_output', 'MOUT? {}', float),
+                         ('PID', 'PID? {}', lambda response: [float(value) for value in response.split(',')])]
 
 class Lakeshore336:
     def __init__(self, address: str = None, device_present: bool = False) -> None:
@@ -37,7 +61,32 @@ class Lakeshore336:
         path = os.path.dirname(__file__)
         config = configparser.ConfigParser()
         config.read(f'{path}/config.ini')
-        self.device_in_use = Lock()
+        # Dedicated I/O worker serializes all communication with the device
+        self.executor = DeviceExecutor('Lakeshore336', config.getint('Lakeshore336', 'queue_size', fallback=100))
+        # Last value of every getter call, shared by the Prometheus worker and HTTP clients
+        self.cache = TelemetryCache(config.getint('Lakeshore336', 'cache_size', fallback=256))
+        # Any write or reconnect may change what the getters return
+        self.executor.add_state_listener(self.cache.invalidate)
+        # Bounded retries of instrument errors; consecutive failures open a circuit breaker which reconnects
+        self.resilience = Resilience('Lakeshore336', config, self.connect)
+        # Known settings (PID), used to skip redundant queries and writes
+        self.shadow = StateShadow('Lakeshore336', config.getfloat('Lakeshore336', 'state_shadow_max_age', fallback=None))
+        # Query delay: fixed, or learned per command type if adaptive_delay is enabled
+        self.query_delay = config.getfloat('Lakeshore336', 'query_delay', fallback=0.5)
+        if config.getboolean('Lakeshore336', 'adaptive_delay', fallback=False):
+            # Valid response has one value per query
+            # No retries of its own: @resilient on query() already retries the whole exchange
+            self.adaptive_delay = AdaptiveDelay('Lakeshore336', self.query_delay, retries=0,
+                                                validate=lambda command, response: (response.strip() != '' and
+                                                                                    response.count(';') == command.count(';')))
+        else:
+            self.adaptive_delay = None
+        # Channels and control loops read by get_snapshot(); several queries are joined with ';' in one message
+        self.snapshot_channels = [channel.strip() for channel in
+                                  config.get('Lakeshore336', 'snapshot_channels', fallback='A, B').split(',')]
+        self.snapshot_loops = [int(loop) for loop in
+                               config.get('Lakeshore336', 'snapshot_loops', fallback='2').split(',')]
+        self.max_message_length = config.getint('Lakeshore336', 'max_message_length', fallback=62)
 
         # Handle resource address
         if address is not None:
@@ -55,59 +104,90 @@ class Lakeshore336:
         self.connect()
 
     # Connector
+    @execute(DeviceExecutor.WRITE)
     def connect(self):
+        # Reconnect (e.g. breaker probe): release the previous session first
+        close_resources(getattr(self, 'ls336', None), getattr(self, 'rm', None))
         if self.device_present:
             self.rm = visa.ResourceManager()
         else:
             # Mock VISA
             self.rm = visa.ResourceManager(f'{os.path.dirname(__file__)}/pyvisa-sim.yaml@sim')
         # Initialize communication
-        self.ls336 = self.rm.open_resource(self.address, read_termination = '\r\n', write_termination = '\r\n', query_delay=0.5)
+        self.ls336 = self.rm.open_resource(self.address, read_termination = '\r\n', write_termination = '\r\n', query_delay=self.query_delay)
         # Set non-typical parameters
         self.ls336.baud_rate = 57600
         self.ls336.data_bits = 7
         self.ls336.parity = visa.constants.Parity.odd
+        # Settings may have changed while disconnected
+        self.shadow.invalidate()
 
     # Query/Write functions to issue a direct query/write command and receive raw response
+    # Only queries (commands with '?') are coalesced
+    @raw_command
+    @coalesce(lambda command: '?' in command)
+    @execute(DeviceExecutor.READ)
+    @resilient
     def query(self, argument):
-        with self.device_in_use:
-            return self.ls336.query(argument)
+        if self.adaptive_delay is not None:
+            return self.adaptive_delay.query(self.ls336, argument)
+        return self.ls336.query(argument)
             
+    @raw_command
+    @execute(DeviceExecutor.WRITE)
+    @resilient(retry=False)
     def write(self, argument):
-        with self.device_in_use:
-            self.ls336.write(argument)
+        self.ls336.write(argument)
 
     # SIMPLE GETTERS (one value) 
+    @cached
+    @execute(DeviceExecutor.READ)
+    @resilient
     def get_temperature(self, control_channel:str = 'A') -> float:
         """
         This method gets the current temperature [Kelvin] on channel control_channel.
         """        
         return float(self.query(f'KRDG? {control_channel}'))
 
+    @cached
+    @execute(DeviceExecutor.READ)
+    @resilient
     def get_sensor(self, control_channel:str = 'A') -> float:
         """
         This method gets the current sensor value (resistance) [Ohms].
         """
         return float(self.query(f'SRDG? {control_channel}'))
     
+    @cached
+    @execute(DeviceExecutor.READ)
+    @resilient
     def get_setpoint(self, control_loop:int = 2) -> float:
         """
         This method gets the active setpoint on control loop control_loop
         """       
         return float(self.query(f'SETP? {int(control_loop):d}'))
     
+    @cached
+    @execute(DeviceExecutor.READ)
+    @resilient
     def get_heater_range(self, control_loop:int = 2) -> int:
         """
         This method gets the heater range index: 0 Off, 1 Low, 2 Medium, 3 High.
         """
         return int(self.query(f'RANGE? {int(control_loop):d}')) or 0
     
+    @cached
+    @execute(DeviceExecutor.READ)
+    @resilient
     def get_heater_percent(self, control_loop:int = 2):
         """
         This method gets the heater output in percentage of the current range.
         """        
         return float(self.query(f'HTR? {int(control_loop):d}'))
     
+    @cached
+    @execute(DeviceExecutor.READ)
+    @resilient
     def get_heater_percent_fullrange(self, control_loop:int = 2):
         """
         This method gets the heater output in percentage of the total heater power.
@@ -119,50 +199,119 @@ class Lakeshore336:
         heater_fullrange = 0.001 * 10**heater_range
         return heater_percent*heater_fullrange
 
+    @cached
+    @execute(DeviceExecutor.READ)
+    @resilient
     def get_PID(self, control_loop:int = 2, pid = None) -> float:
         """
         This method gets the P, I, and D values for the control loop control_loop
         """       
         raw_response = self.query(f'PID? {int(control_loop):d}')
         response = [float(value) for value in raw_response.split(',')]
+        self.shadow.update(('PID', int(control_loop)), [round(value, 1) for value in response])
         response_mapping = {'P': 0, 'I': 1, 'D': 2}
         if pid is None:
             return response
         else:
             return response[response_mapping[pid]]
 
+    @cached
+    @execute(DeviceExecutor.READ)
+    @resilient
     def get_ramp_rate(self, control_loop:int = 2) -> float:
         """
         This method gets the ramp rate [K/min] for the control loop control_loop.
         """
         return float(self.query(f'RAMP? {int(control_loop):d}').split(',')[1])
     
+    @cached
+    @execute(DeviceExecutor.READ)
+    @resilient
     def get_manual_output(self, control_loop:int = 2) -> float:
         """
         This method gets the ramp rate [K/min] for the control loop control_loop.
         """
         return float(self.query(f'MOUT? {int(control_loop):d}'))
 
+    # MULTI-READING GETTERS
+    @cached
+    @execute(DeviceExecutor.READ)
+    @resilient
+    def get_snapshot(self) -> dict:
+        """
+        This method gets temperature and sensor readings of all snapshot channels and setpoint, heater, ramp,
+        manual output and PID of all snapshot loops. Queries are joined with ';' so the whole snapshot takes one
+        or two round trips instead of one per value.
+        """
+        queries = [('channels', channel, name, command.format(channel), parse)
+                   for channel in self.snapshot_channels for name, command, parse in SNAPSHOT_CHANNEL_QUERIES]
+        queries += [('loops', loop, name, command.format(loop), parse)
+                    for loop in self.snapshot_loops for name, command, parse in SNAPSHOT_LOOP_QUERIES]
+
+        # Join queries into messages not longer than max_message_length
+        messages, length = [[]], -1
+        for query in queries:
+            # Command length plus ';' separator
+            if messages[-1] and length + 1 + len(query[3]) > self.max_message_length:
+                messages, length = messages + [[]], -1
+            messages[-1].append(query)
+            length += 1 + len(query[3])
+
+        snapshot = {'channels': {channel: dict() for channel in self.snapshot_channels},
+                    'loops': {loop: dict() for loop in self.snapshot_loops}}
+        for message in messages:
+            responses = self.query(';'.join([query[3] for query in message])).split(';')
+            if len(responses) != len(message):
+                raise ValueError(f'{len(responses)} responses returned for {len(message)} queries')
+            for (group, index, name, command, parse), response in zip(message, responses):
+                snapshot[group][index][name] = parse(response)
+        snapshot['timestamp'] = time.time()
+
+        for channel, readings in snapshot['channels'].items():
+            # Seed the cache: single-value getters can be answered from the snapshot
+            self.cache.put(self.get_temperature, readings['temperature'], channel)
+            self.cache.put(self.get_sensor, readings['sensor'], channel)
+        for loop, readings in snapshot['loops'].items():
+            ramp_enabled, ramp_rate = readings.pop('ramp')
+            readings['ramp_enabled'] = bool(ramp_enabled)
+            readings['ramp_rate'] = ramp_rate
+            # Max low is 1%, max medium is 10%, max high is 100%
+            readings['heater_percent_fullrange'] = readings['heater_percent'] * 0.001 * 10**readings['heater_range']
+            for name in ['setpoint', 'heater_range', 'heater_percent', 'heater_percent_fullrange', 'PID',
+                         'ramp_rate', 'manual_output']:
+                self.cache.put(getattr(self, f'get_{name}'), readings[name], loop)
+            self.shadow.update(('PID', loop), [round(value, 1) for value in readings['PID']])
+        return snapshot
+
     # SIMPLE SETTERS
+    @execute(DeviceExecutor.WRITE)
     def set_setpoint(self, setpoint:float, control_loop:int = 2):
         """
         This method sets the active setpoint on control loop control_loop
         """
         self.write(f'SETP {int(control_loop):d},{setpoint:.2f}')
 
+    @execute(DeviceExecutor.CONTROL)
     def set_heater_range(self, range_index: int, control_loop:int = 2):
         """
         This method sets the heater range given index: 0 Off, 1 Low, 2 Medium, 3 High.
         """
         self.write(f'RANGE {int(control_loop):d},{range_index:d}')
 
+    @execute(DeviceExecutor.WRITE)
     def set_PID(self, P:float = None, I:float = None, D:float = None, control_loop:int = 2) :
         """
-        This method gets the P, I, and D values for the control loop control_loop
+        This method sets the P, I, and D values for the control loop control_loop. Missing values are kept.
         """
-        current_pid = self.get_PID(control_loop)
-        self.write(f'PID {int(control_loop):d},{(P or current_pid[0]):.1f},{(I or current_pid[1]):.1f},{(D or current_pid[2]):.1f}')
+        # Missing values are taken from the last known PID, the device is queried only if it is unknown
+        current_pid = self.shadow.get(('PID', int(control_loop)))
+        if None in (P, I, D) and current_pid is None:
+            current_pid = self.get_PID(control_loop)
+        pid = [round(value if value is not None else current_pid[index], 1) for index, value in enumerate((P, I, D))]
+        self.shadow.apply(('PID', int(control_loop)), pid, self.write,
+                          f'PID {int(control_loop):d},{pid[0]:.1f},{pid[1]:.1f},{pid[2]:.1f}')
 
+    @execute(DeviceExecutor.WRITE)
     def set_ramp_rate(self, ramp_rate:float, control_loop:int = 2):
         """
         This method sets the ramp rate [K/min] for the control loop control_loop.
@@ -173,6 +322,7 @@ class Lakeshore336:
             # Turn off ramping
             self.write(f'RAMP {int(control_loop):d},0,0')
 
+    @execute(DeviceExecutor.WRITE)
     def set_manual_output(self, manual_out:float, control_loop:int = 2):
         """
         This method gets the ramp rate [K/min] for the control loop control_loop.
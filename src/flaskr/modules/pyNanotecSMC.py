@@ -27,6 +27,7 @@ import configparser
 import time
 import threading
 from .pyParallel import ParallelPort
+from .pyJobs import cancelled, report_progress
 
 class NanotecSMC:
     def __init__(self, address: str = None, device_present: bool = True) -> None:
@@ -84,7 +85,7 @@ class NanotecSMC:
             position = float(self.config['NanotecSMC'][f'{motor}_position'])
             # Enable motor
             self.smc.set_data_low(enable_bit)
-            while not self.stop_flag and self.steps_remaining:
+            while not self.stop_flag and self.steps_remaining and not cancelled():
                 # Precise step timing
                 start_timer = time.perf_counter()
                 # Make a step
@@ -101,6 +102,8 @@ class NanotecSMC:
                 position += (1 if steps > 0 else -1)
                 if position <= 0:
                     self.stop_flag = True
+                if self.steps_remaining % 100 == 0:
+                    report_progress(1 - self.steps_remaining/abs(steps))
                 # Step delay
                 while (time.perf_counter()-start_timer) < step_delay:
                     time.sleep(self.min_delay)
@@ -108,9 +111,8 @@ class NanotecSMC:
             self.smc.set_data_high(enable_bit)
             self.config['NanotecSMC'][f'{motor}_position'] = f'{position:.1f}'
             
-        thread = threading.Thread(target=__run__)
-        thread.start()
-        thread.join()
+        # Runs on the calling thread (a job, see /jobs); stop_all() or cancelling the job stops the motor
+        __run__()
         with open(f'{self.path}/config.ini', 'w') as configfile:
             self.config.write(configfile)
 
@@ -0,0 +1,200 @@
+#!/usr/bin/env python
+
+"""
+
+Resilience layer for instrument drivers and forwarded API calls. Failed instrument operations are retried a bounded
+number of times with jittered exponential backoff; consecutive failures open a circuit breaker, so calls fail fast
+with an InstrumentError instead of hanging the calling thread, while a background probe reconnects the instrument and
+closes the breaker once it responds again.
+
+"""
+
+__author__ = "Ivan Jakovac"
+__email__ = "ivan.jakovac2@gmail.com"
+__version__ = "v0.1"
+
+#  Copyright (C) 2020-2025 Ivan Jakovac
+#
+#  This program is free software: you can redistribute it and/or modify it under the terms of the GNU General Public
+#  License as published by the Free Software Foundation, either version 3 of the License, or (at your option) any
+#  later version.
+#
+#  This program is distributed in the hope that it will be useful, but WITHOUT ANY WARRANTY; without even the implied
+#  warranty of MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License along with this program. If not,
+#  see <https://www.gnu.org/licenses/>.
+
+import random
+import time
+import pyvisa as visa
+from functools import wraps
+from prometheus_client import Enum, Counter
+from threading import Lock, Thread, local
+
+breaker_state = Enum('instrument_breaker_state', 'Circuit breaker state of an instrument', ['device'],
+                     states=['closed', 'open', 'half_open'])
+instrument_failures = Counter('instrument_failures', 'Failed instrument operations by error type', ['device', 'error'])
+instrument_retries = Counter('instrument_retries', 'Instrument operations retried after a failure', ['device'])
+
+# Defaults used when a device section in config.ini does not define its own parameters
+DEFAULT_RETRIES = 2
+DEFAULT_BACKOFF = 0.2
+DEFAULT_MAX_BACKOFF = 2.0
+DEFAULT_FAILURE_THRESHOLD = 3
+DEFAULT_PROBE_INTERVAL = 5
+
+# Errors which mean that the instrument did not answer (properly): VISA errors, serial port errors and unparsable
+# responses. Other exceptions are bugs or invalid arguments and are raised as they are.
+INSTRUMENT_ERRORS = (visa.errors.VisaIOError, OSError, ValueError)
+
+
+def jittered_backoff(backoff: float, attempt: int, max_backoff: float = DEFAULT_MAX_BACKOFF) -> float:
+    """
+    Returns the delay [s] before retry attempt + 1: exponential backoff with full jitter, so clients retrying at the
+    same time do not hit an instrument or host in lockstep
+    """
+    return random.uniform(0, min(max_backoff, backoff * 2**attempt))
+
+
+def close_resources(*handles):
+    """
+    Closes VISA resources and resource managers of a previous connection before reconnecting (serial ports cannot be
+    opened twice and every open session holds a VISA handle). Handles which are missing or already broken are skipped.
+    """
+    for handle in handles:
+        if handle is None:
+            continue
+        try:
+            handle.close()
+        except Exception:
+            pass
+
+
+class InstrumentError(Exception):
+    """ Instrument operation failed after all retries, or was not attempted because the circuit breaker is open """
+    def __init__(self, device: str, operation: str, message: str, attempts: int = 0, retry_after: float = None):
+        super().__init__(f'{device}.{operation}: {message}')
+        self.device = device
+        self.operation = operation
+        self.message = message
+        self.attempts = attempts
+        self.retry_after = retry_after
+
+    def to_dict(self) -> dict:
+        return {'error': str(self), 'device': self.device, 'operation': self.operation, 'attempts': self.attempts}
+
+
+class CircuitBreaker:
+    """ Class tracks consecutive failures of a remote host or an instrument and probes it while the circuit is open """
+    def __init__(self, name: str, probe, failure_threshold: int = DEFAULT_FAILURE_THRESHOLD,
+                 probe_interval: float = DEFAULT_PROBE_INTERVAL, state_metric: Enum = breaker_state):
+        # probe() returns True if the host or instrument responds (again)
+        self.name = name
+        self.probe = probe
+        self.failure_threshold = failure_threshold
+        self.probe_interval = probe_interval
+        self.state_metric = state_metric
+        self.failures = 0
+        self.lock = Lock()
+        self.set_state('closed')
+
+    def set_state(self, state: str):
+        self.state = state
+        self.state_metric.labels(self.name).state(state)
+
+    def allow(self) -> bool:
+        """
+        Returns False while the circuit is open (or being probed) and calls should fail fast.
+        """
+        return self.state == 'closed'
+
+    def record_success(self):
+        with self.lock:
+            self.failures = 0
+
+    def record_failure(self):
+        with self.lock:
+            self.failures += 1
+            if self.state == 'closed' and self.failures >= self.failure_threshold:
+                self.set_state('open')
+                Thread(target=self.run_probes, name=f'{self.name} breaker probe', daemon=True).start()
+
+    def run_probes(self):
+        # Probe in the background until the host or instrument responds again
+        while True:
+            time.sleep(self.probe_interval)
+            self.set_state('half_open')
+            if self.probe():
+                with self.lock:
+                    self.failures = 0
+                    self.set_state('closed')
+                return
+            self.set_state('open')
+
+
+class Resilience:
+    def __init__(self, device: str, config, reconnect) -> None:
+        """
+        Class applies retries and the circuit breaker to the operations of one instrument. Parameters are read from
+        the device's config.ini section; reconnect() is the probe of an open breaker.
+        """
+        self.device = device
+        self.retries = config.getint(device, 'retries', fallback=DEFAULT_RETRIES)
+        self.backoff = config.getfloat(device, 'backoff', fallback=DEFAULT_BACKOFF)
+        self.max_backoff = config.getfloat(device, 'max_backoff', fallback=DEFAULT_MAX_BACKOFF)
+        self.reconnect = reconnect
+        self.breaker = CircuitBreaker(device, self.probe,
+                                      config.getint(device, 'failure_threshold', fallback=DEFAULT_FAILURE_THRESHOLD),
+                                      config.getfloat(device, 'probe_interval', fallback=DEFAULT_PROBE_INTERVAL))
+        # Nested operations (e.g. query inside a getter) run once, the outermost one is retried
+        self.local = local()
+
+    def probe(self) -> bool:
+        try:
+            self.reconnect()
+            return True
+        except Exception:
+            return False
+
+    def call(self, function, instance, args: tuple, kwargs: dict, retry: bool = True):
+        if getattr(self.local, 'active', False):
+            return function(instance, *args, **kwargs)
+        # Fail fast while the instrument is being reconnected
+        if not self.breaker.allow():
+            instrument_failures.labels(self.device, 'BreakerOpen').inc()
+            raise InstrumentError(self.device, function.__name__, 'instrument is unavailable, reconnecting', 0,
+                                  self.breaker.probe_interval)
+        attempts = 1 + self.retries if retry else 1
+        self.local.active = True
+        try:
+            for attempt in range(attempts):
+                try:
+                    result = function(instance, *args, **kwargs)
+                except INSTRUMENT_ERRORS as error:
+                    instrument_failures.labels(self.device, type(error).__name__).inc()
+                    self.breaker.record_failure()
+                    if attempt + 1 == attempts or not self.breaker.allow():
+                        raise InstrumentError(self.device, function.__name__, f'{type(error).__name__}: {error}',
+                                              attempt + 1, self.breaker.probe_interval) from error
+                    instrument_retries.labels(self.device).inc()
+                    time.sleep(jittered_backoff(self.backoff, attempt, self.max_backoff))
+                else:
+                    self.breaker.record_success()
+                    return result
+        finally:
+            self.local.active = False
+
+
+def resilient(function=None, retry: bool = True):
+    """
+    Decorator for device class methods which talk to the instrument (self.resilience): instrument errors are retried
+    with backoff (unless retry=False, e.g. for writes which must not be repeated) and counted by the circuit breaker.
+    Use inside @execute, so retries run on the I/O worker before any other command.
+    """
+    def decorator(function):
+        @wraps(function)
+        def wrapper(self, *args, **kwargs):
+            return self.resilience.call(function, self, args, kwargs, retry)
+        return wrapper
+    return decorator(function) if function is not None else decorator
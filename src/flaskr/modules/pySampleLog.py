@@ -0,0 +1,59 @@
+#!/usr/bin/env python
+
+"""
+
+Append-only log of numeric samples (e.g. time, field and current during a magnet sweep). Every column is an
+array('d'), so long runs take 8 bytes per value instead of a Python object per sample, and columns are copied into
+NumPy arrays in one step. The log can be read (e.g. downloaded by a client) while it is being written.
+
+"""
+
+__author__ = "Ivan Jakovac"
+__email__ = "ivan.jakovac2@gmail.com"
+__version__ = "v0.1"
+
+#  Copyright (C) 2020-2025 Ivan Jakovac
+#
+#  This program is free software: you can redistribute it and/or modify it under the terms of the GNU General Public
+#  License as published by the Free Software Foundation, either version 3 of the License, or (at your option) any
+#  later version.
+#
+#  This program is distributed in the hope that it will be useful, but WITHOUT ANY WARRANTY; without even the implied
+#  warranty of MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License along with this program. If not,
+#  see <https://www.gnu.org/licenses/>.
+
+import numpy as np
+from array import array
+from threading import Lock
+
+class SampleLog:
+    def __init__(self, columns: list) -> None:
+        """
+        Class holds one array('d') per column name; every sample has a value for every column
+        """
+        self.names = list(columns)
+        self.arrays = {name: array('d') for name in self.names}
+        self.lock = Lock()
+
+    def __len__(self) -> int:
+        with self.lock:
+            return len(self.arrays[self.names[0]])
+
+    def append(self, *values):
+        """
+        Appends one sample, values in column order
+        """
+        if len(values) != len(self.names):
+            raise ValueError(f'{len(values)} values given for {len(self.names)} columns')
+        with self.lock:
+            for name, value in zip(self.names, values):
+                self.arrays[name].append(value)
+
+    def columns(self, start: int = 0) -> dict:
+        """
+        Returns copies of the columns from sample start on as NumPy arrays
+        """
+        with self.lock:
+            return {name: np.array(self.arrays[name][start:], dtype=np.float64) for name in self.names}
@@ -0,0 +1,92 @@
+#!/usr/bin/env python
+
+"""
+
+Write-through shadow of instrument settings. Device classes record every setting they write (marker on, display
+format, PID, ...) and skip commands which would not change anything. The shadow is invalidated when the device is
+reconnected and when an API client sends a raw command, which can change any setting behind the device class' back.
+
+"""
+
+__author__ = "Ivan Jakovac"
+__email__ = "ivan.jakovac2@gmail.com"
+__version__ = "v0.1"
+
+#  Copyright (C) 2020-2025 Ivan Jakovac
+#
+#  This program is free software: you can redistribute it and/or modify it under the terms of the GNU General Public
+#  License as published by the Free Software Foundation, either version 3 of the License, or (at your option) any
+#  later version.
+#
+#  This program is distributed in the hope that it will be useful, but WITHOUT ANY WARRANTY; without even the implied
+#  warranty of MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License along with this program. If not,
+#  see <https://www.gnu.org/licenses/>.
+
+import time
+from functools import wraps
+from threading import Lock
+from prometheus_client import Counter
+
+skipped_commands = Counter('state_shadow_skipped_commands', 'Commands not sent because the instrument already has '
+                           'the setting', ['device'])
+
+class StateShadow:
+    def __init__(self, device: str, max_age: float = None) -> None:
+        """
+        Class holds the last known value of instrument settings. Values older than max_age [s] (e.g. changed on the
+        front panel in the meantime) are not trusted; None keeps them until invalidated.
+        """
+        self.device = device
+        self.max_age = max_age
+        self.values = dict()
+        self.lock = Lock()
+
+    def get(self, key, default=None):
+        """
+        Returns the known value of a setting, default if it is unknown or too old.
+        """
+        with self.lock:
+            if key in self.values:
+                value, timestamp = self.values[key]
+                if self.max_age is None or time.time() - timestamp <= self.max_age:
+                    return value
+        return default
+
+    def update(self, key, value):
+        with self.lock:
+            self.values[key] = (value, time.time())
+
+    def forget(self, key):
+        with self.lock:
+            self.values.pop(key, None)
+
+    def invalidate(self):
+        with self.lock:
+            self.values.clear()
+
+    def apply(self, key, value, write, command: str) -> bool:
+        """
+        Sends command with write() unless the setting already has the value. Returns True if the command was sent.
+        """
+        if self.get(key) == value:
+            skipped_commands.labels(self.device).inc()
+            return False
+        # Setting is unknown until the write succeeds
+        self.forget(key)
+        write(command)
+        self.update(key, value)
+        return True
+
+def raw_command(function):
+    """
+    Decorator for device class query/write methods. Raw commands of API clients (called outside the device's I/O
+    worker) invalidate the state shadow, unless every command in the message is a query.
+    """
+    @wraps(function)
+    def wrapper(self, argument, *args, **kwargs):
+        if not self.executor.in_worker() and not all('?' in part for part in str(argument).split(';')):
+            self.shadow.invalidate()
+        return function(self, argument, *args, **kwargs)
+    return wrapper
@@ -0,0 +1,140 @@
+#!/usr/bin/env python
+
+"""
+
+Shared, timestamped last-value cache of device getters. Every call of a cached getter (Prometheus worker, HTTP
+clients, ...) stores its value; callers which accept older data pass max_age and get the cached value without a
+VISA query as long as it is fresh enough.
+
+"""
+
+__author__ = "Ivan Jakovac"
+__email__ = "ivan.jakovac2@gmail.com"
+__version__ = "v0.1"
+
+#  Copyright (C) 2020-2025 Ivan Jakovac
+#
+#  This program is free software: you can redistribute it and/or modify it under the terms of the GNU General Public
+#  License as published by the Free Software Foundation, either version 3 of the License, or (at your option) any
+#  later version.
+#
+#  This program is distributed in the hope that it will be useful, but WITHOUT ANY WARRANTY; without even the implied
+#  warranty of MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License along with this program. If not,
+#  see <https://www.gnu.org/licenses/>.
+
+import inspect
+import time
+from collections import OrderedDict
+from functools import wraps
+from threading import Lock
+
+def freeze(value):
+    """
+    Returns a hashable version of a getter argument (lists and dicts, e.g. a frequency plan, as tuples)
+    """
+    if isinstance(value, (list, tuple)):
+        return tuple(freeze(item) for item in value)
+    elif isinstance(value, dict):
+        return tuple(sorted((key, freeze(item)) for key, item in value.items()))
+    return value
+
+class TelemetryCache:
+    def __init__(self, max_entries: int = 256) -> None:
+        """
+        Class holds the last value and its timestamp for every getter call (method name and arguments). At most
+        max_entries calls are kept, the least recently used are evicted first.
+        """
+        self.max_entries = max_entries
+        self.values = OrderedDict()
+        self.signatures = dict()
+        self.lock = Lock()
+
+    def key(self, function, args: tuple, kwargs: dict) -> tuple:
+        """
+        Returns the cache key: method name and all (bound, with defaults) arguments, so that positional and keyword
+        calls of the same getter share a cache entry.
+        """
+        if function not in self.signatures:
+            self.signatures[function] = inspect.signature(function)
+        bound = self.signatures[function].bind(None, *args, **kwargs)
+        bound.apply_defaults()
+        return (function.__name__,) + tuple((name, freeze(value)) for name, value in list(bound.arguments.items())[1:])
+
+    def store(self, key: tuple, value):
+        with self.lock:
+            self.values[key] = (value, time.time())
+            self.values.move_to_end(key)
+            while len(self.values) > self.max_entries:
+                self.values.popitem(last=False)
+
+    def lookup(self, key: tuple, max_age: float):
+        """
+        Returns (value, age) if a cached value is not older than max_age [s], None otherwise.
+        """
+        with self.lock:
+            if key in self.values:
+                value, timestamp = self.values[key]
+                age = time.time() - timestamp
+                if age <= max_age:
+                    self.values.move_to_end(key)
+                    return value, age
+        return None
+
+    def invalidate(self):
+        """
+        Drops all cached values (registered as an executor state listener: called before every write).
+        """
+        with self.lock:
+            self.values.clear()
+
+    def get(self, function, instance, args: tuple, kwargs: dict, max_age: float = None):
+        """
+        Returns (value, age) of a getter call: the cached value if fresh enough, otherwise queries the device.
+        """
+        key = self.key(function, args, kwargs)
+        if max_age is not None:
+            cached = self.lookup(key, max_age)
+            if cached is not None:
+                return cached
+        def read():
+            value = function(instance, *args, **kwargs)
+            self.store(key, value)
+            return value
+        # Value is stored on the device's I/O worker as part of the read: a setter queued meanwhile runs (and
+        # invalidates the cache) only after the value is stored, never between the read and storing it
+        executor = getattr(instance, 'executor', None)
+        if executor is None:
+            return read(), 0.0
+        return executor.call(executor.READ, read), 0.0
+
+    def fetch(self, getter, max_age: float = None, *args, **kwargs):
+        """
+        Returns (value, age) for a bound cached getter, e.g. cache.fetch(device.get_temperature, 5, 'A').
+        """
+        return self.get(getter.__func__.__wrapped__, getter.__self__, args, kwargs, max_age)
+
+    def put(self, getter, value, *args, **kwargs):
+        """
+        Stores a value read by other means (e.g. a multi-reading snapshot) for a bound cached getter call.
+        """
+        self.store(self.key(getter.__func__.__wrapped__, args, kwargs), value)
+
+    def discard(self, getter, *args, **kwargs):
+        """
+        Drops the cached value of a bound cached getter call (e.g. a trace whose sweep settings changed).
+        """
+        key = self.key(getter.__func__.__wrapped__, args, kwargs)
+        with self.lock:
+            self.values.pop(key, None)
+
+def cached(function):
+    """
+    Decorator for device class getters: every value is stored in the device's cache (self.cache) and the getter
+    accepts an optional max_age [s] keyword argument to return a cached value instead of querying the device.
+    """
+    @wraps(function)
+    def wrapper(self, *args, max_age: float = None, **kwargs):
+        return self.cache.get(function, self, args, kwargs, max_age)[0]
+    return wrapper
@@ -0,0 +1,149 @@
+#!/usr/bin/env python
+
+"""
+
+Server-side analysis of VNA traces. Minimum, notch (Q at -13 dB), filter (bandwidth at half depth) and virtual marker
+values are computed with NumPy from one complex S11 trace instead of driving the instrument's marker and bandwidth
+search engine with several SCPI round trips per figure. Results are memoized, so any number of analyses of the same
+trace cost one acquisition.
+
+"""
+
+__author__ = "Ivan Jakovac"
+__email__ = "ivan.jakovac2@gmail.com"
+__version__ = "v0.1"
+
+#  Copyright (C) 2020-2025 Ivan Jakovac
+#
+#  This program is free software: you can redistribute it and/or modify it under the terms of the GNU General Public
+#  License as published by the Free Software Foundation, either version 3 of the License, or (at your option) any
+#  later version.
+#
+#  This program is distributed in the hope that it will be useful, but WITHOUT ANY WARRANTY; without even the implied
+#  warranty of MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License along with this program. If not,
+#  see <https://www.gnu.org/licenses/>.
+
+import numpy as np
+from threading import RLock
+
+def to_dB(magnitude):
+    return 20*np.log10(np.maximum(magnitude, 1e-15))
+
+def stitch(traces: list) -> tuple:
+    """
+    Joins traces [(frequencies, data), ...] of sweep segments into one (frequencies, data) pair ordered by frequency.
+    Points of a segment which overlap the segments below it are dropped (the lower segment's measurement is kept).
+    """
+    kept, covered = [], -np.inf
+    for frequencies, data in sorted(traces, key=lambda trace: trace[0][0]):
+        # Tolerance of the instrument's frequency resolution (1 Hz)
+        mask = frequencies > covered + 1e-6
+        kept.append((frequencies[mask], data[mask]))
+        if mask.any():
+            covered = max(covered, float(frequencies[mask][-1]))
+    return (np.concatenate([frequencies for frequencies, data in kept]),
+            np.concatenate([data for frequencies, data in kept]))
+
+class TraceAnalysis:
+    def __init__(self, frequencies: np.ndarray, data: np.ndarray) -> None:
+        """
+        Class analyses one sweep: frequencies [in MHz] and complex S11 data
+        """
+        self.frequencies = np.asarray(frequencies, dtype=np.float64)
+        self.data = np.asarray(data, dtype=np.complex128)
+        self.magnitude = np.abs(self.data)
+        self.magnitude_dB = to_dB(self.magnitude)
+        self.results = dict()
+        self.lock = RLock()
+
+    def memoized(self, key, compute):
+        with self.lock:
+            if key not in self.results:
+                self.results[key] = compute()
+            return self.results[key]
+
+    def minimum_index(self) -> int:
+        return int(np.argmin(self.magnitude))
+
+    def minimum(self) -> dict:
+        """
+        Returns the frequency [in MHz] and S11 [in dB] of the minimum: vertex of a parabola through the lowest point
+        and its neighbours.
+        """
+        def compute():
+            index = self.minimum_index()
+            frequency, value = self.frequencies[index], self.magnitude_dB[index]
+            if 0 < index < len(self.frequencies) - 1:
+                # Fit relative to the lowest point for numerical stability
+                a, b, c = np.polyfit(self.frequencies[index-1:index+2] - frequency,
+                                     self.magnitude_dB[index-1:index+2], 2)
+                if a > 0:
+                    frequency, value = frequency - b/(2*a), c - b**2/(4*a)
+            return {'frequency': float(frequency), 'value': float(value)}
+        return self.memoized('minimum', compute)
+
+    def crossings(self, values: np.ndarray, level: float) -> tuple:
+        """
+        Returns the frequencies [in MHz] where values rise above level on both sides of the minimum (linear
+        interpolation between sweep points), None if a side does not reach the level.
+        """
+        index = self.minimum_index()
+        above = np.flatnonzero(values >= level)
+        left, right = above[above < index], above[above > index]
+
+        def edge(outer: int, inner: int) -> float:
+            f_inner, f_outer = self.frequencies[inner], self.frequencies[outer]
+            v_inner, v_outer = values[inner], values[outer]
+            return float(f_inner + (level - v_inner)*(f_outer - f_inner)/(v_outer - v_inner))
+
+        return (edge(left[-1], left[-1] + 1) if len(left) else None,
+                edge(right[0], right[0] - 1) if len(right) else None)
+
+    def bandwidth(self, values: np.ndarray, level: float) -> dict:
+        """
+        Returns bandwidth, center [in MHz], Q value and loss [in dB, at the minimum] of the dip at level
+        """
+        left, right = self.crossings(values, level)
+        if left is None or right is None:
+            return {'bandwidth': None, 'center': None, 'Q': None, 'loss': self.minimum()['value']}
+        center = (left + right)/2
+        return {'bandwidth': right - left, 'center': center, 'Q': center/(right - left),
+                'loss': self.minimum()['value']}
+
+    def notch(self, threshold: float = -13) -> dict:
+        """
+        Notch search: bandwidth where S11 is threshold [in dB] below the peak of the trace ("the NMR Q-value" at
+        -13 dB, as get_Q).
+        """
+        return self.memoized(('notch', threshold), lambda: self.bandwidth(
+            self.magnitude_dB, float(np.max(self.magnitude_dB)) + threshold))
+
+    def filter(self, threshold: float = 0.5) -> dict:
+        """
+        Filter search: bandwidth where linear |S11| has risen threshold of the way from the minimum to 1 (0.5 = half
+        depth, as get_filter).
+        """
+        minimum = self.magnitude[self.minimum_index()]
+        return self.memoized(('filter', threshold), lambda: self.bandwidth(
+            self.magnitude, float(minimum + threshold*(1 - minimum))))
+
+    def markers(self, frequencies) -> list:
+        """
+        Virtual markers: S11 [in dB] at any frequencies [in MHz], interpolated between sweep points
+        """
+        frequencies = np.atleast_1d(np.asarray(frequencies, dtype=np.float64))
+        values = np.interp(frequencies, self.frequencies, self.data.real) + \
+            1j*np.interp(frequencies, self.frequencies, self.data.imag)
+        return to_dB(np.abs(values)).tolist()
+
+    def analyze(self, markers=(), notch_threshold: float = -13, filter_threshold: float = 0.5) -> dict:
+        """
+        Returns all figures of merit of the trace
+        """
+        return {'minimum': self.minimum(),
+                'notch': self.notch(notch_threshold),
+                'filter': self.filter(filter_threshold),
+                'markers': [{'frequency': float(frequency), 'value': value}
+                            for frequency, value in zip(markers, self.markers(markers) if len(markers) else [])]}
@@ -0,0 +1,129 @@
+#!/usr/bin/env python
+
+"""
+
+Write coalescing for SCPI instruments. Inside a pipelined() block consecutive writes are buffered and sent as one
+';'-joined message together with the next query, so a measurement which configures the instrument with several
+commands and then reads the result costs one VISA round trip instead of one per command. An optional *OPC? barrier
+makes writes left at the end of a block complete before the block returns.
+
+"""
+
+__author__ = "Ivan Jakovac"
+__email__ = "ivan.jakovac2@gmail.com"
+__version__ = "v0.1"
+
+#  Copyright (C) 2020-2025 Ivan Jakovac
+#
+#  This program is free software: you can redistribute it and/or modify it under the terms of the GNU General Public
+#  License as published by the Free Software Foundation, either version 3 of the License, or (at your option) any
+#  later version.
+#
+#  This program is distributed in the hope that it will be useful, but WITHOUT ANY WARRANTY; without even the implied
+#  warranty of MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License along with this program. If not,
+#  see <https://www.gnu.org/licenses/>.
+
+from contextlib import contextmanager
+from functools import wraps
+from prometheus_client import Counter
+
+sent_commands = Counter('visa_commands', 'SCPI commands sent to the instrument', ['device'])
+sent_messages = Counter('visa_messages', 'Messages written to the instrument (joined commands count once)', ['device'])
+
+class WritePipeline:
+    def __init__(self, resource, device: str, max_length: int = 1024, opc_barrier: bool = False) -> None:
+        """
+        Class wraps a VISA resource: write() is buffered inside pipelined() blocks, queries and reads send the
+        buffered commands first. All other attributes are those of the resource.
+        """
+        self.resource = resource
+        self.device = device
+        self.max_length = max_length
+        self.opc_barrier = opc_barrier
+        self.buffer = []
+        self.depth = 0
+
+    def __getattr__(self, name):
+        return getattr(self.resource, name)
+
+    @staticmethod
+    def joinable(command: str) -> bool:
+        """
+        Returns True for commands with an absolute header (':...' or common '*...' commands), which mean the same
+        after a ';' as at the start of a message.
+        """
+        return command.lstrip().startswith((':', '*'))
+
+    def joined(self, command: str = None) -> str:
+        """
+        Returns the buffered commands (and command) as one message and empties the buffer.
+        """
+        commands = self.buffer + ([command] if command is not None else [])
+        self.buffer = []
+        sent_commands.labels(self.device).inc(len(commands))
+        sent_messages.labels(self.device).inc()
+        return ';'.join(commands)
+
+    def flush(self, barrier: bool = False):
+        """
+        Sends the buffered commands. With barrier, waits until the instrument has executed them (*OPC?).
+        """
+        if not self.buffer:
+            return
+        if barrier:
+            self.resource.query(self.joined('*OPC?'))
+        else:
+            self.resource.write(self.joined())
+
+    @contextmanager
+    def pipelined(self):
+        """
+        Buffers writes until the next query or the end of the (outermost) block
+        """
+        self.depth += 1
+        try:
+            yield self
+        finally:
+            self.depth -= 1
+            if self.depth == 0:
+                self.flush(self.opc_barrier)
+
+    def prepare(self, command: str):
+        """
+        Sends the buffered commands on their own if command cannot be joined to them
+        """
+        if not self.joinable(command) or len(';'.join(self.buffer + [command])) > self.max_length:
+            self.flush()
+
+    def write(self, command: str):
+        self.prepare(command)
+        if self.depth == 0 or not self.joinable(command):
+            self.resource.write(self.joined(command))
+        else:
+            self.buffer.append(command)
+
+    def query(self, command: str, *args, **kwargs) -> str:
+        # Buffered writes are sent in the same message as the query
+        self.prepare(command)
+        return self.resource.query(self.joined(command), *args, **kwargs)
+
+    def query_binary_values(self, command: str, *args, **kwargs):
+        self.prepare(command)
+        return self.resource.query_binary_values(self.joined(command), *args, **kwargs)
+
+    def read(self, *args, **kwargs) -> str:
+        self.flush()
+        return self.resource.read(*args, **kwargs)
+
+def pipelined(function):
+    """
+    Decorator for device class methods: writes of the method are buffered and sent together with its queries, in
+    the device's write_pipeline() context.
+    """
+    @wraps(function)
+    def wrapper(self, *args, **kwargs):
+        with self.write_pipeline():
+            return function(self, *args, **kwargs)
+    return wrapper
@@ -1,53 +1,64 @@
-from prometheus_client import Gauge, Enum
+from prometheus_client import Gauge, Enum, Histogram, Counter
+from threading import Event, Thread
+from contextlib import nullcontext
+import heapq
+import itertools
+import math
 import os
 import json
 import time
 
+# Delay between the deadline of a metric update and the actual update call
+scheduling_lag = Gauge('prometheus_worker_lag_seconds', 'Delay of the last metric update after its scheduled time',
+                       ['metric', 'label_values'])
+# Time a device polling lane spends on its due updates between two sleeps
+cycle_time = Histogram('prometheus_worker_cycle_seconds', 'Time a device polling lane spends on due metric updates',
+                       ['device'])
+update_errors = Counter('prometheus_worker_errors', 'Metric updates which raised an exception', ['device'])
+
 class PrometheusWorker:
     """ Class wraps all calls to local device method which then update respective Prometheus metrics """
-    def __init__(self, app):
+    def __init__(self, app, config_path: str = None):
         # Load device configuration: metrics, labels, class methods, update intervals...
-        path = os.path.dirname(__file__)
-        with open(f'{path}/prometheus_config.json') as json_file:
+        if config_path is None:
+            config_path = f'{os.path.dirname(__file__)}/prometheus_config.json'
+        with open(config_path) as json_file:
             device_configuration = json.load(json_file)
 
         # Define worker class arguments
         self.is_running = True
+        self.stop_event = Event()
         self.list_of_update_calls = []
+        self.lanes = dict()
+        self.executors = dict()
 
         for device, list_of_metrics in device_configuration.items():
             # For each device check whether it is local (class methods are called directly)
             if device in app.local_devices.keys():
+                # Due updates of a device run in one coalescing window: identical instrument queries are sent once
+                self.executors[device] = getattr(app.local_devices[device], 'executor', None)
                 # Iterate through all metrics
                 for metric in list_of_metrics:
+                    # Define update method - local device class method
+                    update_method = getattr(app.local_devices[device], metric['method'])
+
                     if metric['type'] == "gauge":
                         gauge = Gauge(metric['name'],
                                       metric['description'],
                                       metric['label_names'])
-                        
-                        # Define update method - local device class method
-                        update_method = getattr(app.local_devices[device], metric['method'])
 
                         # Label values represent different parameters with which update method can be called
                         if len(metric['label_values']):
                             for label_value in metric['label_values']:
-                                update_method_parameters = {name: value for name, value in zip(metric['label_names'],
-                                                                                               label_value)}
-                                update_metric = gauge.labels(*label_value).set
+                                update_method_parameters = self.get_parameters(metric, label_value)
+                                update_metric = self.select_result(metric, label_value, gauge.labels(*label_value).set)
                                 # Add a method call to the list
-                                self.list_of_update_calls.append([update_metric,
-                                                                  update_method,
-                                                                  update_method_parameters,
-                                                                  metric['update_interval'],
-                                                                  0])
+                                self.add_update_call(device, metric, label_value, update_metric, update_method,
+                                                     update_method_parameters)
                         # Handle single label (no label)
                         else:
-                            self.list_of_update_calls.append([gauge.set,
-                                                              update_method,
-                                                              {},
-                                                              metric['update_interval'],
-                                                              0])
-                                                              
+                            self.add_update_call(device, metric, [], gauge.set, update_method, {})
+
                     # Enum metric follows the same pattern
                     elif metric['type'] == "enum":
                         enum = Enum(metric['name'],
@@ -56,26 +67,98 @@ class PrometheusWorker:
                                     states=metric['states'])
                         if len(metric['label_values']):
                             for label_value in metric['label_values']:
-                                    update_method_parameters = {name: value for name, value in zip(metric['label_names'],
-                                                                                                   label_value)}
-                                    update_metric = enum.labels(*label_value).state
-                                    self.list_of_update_calls.append([update_metric,
-                                                                      update_method,
-                                                                      update_method_parameters,
-                                                                      metric['update_interval'],
-                                                                      0])
+                                    update_method_parameters = self.get_parameters(metric, label_value)
+                                    update_metric = self.select_result(metric, label_value,
+                                                                       enum.labels(*label_value).state)
+                                    self.add_update_call(device, metric, label_value, update_metric, update_method,
+                                                         update_method_parameters)
                         # Handle single label (no label)
                         else:
-                            self.list_of_update_calls.append([gauge.set,
-                                                              update_method,
-                                                              {},
-                                                              metric['update_interval'],
-                                                              0])
+                            self.add_update_call(device, metric, [], enum.state, update_method, {})
+
+    @staticmethod
+    def get_parameters(metric: dict, label_value: list) -> dict:
+        # Labels listed in result_labels select a part of the method result, other labels are method parameters
+        result_labels = metric.get('result_labels', {})
+        return {name: value for name, value in zip(metric['label_names'], label_value) if name not in result_labels}
+
+    @staticmethod
+    def select_result(metric: dict, label_value: list, update_metric):
+        # e.g. "result_labels": {"pid": ["P", "I", "D"]} sets label pid="I" to the second element of get_PID() result;
+        # dict results (e.g. get_snapshot()) are selected by the label value itself
+        result_labels = metric.get('result_labels', {})
+        if not result_labels:
+            return update_metric
+        selectors = [(values.index(label_value[metric['label_names'].index(name)]),
+                      label_value[metric['label_names'].index(name)]) for name, values in result_labels.items()]
+
+        def update_selected(result):
+            for index, key in selectors:
+                result = result[key] if isinstance(result, dict) else result[index]
+            update_metric(result)
+        return update_selected
+
+    def add_update_call(self, device: str, metric: dict, label_value: list, update_metric, update_method,
+                        update_method_parameters: dict):
+        # Every device has its own polling lane (list of update call indices)
+        self.lanes.setdefault(device, []).append(len(self.list_of_update_calls))
+        # Update interval can be shorter than a second (e.g. 0.2)
+        self.list_of_update_calls.append([update_metric,
+                                          update_method,
+                                          update_method_parameters,
+                                          float(metric['update_interval']),
+                                          scheduling_lag.labels(metric['name'],
+                                                                ','.join(str(value) for value in label_value))])
+
+    def stop(self):
+        self.is_running = False
+        self.stop_event.set()
+
     def run(self):
-        # Run all update calls periodically (fastest update interval = 5 seconds)
-        while self.is_running:
-            for i, (update_metric, update_method, update_method_parameters, update_interval, next_update) in enumerate(self.list_of_update_calls):
-                if next_update < time.time():
-                    update_metric(update_method(**update_method_parameters))
-                    self.list_of_update_calls[i][4] = time.time() + update_interval
-            time.sleep(5)
+        # Poll devices concurrently: a slow or hung device only delays its own metrics
+        threads = [Thread(target=self.run_lane, args=(device, indices), name=f'{device} polling lane', daemon=True)
+                   for device, indices in self.lanes.items()]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+    def run_lane(self, device: str, indices: list):
+        # Deadline-ordered schedule: (next update time, sequence, update call index); all metrics are due at start
+        sequence = itertools.count()
+        start = time.monotonic()
+        schedule = [(start, next(sequence), i) for i in indices]
+        heapq.heapify(schedule)
+        executor = self.executors.get(device)
+
+        while self.is_running and schedule:
+            # Sleep exactly until the next metric is due (or the worker is stopped)
+            delay = schedule[0][0] - time.monotonic()
+            if delay > 0:
+                self.stop_event.wait(delay)
+                continue
+
+            # Run all due updates in one cycle
+            cycle_start = time.monotonic()
+            due = []
+            while schedule and schedule[0][0] <= cycle_start:
+                due.append(heapq.heappop(schedule))
+            with executor.coalescing() if executor is not None else nullcontext():
+                for deadline, _, i in due:
+                    update_metric, update_method, update_method_parameters, update_interval, lag = \
+                        self.list_of_update_calls[i]
+                    lag.set(time.monotonic() - deadline)
+                    try:
+                        update_metric(update_method(**update_method_parameters))
+                    except Exception:
+                        # Keep polling the device; the metric keeps its last value
+                        update_errors.labels(device).inc()
+            cycle_time.labels(device).observe(time.monotonic() - cycle_start)
+
+            # Fixed-rate rescheduling: next deadline is a multiple of the interval after the previous one, so
+            # query time does not accumulate; updates missed while the device was busy are skipped
+            now = time.monotonic()
+            for deadline, _, i in due:
+                update_interval = self.list_of_update_calls[i][3]
+                missed = math.floor((now - deadline) / update_interval)
+                heapq.heappush(schedule, (deadline + (missed + 1) * update_interval, next(sequence), i))
@@ -17,5 +17,5 @@ theaded_client.start()
 # Serve Prometheus metrics
 start_http_server(2025)
 
-# Serve it on localhost:5000
-serve(app, host='127.0.0.1', port='5000', threads=1)
\ No newline at end of file
+# Serve it on localhost:5000; device I/O is serialized by per-instrument executors, so requests can run in parallel
+serve(app, host='127.0.0.1', port='5000', threads=8)
\ No newline at end of file
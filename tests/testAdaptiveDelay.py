@@ -0,0 +1,115 @@
+#!/usr/bin/env python
+
+"""
+
+Tests for the adaptive query delay.
+
+"""
+
+__author__ = "Ivan Jakovac"
+__email__ = "ivan.jakovac2@gmail.com"
+__version__ = "v0.1"
+
+
+#  Copyright (C) 2020-2025 Ivan Jakovac
+#
+#  This program is free software: you can redistribute it and/or modify it under the terms of the GNU General Public
+#  License as published by the Free Software Foundation, either version 3 of the License, or (at your option) any
+#  later version.
+#
+#  This program is distributed in the hope that it will be useful, but WITHOUT ANY WARRANTY; without even the implied
+#  warranty of MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License along with this program. If not,
+#  see <https://www.gnu.org/licenses/>.
+
+import unittest
+import sys
+import os
+import tempfile
+import time
+sys.path.append('../src/flaskr/modules')
+from pyAdaptiveDelay import AdaptiveDelay, command_type
+from pyvisa import VisaIOError, constants
+
+class SlowResource:
+    """
+    Mock resource which returns a garbled response if read sooner than response_time after a write
+    """
+    def __init__(self, response_time: float, timeout: bool = False):
+        self.response_time = response_time
+        self.timeout = timeout
+        self.writes = 0
+
+    def write(self, command):
+        self.written_at = time.perf_counter()
+        self.writes += 1
+
+    def read(self):
+        if time.perf_counter() - self.written_at < self.response_time:
+            if self.timeout:
+                raise VisaIOError(constants.StatusCode.error_timeout)
+            return '+1.2'
+        return '+1.234;+5.678'
+
+    def clear(self):
+        pass
+
+class TestAdaptiveDelay(unittest.TestCase):
+    """
+    Test delay tuning, fallback on failures and persistence
+    """
+    def setUp(self):
+        handle, self.path = tempfile.mkstemp(suffix='.json')
+        os.close(handle)
+        os.remove(self.path)
+        self.addCleanup(lambda: os.path.exists(self.path) and os.remove(self.path))
+        self.validate = lambda command, response: response.count(';') == command.count(';')
+
+    def test_command_type(self):
+        self.assertEqual(command_type('KRDG? A'), 'KRDG?')
+        self.assertEqual(command_type('R 7'), 'R')
+        self.assertEqual(command_type('I12.000'), 'I')
+        self.assertEqual(command_type('KRDG? A;SETP? 2'), 'KRDG?;SETP?')
+
+    def test_tuning(self):
+        adaptive_delay = AdaptiveDelay('test_tuning', 0.05, validate=self.validate, path=self.path)
+        resource = SlowResource(0.01)
+        for i in range(100):
+            self.assertEqual(adaptive_delay.query(resource, 'KRDG? A;KRDG? B'), '+1.234;+5.678')
+        # Delay is lowered towards the response time but never stays below it
+        delay = adaptive_delay.delays['KRDG?;KRDG?']
+        self.assertLess(delay, 0.05)
+        self.assertGreaterEqual(delay, 0.01)
+        self.assertLess(resource.writes, 110)
+
+    def test_fallback(self):
+        adaptive_delay = AdaptiveDelay('test_fallback', 0.0, validate=self.validate, path=self.path)
+        resource = SlowResource(0.015, timeout=True)
+        self.assertEqual(adaptive_delay.query(resource, 'KRDG? A;KRDG? B'), '+1.234;+5.678')
+        self.assertGreaterEqual(adaptive_delay.delays['KRDG?;KRDG?'], 0.015)
+        # Too slow device: all retries fail
+        resource.response_time = 10
+        with self.assertRaises(VisaIOError):
+            adaptive_delay.query(resource, 'SETP? 2')
+
+    def test_floor_decay(self):
+        adaptive_delay = AdaptiveDelay('test_floor_decay', 0.0, validate=self.validate, path=self.path)
+        resource = SlowResource(0.015)
+        adaptive_delay.query(resource, 'KRDG? A;KRDG? B')
+        floor = adaptive_delay.floors['KRDG?;KRDG?']
+        # One slow response does not limit the delay for good: the device is fast again
+        resource.response_time = 0
+        for i in range(adaptive_delay.FLOOR_DECAY_SUCCESSES):
+            adaptive_delay.query(resource, 'KRDG? A;KRDG? B')
+        self.assertLess(adaptive_delay.floors['KRDG?;KRDG?'], floor)
+
+    def test_persistence(self):
+        adaptive_delay = AdaptiveDelay('test_persistence', 0.0, validate=self.validate, path=self.path)
+        adaptive_delay.query(SlowResource(0.015), 'KRDG? A;KRDG? B')
+        learned = AdaptiveDelay('test_persistence', 0.0, path=self.path)
+        self.assertEqual(learned.delays, adaptive_delay.delays)
+        self.assertEqual(AdaptiveDelay('other_device', 0.0, path=self.path).delays, {})
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,134 @@
+#!/usr/bin/env python
+
+"""
+
+Tests for the per-instrument command executor.
+
+"""
+
+__author__ = "Ivan Jakovac"
+__email__ = "ivan.jakovac2@gmail.com"
+__version__ = "v0.1"
+
+
+#  Copyright (C) 2020-2025 Ivan Jakovac
+#
+#  This program is free software: you can redistribute it and/or modify it under the terms of the GNU General Public
+#  License as published by the Free Software Foundation, either version 3 of the License, or (at your option) any
+#  later version.
+#
+#  This program is distributed in the hope that it will be useful, but WITHOUT ANY WARRANTY; without even the implied
+#  warranty of MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License along with this program. If not,
+#  see <https://www.gnu.org/licenses/>.
+
+import unittest
+import sys
+import threading
+sys.path.append('../src/flaskr/modules')
+from pyExecutor import DeviceExecutor, execute, coalesce
+
+class TestDeviceExecutor(unittest.TestCase):
+    """
+    Test command ordering and error handling
+    """
+    def setUp(self):
+        self.executor = DeviceExecutor('test_executor')
+        self.executed = []
+
+    def test_priority_order(self):
+        # Block the worker so that the following commands wait in the queue
+        release = threading.Event()
+        blocking = self.executor.submit(DeviceExecutor.READ, release.wait)
+        futures = [self.executor.submit(DeviceExecutor.READ, self.executed.append, 'read'),
+                   self.executor.submit(DeviceExecutor.WRITE, self.executed.append, 'write'),
+                   self.executor.submit(DeviceExecutor.CONTROL, self.executed.append, 'control'),
+                   self.executor.submit(DeviceExecutor.READ, self.executed.append, 'second read')]
+        release.set()
+        for future in [blocking] + futures:
+            future.result(timeout=5)
+        self.assertEqual(self.executed, ['control', 'write', 'read', 'second read'])
+
+    def test_exception(self):
+        with self.assertRaises(ZeroDivisionError):
+            self.executor.call(DeviceExecutor.READ, lambda: 1/0)
+
+    def test_nested_call(self):
+        # Decorated methods calling each other run directly on the worker thread
+        class Device:
+            def __init__(self, executor):
+                self.executor = executor
+
+            @execute(DeviceExecutor.READ)
+            def outer(self):
+                return self.inner() + 1
+
+            @execute(DeviceExecutor.READ)
+            def inner(self):
+                return 1
+
+        self.assertEqual(Device(self.executor).outer(), 2)
+
+class TestCoalescing(unittest.TestCase):
+    """
+    Test that identical queries inside a coalescing window reach the instrument once
+    """
+    class Device:
+        def __init__(self):
+            self.executor = DeviceExecutor('test_coalescing')
+            self.sent = []
+
+        @coalesce(lambda command: '?' in command)
+        @execute(DeviceExecutor.READ)
+        def query(self, command):
+            self.sent.append(command)
+            return f'{command} {len(self.sent)}'
+
+        @execute(DeviceExecutor.READ)
+        def get_PID(self):
+            return self.query('PID? 2')
+
+        @execute(DeviceExecutor.WRITE)
+        def write(self, command):
+            self.sent.append(command)
+
+        @execute(DeviceExecutor.READ)
+        def get_minimum(self):
+            # Read which moves a marker before querying it
+            self.write('MARK1:FUNC:EXEC MIN')
+            return self.query('MARK1:Y?')
+
+    def setUp(self):
+        self.device = self.Device()
+
+    def test_window(self):
+        with self.device.executor.coalescing():
+            responses = [self.device.get_PID() for pid in 'PID'] + [self.device.query('PID? 2')]
+        self.assertEqual(set(responses), {'PID? 2 1'})
+        # Outside of the window every query is sent
+        self.device.get_PID()
+        self.assertEqual(self.device.sent, ['PID? 2', 'PID? 2'])
+
+    def test_write_clears_window(self):
+        with self.device.executor.coalescing():
+            self.device.query('SETP? 2')
+            self.device.write('SETP 2,10')
+            self.device.query('SETP? 2')
+            # Commands which are not queries are never coalesced
+            self.device.query('*CLS')
+            self.device.query('*CLS')
+        self.assertEqual(self.device.sent, ['SETP? 2', 'SETP 2,10', 'SETP? 2', '*CLS', '*CLS'])
+
+    def test_nested_write_clears_window(self):
+        with self.device.executor.coalescing():
+            self.device.query('MARK1:Y?')
+            self.device.get_minimum()
+            # Non-query sent through query() clears the window as well
+            self.device.query('MARK1:X 5E9')
+            self.device.query('MARK1:Y?')
+        self.assertEqual(self.device.sent, ['MARK1:Y?', 'MARK1:FUNC:EXEC MIN', 'MARK1:Y?', 'MARK1:X 5E9',
+                                            'MARK1:Y?'])
+
+if __name__=="__main__":
+    unittest.main()
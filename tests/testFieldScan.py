@@ -0,0 +1,143 @@
+#!/usr/bin/env python
+
+"""
+
+Tests for field-synchronized VNA acquisition.
+
+"""
+
+__author__ = "Ivan Jakovac"
+__email__ = "ivan.jakovac2@gmail.com"
+__version__ = "v0.1"
+
+
+#  Copyright (C) 2020-2025 Ivan Jakovac
+#
+#  This program is free software: you can redistribute it and/or modify it under the terms of the GNU General Public
+#  License as published by the Free Software Foundation, either version 3 of the License, or (at your option) any
+#  later version.
+#
+#  This program is distributed in the hope that it will be useful, but WITHOUT ANY WARRANTY; without even the implied
+#  warranty of MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License along with this program. If not,
+#  see <https://www.gnu.org/licenses/>.
+
+import unittest
+import sys
+import time
+from threading import Event
+from contextlib import contextmanager
+sys.path.append('../src/flaskr/modules')
+import numpy as np
+from pyFieldScan import FieldScan, run_field_scan
+from pyJobs import Job, JobManager
+
+class SweepingIPS:
+    # Output field moves 0.1 T towards the setpoint on every field reading while going to setpoint
+    field_tolerance = 0.001
+
+    def __init__(self):
+        self.field, self.setpoint, self.sweeping, self.calls = 0.0, 0.0, False, []
+
+    def read_field_sample(self):
+        if self.sweeping:
+            self.field = round(self.field + max(min(self.setpoint - self.field, 0.1), -0.1), 4)
+        self.calls.append('sample')
+        return time.time(), self.field, 10*self.field
+
+    def apply_session(self, steps):
+        for step in steps:
+            self.calls.append(step['method'])
+            if step['method'] == 'set_setpoint_field':
+                self.setpoint = step['args'][0]
+        self.sweeping = True
+
+    def set_hold(self):
+        self.calls.append('set_hold')
+        self.sweeping = False
+
+class TriggeredVNA:
+    def __init__(self, points=5, started=None, change_after=None):
+        self.points, self.started, self.holders, self.traces = points, started, 0, 0
+        # Sweep points are changed by another client after change_after traces
+        self.change_after = change_after
+
+    @contextmanager
+    def single_sweeps(self):
+        self.holders += 1
+        try:
+            yield
+        finally:
+            self.holders -= 1
+
+    def get_sweep_range(self):
+        return [10.0, 20.0]
+
+    def get_sweep_points(self):
+        return self.points
+
+    def read_frequencies(self):
+        return np.linspace(10, 20, self.points)
+
+    def acquire_trace(self):
+        if self.started is not None:
+            self.started.set()
+            time.sleep(0.01)
+        self.traces += 1
+        if self.traces == self.change_after:
+            self.points += 1
+        return np.full(self.points, self.traces*(1 + 1j))
+
+class TestFieldScan(unittest.TestCase):
+    """
+    Test traces stamped with the field before and after them
+    """
+    def setUp(self):
+        self.ips, self.vna = SweepingIPS(), TriggeredVNA()
+        self.scan = FieldScan(capacity=2)
+
+    def test_run_field_scan(self):
+        summary = run_field_scan(self.ips, self.vna, self.scan, 0.5, rate=0.1)
+        result = self.scan.to_dict()
+        # Readings 0.1/0.2, 0.3/0.4 and 0.5/0.5: arrival after the third trace
+        self.assertEqual(summary['traces'], 3)
+        self.assertEqual(result['data'].shape, (3, 5))
+        np.testing.assert_allclose(result['field_before'], [0.1, 0.3, 0.5])
+        np.testing.assert_allclose(result['field_after'], [0.2, 0.4, 0.5])
+        np.testing.assert_allclose(result['field'], [0.15, 0.35, 0.5])
+        self.assertTrue((result['time_after'] >= result['time_before']).all())
+        np.testing.assert_array_equal(result['data'][:, 0], [1 + 1j, 2 + 2j, 3 + 3j])
+        np.testing.assert_allclose(result['frequency'], np.linspace(10, 20, 5))
+        # Sweep started in one session, stopped at the end; VNA sweep released
+        self.assertEqual(self.ips.calls[1:4], ['set_sweep_rate_field', 'set_setpoint_field', 'set_go_to_setpoint'])
+        self.assertEqual(self.ips.calls[-1], 'set_hold')
+        self.assertEqual(self.vna.holders, 0)
+
+    def test_sweep_change(self):
+        vna = TriggeredVNA(change_after=3)
+        with self.assertRaises(ValueError):
+            run_field_scan(self.ips, vna, self.scan, 5.0)
+        # Only traces of the original sweep are kept
+        self.assertEqual(len(self.scan), 2)
+        self.assertEqual(self.ips.calls[-1], 'set_hold')
+        self.assertEqual(vna.holders, 0)
+
+    def test_max_traces(self):
+        summary = run_field_scan(self.ips, self.vna, self.scan, 5.0, max_traces=4)
+        self.assertEqual(summary['traces'], 4)
+        self.assertEqual(len(self.scan.to_dict()['field']), 4)
+
+    def test_cancel(self):
+        started = Event()
+        manager = JobManager()
+        vna = TriggeredVNA(started=started)
+        job = manager.submit('IPS120', 'field_scan', run_field_scan, self.ips, vna, self.scan, 1000.0)
+        started.wait(5)
+        manager.cancel(job.id)
+        self.assertEqual(manager.wait(job, timeout=5).status, Job.CANCELLED)
+        self.assertEqual(self.ips.calls[-1], 'set_hold')
+        self.assertGreater(len(self.scan), 0)
+
+if __name__=="__main__":
+    unittest.main()
@@ -26,6 +26,7 @@ __version__ = "v0.1"
 import unittest
 import sys
 sys.path.append('../src/flaskr/modules')
+import numpy as np
 from pyIPS120 import IPS120
 
 class TestAllGetterTypes(unittest.TestCase):
@@ -107,5 +108,141 @@ class TestNonActiveSetters(unittest.TestCase):
         self.ips.set_sweep_rate_field(sweep_rate=test_value)
         self.assertEqual(self.ips.get_sweep_rate_field(), test_value)
         
+class TestSnapshot(unittest.TestCase):
+    """
+    Test the status and readings snapshot
+    """
+    class RecordingResource:
+        # Answers X with the status string and R n with 'R' followed by n
+        def __init__(self):
+            self.queries = []
+
+        def query(self, command):
+            self.queries.append(command)
+            return 'X00A1C3H1M00P03' if command == 'X' else f'R+{command.split()[1]}.000'
+
+    def setUp(self):
+        self.ips = IPS120()
+        self.resource = self.RecordingResource()
+        self.ips.ips = self.resource
+
+    def test_get_snapshot(self):
+        snapshot = self.ips.get_snapshot()
+        self.assertEqual(self.resource.queries, ['X', 'R 0', 'R 2', 'R 5', 'R 6', 'R 7', 'R 8', 'R 9', 'R 16', 'R 18',
+                                                 'R 20'])
+        self.assertEqual(snapshot['persistent_field'], 18.0)
+        self.assertEqual(snapshot['activity_status'], 'To setpoint')
+        self.assertTrue(snapshot['is_heater_on'])
+        self.assertTrue(snapshot['is_going_to_setpoint'])
+        self.assertFalse(snapshot['is_on_hold'])
+        self.assertIsInstance(snapshot['timestamp'], float)
+
+    def test_seeded_cache(self):
+        self.ips.get_snapshot()
+        self.assertEqual(self.ips.get_output_field(max_age=10), 7.0)
+        self.assertTrue(self.ips.get_is_heater_on(max_age=10))
+        self.assertFalse(self.ips.get_is_clamped(max_age=10))
+        self.assertEqual(len(self.resource.queries), 11)
+
+    def test_boolean_helpers(self):
+        # Helpers derive from one status query
+        self.assertTrue(self.ips.get_is_going_to_setpoint())
+        self.assertEqual(self.resource.queries, ['X'])
+
+class TestRemoteSession(unittest.TestCase):
+    """
+    Test setters applied in one remote control session
+    """
+    class RecordingResource:
+        def __init__(self):
+            self.queries = []
+
+        def query(self, command):
+            self.queries.append(command)
+            return command[0]
+
+        def clear(self):
+            pass
+
+    def setUp(self):
+        self.ips = IPS120()
+        self.resource = self.RecordingResource()
+        self.ips.ips = self.resource
+
+    def test_single_setter(self):
+        self.ips.set_setpoint_field(2.5)
+        self.assertEqual(self.resource.queries, ['C1', 'J2.5000', 'C0'])
+
+    def test_apply_session(self):
+        self.ips.apply_session([{'method': 'set_sweep_rate_field', 'args': {'sweep_rate': 0.1}},
+                                {'method': 'set_setpoint_field', 'args': [2.5]},
+                                {'method': 'set_go_to_setpoint'}])
+        self.assertEqual(self.resource.queries, ['C1', 'T0.100', 'J2.5000', 'A1', 'C0'])
+
+    def test_invalid_step(self):
+        # Nothing is sent if any step is not an allowed setter
+        with self.assertRaises(ValueError):
+            self.ips.apply_session([{'method': 'set_hold'}, {'method': 'set_magnet_field', 'args': [1.0]}])
+        self.assertEqual(self.resource.queries, [])
+
+    def test_release_on_error(self):
+        # Local control is restored if a step fails
+        with self.assertRaises(TypeError):
+            self.ips.apply_session([{'method': 'set_hold'}, {'method': 'set_setpoint_field'}])
+        self.assertEqual(self.resource.queries, ['C1', 'A0', 'C0'])
+        self.assertEqual(self.ips.remote_depth, 0)
+
+class TestSweepProfile(unittest.TestCase):
+    """
+    Test the field profile executor against a simulated ramp
+    """
+    class RampResource:
+        # Output field moves 0.25 T towards the setpoint on every field reading while going to setpoint
+        def __init__(self):
+            self.queries = []
+            self.field, self.setpoint, self.sweeping = 0.0, 0.0, False
+
+        def query(self, command):
+            self.queries.append(command)
+            if command.startswith('J'):
+                self.setpoint = float(command[1:])
+            elif command.startswith('A'):
+                self.sweeping = command == 'A1'
+            elif command == 'R 7':
+                if self.sweeping:
+                    step = max(min(self.setpoint - self.field, 0.25), -0.25)
+                    self.field = round(self.field + step, 4)
+                return f'R+{self.field:.4f}'
+            elif command == 'R 0':
+                return f'R+{10*self.field:.3f}'
+            return command[0]
+
+    def setUp(self):
+        self.ips = IPS120()
+        self.resource = self.RampResource()
+        self.ips.ips = self.resource
+
+    def test_run_field_profile(self):
+        summary = self.ips.run_field_profile([{'field': 1.0, 'rate': 0.5}, {'field': 0.5, 'dwell': 0.05}],
+                                             tolerance=0.01, sample_interval=0.01)
+        columns = self.ips.profile_log.columns()
+        self.assertEqual(summary['samples'], len(columns['time']))
+        # 0, 0.25, ..., 1.0 in segment 0, then 0.75, 0.5 and dwell samples in segment 1
+        self.assertEqual(columns['output_field'][:5].tolist(), [0.25, 0.5, 0.75, 1.0, 0.75])
+        self.assertEqual(columns['segment'][:5].tolist(), [0, 0, 0, 0, 1])
+        self.assertGreater(len(columns['time']), 6)
+        self.assertTrue((columns['output_field'][5:] == 0.5).all())
+        self.assertEqual(columns['output_current'].tolist(), (10*columns['output_field']).tolist())
+        self.assertTrue((np.diff(columns['time']) > 0).all())
+        # One remote control session per segment, hold at the end
+        self.assertEqual(self.resource.queries.count('C1'), 3)
+        self.assertIn('T0.500', self.resource.queries)
+        self.assertEqual(self.resource.queries[-3:], ['C1', 'A0', 'C0'])
+
+    def test_invalid_profile(self):
+        with self.assertRaises(ValueError):
+            self.ips.run_field_profile([{'field': 1.0, 'rate': -0.1}])
+        self.assertEqual(self.resource.queries, [])
+
 if __name__=="__main__":
     unittest.main()
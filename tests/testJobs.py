@@ -0,0 +1,123 @@
+#!/usr/bin/env python
+
+"""
+
+Tests for asynchronous jobs.
+
+"""
+
+__author__ = "Ivan Jakovac"
+__email__ = "ivan.jakovac2@gmail.com"
+__version__ = "v0.1"
+
+
+#  Copyright (C) 2020-2025 Ivan Jakovac
+#
+#  This program is free software: you can redistribute it and/or modify it under the terms of the GNU General Public
+#  License as published by the Free Software Foundation, either version 3 of the License, or (at your option) any
+#  later version.
+#
+#  This program is distributed in the hope that it will be useful, but WITHOUT ANY WARRANTY; without even the implied
+#  warranty of MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License along with this program. If not,
+#  see <https://www.gnu.org/licenses/>.
+
+import unittest
+import sys
+import time
+from threading import Event
+sys.path.append('../src/flaskr/modules')
+from pyJobs import Job, JobManager, sleep, report_progress, cancelled
+
+class TestJobManager(unittest.TestCase):
+    """
+    Test job results, per-device ordering, progress, cancellation and bounded history
+    """
+    def setUp(self):
+        self.manager = JobManager(max_workers=4, history=3)
+
+    def finish(self, job):
+        return self.manager.wait(job, timeout=5)
+
+    def test_result(self):
+        job = self.finish(self.manager.submit('Device', 'add', lambda a, b: a + b, 1, b=2))
+        self.assertEqual(job.status, Job.SUCCEEDED)
+        self.assertEqual(job.result, 3)
+        failed = self.finish(self.manager.submit('Device', 'divide', lambda: 1/0))
+        self.assertEqual(failed.status, Job.FAILED)
+        self.assertIn('ZeroDivisionError', failed.error)
+
+    def test_device_exclusion(self):
+        # Jobs of the same device run one at a time and in order, other devices are not blocked
+        order, release = [], Event()
+        def hold():
+            release.wait(5)
+            order.append('first')
+        first = self.manager.submit('Device', 'hold', hold)
+        second = self.manager.submit('Device', 'append', order.append, 'second')
+        other = self.finish(self.manager.submit('OtherDevice', 'add', lambda: 1))
+        self.assertEqual(other.status, Job.SUCCEEDED)
+        self.assertEqual(second.status, Job.QUEUED)
+        release.set()
+        self.finish(second)
+        self.assertEqual(order, ['first', 'second'])
+
+    def test_progress(self):
+        def ramp():
+            for step in range(1, 5):
+                report_progress(step/4, f'step {step}')
+                sleep(0.01)
+            return 'done'
+        job = self.manager.submit('Device', 'ramp', ramp)
+        version, progress = -1, []
+        while not job.done:
+            self.manager.wait(job, version, timeout=5)
+            version = job.version
+            progress.append(job.progress)
+        self.assertEqual(progress[-1], 1.0)
+        self.assertEqual(job.result, 'done')
+
+    def test_cancel(self):
+        started = Event()
+        def wait_forever():
+            started.set()
+            sleep(60)
+        running = self.manager.submit('Device', 'wait', wait_forever)
+        queued = self.manager.submit('Device', 'wait', wait_forever)
+        started.wait(5)
+        self.manager.cancel(queued.id)
+        self.manager.cancel(running.id)
+        self.assertEqual(self.finish(running).status, Job.CANCELLED)
+        self.assertEqual(queued.status, Job.CANCELLED)
+        self.assertIsNone(queued.started)
+
+    def test_cancelled_flag(self):
+        started = Event()
+        def poll():
+            started.set()
+            while not cancelled():
+                time.sleep(0.001)
+            return 'stopped'
+        job = self.manager.submit('Device', 'poll', poll)
+        started.wait(5)
+        self.manager.cancel(job.id)
+        # Method which checks cancelled() returns normally
+        self.assertEqual(self.finish(job).result, 'stopped')
+
+    def test_history(self):
+        jobs = [self.finish(self.manager.submit('Device', 'add', lambda: 1)) for _ in range(5)]
+        self.assertEqual([job.id for job in self.manager.list()], [job.id for job in jobs[-3:]])
+        with self.assertRaises(KeyError):
+            self.manager.get(jobs[0].id)
+
+    def test_outside_job(self):
+        # Helpers are plain calls outside of jobs
+        report_progress(0.5)
+        self.assertFalse(cancelled())
+        start = time.perf_counter()
+        sleep(0.01)
+        self.assertGreaterEqual(time.perf_counter() - start, 0.01)
+
+if __name__=="__main__":
+    unittest.main()
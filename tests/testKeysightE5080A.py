@@ -25,8 +25,9 @@ __version__ = "v0.1"
 
 import unittest
 import sys
+import numpy as np
 sys.path.append('../src/flaskr/modules')
-from pyKeysightE5080A import KeysightE5080A
+from pyKeysightE5080A import KeysightE5080A, sweep_windows
 
 class TestAllGetterTypes(unittest.TestCase):
     """
@@ -104,5 +105,126 @@ class TestAllSetters(unittest.TestCase):
         self.VNA.set_sweep_range(*test_value)
         self.assertEqual(self.VNA.get_sweep_range(), test_value)
         
+class TestTraceTransfer(unittest.TestCase):
+    """
+    Test binary (REAL,64) and ASCII trace transfer
+    """
+    class TraceResource:
+        # Mock VNA with a 5-point linear sweep 10-14 MHz
+        def __init__(self):
+            self.frequencies = np.linspace(10e6, 14e6, 5)
+            self.data = np.arange(5) + 1j*np.arange(5, 10)
+            self.writes = []
+
+        def write(self, command):
+            self.writes.append(command)
+
+        def query(self, command):
+            responses = {':SENS1:FREQ:STAR?': '1.0E+07', ':SENS1:FREQ:STOP?': '1.4E+07', ':SENS1:SWE:POIN?': '5',
+                         '*OPC?': '1',
+                         ':CALC1:MEAS1:DATA:SDAT?': ','.join(str(value) for value in self.data.view(np.float64))}
+            return responses[command]
+
+        def query_binary_values(self, command, datatype, is_big_endian, container):
+            values = {':CALC1:MEAS1:X?': self.frequencies, ':CALC1:MEAS1:DATA:SDAT?': self.data.view(np.float64)}
+            return container(values[command])
+
+    def setUp(self):
+        self.VNA = KeysightE5080A()
+        self.resource = self.TraceResource()
+        self.VNA.VNA = self.resource
+
+    def test_binary_transfer(self):
+        self.VNA.binary_transfer = True
+        frequencies, data = self.VNA.get_complex_array()
+        np.testing.assert_allclose(frequencies, [10, 11, 12, 13, 14])
+        np.testing.assert_array_equal(data, self.resource.data)
+        self.assertIn(':FORM:DATA REAL,64', self.resource.writes)
+        self.assertEqual(self.resource.writes[-1], ':FORM:DATA ASCII,0')
+
+    def test_ascii_transfer(self):
+        self.VNA.binary_transfer = False
+        frequencies, data = self.VNA.get_complex_array()
+        np.testing.assert_allclose(frequencies, [10, 11, 12, 13, 14])
+        np.testing.assert_array_equal(data, self.resource.data)
+
+    def test_complex_data(self):
+        self.VNA.binary_transfer = True
+        return_value = self.VNA.get_complex_data()
+        self.assertEqual(return_value[1], (11.0, 1+6j))
+        self.assertIsInstance(return_value[0][0], float)
+        self.assertIsInstance(return_value[0][1], complex)
+
+    def test_acquire_trace(self):
+        self.VNA.binary_transfer = True
+        self.VNA.set_single_sweeps(True)
+        data = self.VNA.acquire_trace()
+        self.VNA.set_single_sweeps(False)
+        np.testing.assert_array_equal(data, self.resource.data)
+        self.assertEqual(self.resource.writes[0], ':INIT1:CONT OFF')
+        self.assertEqual(self.resource.writes[1], ':INIT1:IMM')
+        self.assertEqual(self.resource.writes[-1], ':INIT1:CONT ON')
+
+    def test_averaged_array(self):
+        self.VNA.binary_transfer = True
+        frequencies, data = self.VNA.get_averaged_array(4)
+        np.testing.assert_array_equal(data, self.resource.data)
+        self.assertEqual(self.resource.writes.count(':INIT1:IMM'), 4)
+        self.assertEqual(self.resource.writes[-1], ':INIT1:CONT ON')
+        # Bins of 2 points, the last bin has a single point
+        frequencies, data = self.VNA.get_averaged_array(2, bin_size=2)
+        np.testing.assert_allclose(frequencies, [10.5, 12.5, 14])
+        np.testing.assert_allclose(data, [0.5+5.5j, 2.5+7.5j, 4+9j])
+
+    def test_single_sweep_holders(self):
+        self.VNA.binary_transfer = True
+        with self.VNA.single_sweeps():
+            # Averaging inside a held stream does not resume continuous sweeps
+            self.VNA.get_averaged_array(2)
+            self.assertNotIn(':INIT1:CONT ON', self.resource.writes)
+        self.assertEqual(self.resource.writes.count(':INIT1:CONT OFF'), 1)
+        self.assertEqual(self.resource.writes[-1], ':INIT1:CONT ON')
+        self.assertEqual(self.VNA.single_sweep_holders, 0)
+
+class TestStitchedScan(unittest.TestCase):
+    """
+    Test wide-band scans stitched from sequential sweep windows
+    """
+    class SweepResource:
+        # Mock VNA which keeps its sweep settings, S11 = frequency [MHz] * 1j
+        def __init__(self):
+            self.settings = {':SENS1:FREQ:STAR': 1e7, ':SENS1:FREQ:STOP': 1.4e7, ':SENS1:SWE:POIN': 5}
+
+        def write(self, command):
+            header, _, value = command.partition(' ')
+            if header in self.settings:
+                self.settings[header] = float(value)
+
+        def query(self, command):
+            return '1' if command == '*OPC?' else str(self.settings[command.rstrip('?')])
+
+        def frequencies(self):
+            return np.linspace(self.settings[':SENS1:FREQ:STAR'], self.settings[':SENS1:FREQ:STOP'],
+                               int(self.settings[':SENS1:SWE:POIN']))
+
+        def query_binary_values(self, command, datatype, is_big_endian, container):
+            if command == ':CALC1:MEAS1:X?':
+                return container(self.frequencies())
+            return container((self.frequencies()/1e6*1j).view(np.float64))
+
+    def setUp(self):
+        self.VNA = KeysightE5080A()
+        self.VNA.binary_transfer = True
+        self.resource = self.SweepResource()
+        self.VNA.VNA = self.resource
+
+    def test_windows(self):
+        frequencies, data = self.VNA.get_stitched_array(sweep_windows(10, 40, 3, 11))
+        np.testing.assert_allclose(frequencies, np.linspace(10, 40, 31))
+        np.testing.assert_allclose(data, frequencies*1j)
+        # Sweep settings are restored
+        self.assertEqual(self.resource.settings, {':SENS1:FREQ:STAR': 1e7, ':SENS1:FREQ:STOP': 1.4e7,
+                                                  ':SENS1:SWE:POIN': 5})
+
 if __name__=="__main__":
     unittest.main()
@@ -104,5 +104,50 @@ class TestAllSetters(unittest.TestCase):
         self.ls336.set_manual_output(test_value, control_loop=2)
         self.assertEqual(self.ls336.get_manual_output(control_loop=2), test_value)
         
+class TestSnapshot(unittest.TestCase):
+    """
+    Test the multi-reading snapshot (queries joined with ';')
+    """
+    class JoinedQueryResource:
+        # Answers every query of a joined message, like the instrument does
+        responses = {'KRDG?': '+004.321', 'SRDG?': '+1234.56', 'SETP?': '+4.3210', 'HTR?': '+012.3', 'RANGE?': '2',
+                     'RAMP?': '1,+0.5000', 'MOUT?': '+00.000', 'PID?': '+0050.0,+0020.0,+000.0'}
+
+        def __init__(self):
+            self.messages = []
+
+        def query(self, message):
+            self.messages.append(message)
+            return ';'.join([self.responses[query.split()[0]] for query in message.split(';')])
+
+        # Adaptive query delay writes and reads separately
+        def write(self, message):
+            self.written = message
+
+        def read(self):
+            return self.query(self.written)
+
+    def setUp(self):
+        self.ls336 = Lakeshore336()
+        self.resource = self.JoinedQueryResource()
+        self.ls336.ls336 = self.resource
+
+    def test_get_snapshot(self):
+        snapshot = self.ls336.get_snapshot()
+        self.assertEqual(len(self.resource.messages), 2)
+        for message in self.resource.messages:
+            self.assertLessEqual(len(message), self.ls336.max_message_length)
+        self.assertEqual(snapshot['channels']['A'], {'temperature': 4.321, 'sensor': 1234.56})
+        self.assertEqual(snapshot['loops'][2]['heater_range'], 2)
+        self.assertEqual(snapshot['loops'][2]['PID'], [50., 20., 0.])
+        self.assertTrue(snapshot['loops'][2]['ramp_enabled'])
+        self.assertIsInstance(snapshot['timestamp'], float)
+
+    def test_seeded_cache(self):
+        self.ls336.get_snapshot()
+        self.assertEqual(self.ls336.get_temperature('B', max_age=10), 4.321)
+        self.assertEqual(self.ls336.get_ramp_rate(2, max_age=10), 0.5)
+        self.assertEqual(len(self.resource.messages), 2)
+
 if __name__=="__main__":
     unittest.main()
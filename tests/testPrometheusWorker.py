@@ -0,0 +1,164 @@
+#!/usr/bin/env python
+
+"""
+
+Tests for the Prometheus worker scheduler.
+
+"""
+
+__author__ = "Ivan Jakovac"
+__email__ = "ivan.jakovac2@gmail.com"
+__version__ = "v0.1"
+
+
+#  Copyright (C) 2020-2025 Ivan Jakovac
+#
+#  This program is free software: you can redistribute it and/or modify it under the terms of the GNU General Public
+#  License as published by the Free Software Foundation, either version 3 of the License, or (at your option) any
+#  later version.
+#
+#  This program is distributed in the hope that it will be useful, but WITHOUT ANY WARRANTY; without even the implied
+#  warranty of MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License along with this program. If not,
+#  see <https://www.gnu.org/licenses/>.
+
+import unittest
+import sys
+import json
+import os
+import tempfile
+import time
+from threading import Thread
+from types import SimpleNamespace
+sys.path.append('../src')
+from prometheusWorker import PrometheusWorker
+from prometheus_client import REGISTRY
+
+class Device:
+    def __init__(self):
+        self.calls = []
+
+    def get_value(self, channel: str = 'A'):
+        self.calls.append((channel, time.monotonic()))
+        return len(self.calls)
+
+class TestScheduler(unittest.TestCase):
+    """
+    Test sub-second update intervals, fixed-rate rescheduling and per-device polling lanes
+    """
+    def setUp(self):
+        self.device, self.other_device = Device(), Device()
+        configuration = {device: [{'type': 'gauge',
+                                   'name': f'test_{device}_{self.id().split(".")[-1]}',
+                                   'description': 'Test value',
+                                   'label_names': ['channel'],
+                                   'label_values': [['A'], ['B']],
+                                   'method': 'get_value',
+                                   'update_interval': 0.1}] for device in ['Device', 'OtherDevice']}
+        with tempfile.NamedTemporaryFile('w', suffix='.json', delete=False) as config_file:
+            json.dump(configuration, config_file)
+        self.addCleanup(os.remove, config_file.name)
+        self.worker = PrometheusWorker(SimpleNamespace(local_devices={'Device': self.device,
+                                                                     'OtherDevice': self.other_device}), config_file.name)
+
+    def run_worker(self, duration: float):
+        thread = Thread(target=self.worker.run, daemon=True)
+        thread.start()
+        time.sleep(duration)
+        self.worker.stop()
+        thread.join(timeout=1)
+        self.assertFalse(thread.is_alive())
+
+    def test_sub_second_interval(self):
+        self.run_worker(0.55)
+        calls_A = [timestamp for channel, timestamp in self.device.calls if channel == 'A']
+        self.assertIn(len(calls_A), [5, 6, 7])
+
+    def test_fixed_rate(self):
+        # A slow device call must not shift the following deadlines
+        get_value = self.device.get_value
+        def slow_get_value(channel):
+            value = get_value(channel)
+            if value == 3:
+                time.sleep(0.25)
+            return value
+        self.worker.list_of_update_calls[0][1] = slow_get_value
+        self.run_worker(0.75)
+        calls_A = [timestamp for channel, timestamp in self.device.calls if channel == 'A']
+        # Missed updates are skipped, the rest stay on the 0.1 s grid
+        offsets = [(timestamp - calls_A[0]) / 0.1 for timestamp in calls_A]
+        for offset in offsets:
+            self.assertAlmostEqual(offset, round(offset), delta=0.3)
+        self.assertLess(len(calls_A), 8)
+
+    def test_parallel_lanes(self):
+        # A hung device does not delay (or stop) polling of other devices
+        def hung_get_value(channel):
+            time.sleep(10)
+        self.worker.list_of_update_calls[0][1] = hung_get_value
+        self.worker.list_of_update_calls[1][1] = hung_get_value
+        thread = Thread(target=self.worker.run, daemon=True)
+        thread.start()
+        time.sleep(0.55)
+        self.worker.stop()
+        calls_A = [timestamp for channel, timestamp in self.other_device.calls if channel == 'A']
+        self.assertIn(len(calls_A), [5, 6, 7])
+
+    def test_errors(self):
+        # Failing updates do not stop the polling lane
+        def failing_get_value(channel):
+            raise IOError('Device not responding')
+        self.worker.list_of_update_calls[0][1] = failing_get_value
+        self.run_worker(0.35)
+        calls_B = [timestamp for channel, timestamp in self.device.calls if channel == 'B']
+        self.assertIn(len(calls_B), [3, 4, 5])
+
+class TestQueryCoalescing(unittest.TestCase):
+    """
+    Test that metrics sharing one instrument query are updated from a single query
+    """
+    def setUp(self):
+        sys.path.append('../src/flaskr/modules')
+        from pyExecutor import DeviceExecutor, execute, coalesce
+
+        class PIDDevice:
+            def __init__(self):
+                self.executor = DeviceExecutor('test_pid_device')
+                self.sent = []
+
+            @coalesce(lambda command: '?' in command)
+            @execute(DeviceExecutor.READ)
+            def query(self, command):
+                self.sent.append(command)
+                return '10.0,20.0,0.0'
+
+            @execute(DeviceExecutor.READ)
+            def get_PID(self, control_loop: int):
+                return tuple(float(value) for value in self.query(f'PID? {control_loop}').split(','))
+
+        self.device = PIDDevice()
+        configuration = {'PIDDevice': [{'type': 'gauge',
+                                        'name': 'test_coalesced_pid',
+                                        'description': 'Test PID',
+                                        'label_names': ['control_loop', 'pid'],
+                                        'label_values': [[2, 'P'], [2, 'I'], [2, 'D']],
+                                        'result_labels': {'pid': ['P', 'I', 'D']},
+                                        'method': 'get_PID',
+                                        'update_interval': 10}]}
+        with tempfile.NamedTemporaryFile('w', suffix='.json', delete=False) as config_file:
+            json.dump(configuration, config_file)
+        self.addCleanup(os.remove, config_file.name)
+        self.worker = PrometheusWorker(SimpleNamespace(local_devices={'PIDDevice': self.device}), config_file.name)
+
+    def test_single_query(self):
+        thread = Thread(target=self.worker.run, daemon=True)
+        thread.start()
+        time.sleep(0.2)
+        self.worker.stop()
+        self.assertEqual(self.device.sent, ['PID? 2'])
+        values = [REGISTRY.get_sample_value('test_coalesced_pid', {'control_loop': '2', 'pid': pid}) for pid in 'PID']
+        self.assertEqual(values, [10.0, 20.0, 0.0])
+
+if __name__ == '__main__':
+    unittest.main()
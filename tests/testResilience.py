@@ -0,0 +1,232 @@
+#!/usr/bin/env python
+
+"""
+
+Tests for bounded retries and circuit breaking of instrument operations.
+
+"""
+
+__author__ = "Ivan Jakovac"
+__email__ = "ivan.jakovac2@gmail.com"
+__version__ = "v0.1"
+
+
+#  Copyright (C) 2020-2025 Ivan Jakovac
+#
+#  This program is free software: you can redistribute it and/or modify it under the terms of the GNU General Public
+#  License as published by the Free Software Foundation, either version 3 of the License, or (at your option) any
+#  later version.
+#
+#  This program is distributed in the hope that it will be useful, but WITHOUT ANY WARRANTY; without even the implied
+#  warranty of MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License along with this program. If not,
+#  see <https://www.gnu.org/licenses/>.
+
+import unittest
+import sys
+import time
+import configparser
+sys.path.append('../src/flaskr/modules')
+from pyResilience import Resilience, InstrumentError, resilient, jittered_backoff, close_resources
+from pyILM import ILM
+from pyLakeshore336 import Lakeshore336
+from pyKeysightE5080A import KeysightE5080A
+
+class FlakyDevice:
+    def __init__(self, failures: int, threshold: int = 10):
+        config = configparser.ConfigParser()
+        config['FlakyDevice'] = {'retries': '2', 'backoff': '0.001', 'failure_threshold': str(threshold),
+                                 'probe_interval': '0.01'}
+        self.resilience = Resilience('FlakyDevice', config, self.connect)
+        self.failures = failures
+        self.calls = 0
+        self.connects = 0
+
+    def connect(self):
+        self.connects += 1
+
+    @resilient
+    def query(self, argument):
+        self.calls += 1
+        if self.calls <= self.failures:
+            raise OSError('Port not responding')
+        return argument
+
+    @resilient
+    def get_value(self):
+        # Nested operation: retried once as a whole, not per query
+        return float(self.query('1.5'))
+
+    @resilient(retry=False)
+    def write(self, argument):
+        self.calls += 1
+        raise OSError('Port not responding')
+
+    @resilient
+    def get_invalid(self):
+        self.calls += 1
+        raise TypeError('Not an instrument error')
+
+class TestResilience(unittest.TestCase):
+    """
+    Test bounded retries, the circuit breaker and reconnection
+    """
+    def test_retry(self):
+        device = FlakyDevice(failures=2)
+        self.assertEqual(device.query('X'), 'X')
+        self.assertEqual(device.calls, 3)
+
+    def test_bounded_retries(self):
+        device = FlakyDevice(failures=100)
+        with self.assertRaises(InstrumentError) as context:
+            device.get_value()
+        self.assertEqual(device.calls, 3)
+        self.assertEqual(context.exception.attempts, 3)
+        self.assertEqual(context.exception.to_dict()['operation'], 'get_value')
+        self.assertIsInstance(context.exception.__cause__, OSError)
+
+    def test_no_retry(self):
+        device = FlakyDevice(failures=0)
+        with self.assertRaises(InstrumentError):
+            device.write('C1')
+        self.assertEqual(device.calls, 1)
+        # Other exceptions are raised as they are, without retries
+        with self.assertRaises(TypeError):
+            device.get_invalid()
+        self.assertEqual(device.calls, 2)
+
+    def test_breaker(self):
+        device = FlakyDevice(failures=3, threshold=3)
+        with self.assertRaises(InstrumentError):
+            device.query('X')
+        # Breaker is open: fail fast without touching the instrument
+        with self.assertRaises(InstrumentError) as context:
+            device.query('X')
+        self.assertEqual(context.exception.attempts, 0)
+        self.assertEqual(device.calls, 3)
+        # Probe reconnects and closes the breaker
+        deadline = time.monotonic() + 5
+        while not device.resilience.breaker.allow() and time.monotonic() < deadline:
+            time.sleep(0.01)
+        self.assertGreaterEqual(device.connects, 1)
+        self.assertEqual(device.query('X'), 'X')
+
+    def test_jittered_backoff(self):
+        delays = [jittered_backoff(0.1, 3, max_backoff=0.5) for _ in range(100)]
+        self.assertTrue(all(0 <= delay <= 0.5 for delay in delays))
+        self.assertGreater(len(set(delays)), 1)
+
+    def test_close_resources(self):
+        class Handle:
+            closed = False
+
+            def close(self):
+                self.closed = True
+
+        class BrokenHandle:
+            def close(self):
+                raise OSError('Session already closed')
+
+        handle = Handle()
+        close_resources(BrokenHandle(), None, handle)
+        self.assertTrue(handle.closed)
+
+class TestILMRetries(unittest.TestCase):
+    """
+    Test that garbled level meter responses no longer hang the caller
+    """
+    class GarbledResource:
+        def __init__(self):
+            self.queries = []
+
+        def query(self, command):
+            self.queries.append(command)
+            return '?R1'
+
+    def setUp(self):
+        self.ilm = ILM()
+        self.resource = self.GarbledResource()
+        self.ilm.ilm = self.resource
+
+    def test_get_LHe_level(self):
+        with self.assertRaises(InstrumentError):
+            self.ilm.get_LHe_level()
+        self.assertEqual(len(self.resource.queries), 1 + self.ilm.resilience.retries)
+
+    def test_reconnect_closes_session(self):
+        closed = []
+        self.resource.close = lambda: closed.append('resource')
+        self.ilm.connect()
+        self.assertEqual(closed, ['resource'])
+        self.assertIsNot(self.ilm.ilm, self.resource)
+
+class TestLakeshoreParse(unittest.TestCase):
+    """
+    Test that unparseable responses are reported as instrument errors
+    """
+    class GarbledResource:
+        def __init__(self):
+            self.queries = []
+
+        def query(self, command):
+            self.queries.append(command)
+            return '+0.000E+00;'
+
+    def setUp(self):
+        self.ls336 = Lakeshore336()
+        self.ls336.adaptive_delay = None
+        self.resource = self.GarbledResource()
+        self.ls336.ls336 = self.resource
+
+    def test_get_temperature(self):
+        with self.assertRaises(InstrumentError) as context:
+            self.ls336.get_temperature('A')
+        self.assertIsInstance(context.exception.__cause__, ValueError)
+        # Nested query() is not retried on its own
+        self.assertEqual(len(self.resource.queries), 1 + self.ls336.resilience.retries)
+
+class TestKeysightParse(unittest.TestCase):
+    """
+    Test that truncated or garbled VNA replies are reported as instrument errors
+    """
+    class GarbledResource:
+        def __init__(self):
+            self.queries = []
+
+        def write(self, command):
+            pass
+
+        def query(self, command):
+            self.queries.append(command)
+            if command == ':CALC1:MEAS1:DATA:SDAT?':
+                # Truncated trace: odd number of values
+                return '1.0,2.0,3.0'
+            return {':SENS1:FREQ:STAR?': '9.0E+07', ':SENS1:FREQ:STOP?': '1.1E+08', ':SENS1:SWE:POIN?': '2'}.get(
+                command, 'garbled')
+
+    def setUp(self):
+        self.VNA = KeysightE5080A()
+        self.VNA.binary_transfer = False
+        self.resource = self.GarbledResource()
+        self.VNA.VNA = self.resource
+
+    def test_read_trace(self):
+        with self.assertRaises(InstrumentError) as context:
+            self.VNA.read_trace()
+        self.assertIsInstance(context.exception.__cause__, ValueError)
+        self.assertEqual(self.resource.queries.count(':CALC1:MEAS1:DATA:SDAT?'), 1 + self.VNA.resilience.retries)
+
+    def test_analyze_trace(self):
+        # Trace analysis reads the same trace: instrument error instead of an unhandled exception
+        with self.assertRaises(InstrumentError):
+            self.VNA.analyze_trace([100])
+        self.assertEqual(self.VNA.analysis, (None, None))
+
+    def test_getters(self):
+        for getter in (lambda: self.VNA.get_marker_X(1), lambda: self.VNA.get_Q(1), lambda: self.VNA.get_filter(1)):
+            with self.assertRaises(InstrumentError):
+                getter()
+
+if __name__=="__main__":
+    unittest.main()
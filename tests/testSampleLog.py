@@ -0,0 +1,62 @@
+#!/usr/bin/env python
+
+"""
+
+Tests for the array-backed sample log.
+
+"""
+
+__author__ = "Ivan Jakovac"
+__email__ = "ivan.jakovac2@gmail.com"
+__version__ = "v0.1"
+
+
+#  Copyright (C) 2020-2025 Ivan Jakovac
+#
+#  This program is free software: you can redistribute it and/or modify it under the terms of the GNU General Public
+#  License as published by the Free Software Foundation, either version 3 of the License, or (at your option) any
+#  later version.
+#
+#  This program is distributed in the hope that it will be useful, but WITHOUT ANY WARRANTY; without even the implied
+#  warranty of MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License along with this program. If not,
+#  see <https://www.gnu.org/licenses/>.
+
+import unittest
+import sys
+sys.path.append('../src/flaskr/modules')
+import numpy as np
+from pySampleLog import SampleLog
+
+class TestSampleLog(unittest.TestCase):
+    """
+    Test appending samples and reading columns
+    """
+    def setUp(self):
+        self.log = SampleLog(['time', 'field'])
+
+    def test_columns(self):
+        for i in range(5):
+            self.log.append(float(i), 0.1*i)
+        self.assertEqual(len(self.log), 5)
+        columns = self.log.columns()
+        self.assertEqual(list(columns), ['time', 'field'])
+        self.assertIsInstance(columns['field'], np.ndarray)
+        np.testing.assert_allclose(columns['field'], [0.0, 0.1, 0.2, 0.3, 0.4])
+        # Incremental download
+        np.testing.assert_array_equal(self.log.columns(3)['time'], [3.0, 4.0])
+
+    def test_copy(self):
+        self.log.append(1.0, 2.0)
+        columns = self.log.columns()
+        self.log.append(3.0, 4.0)
+        self.assertEqual(len(columns['time']), 1)
+
+    def test_wrong_length(self):
+        with self.assertRaises(ValueError):
+            self.log.append(1.0)
+        self.assertEqual(len(self.log), 0)
+
+if __name__=="__main__":
+    unittest.main()
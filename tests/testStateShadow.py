@@ -0,0 +1,128 @@
+#!/usr/bin/env python
+
+"""
+
+Tests for the write-through instrument state shadow.
+
+"""
+
+__author__ = "Ivan Jakovac"
+__email__ = "ivan.jakovac2@gmail.com"
+__version__ = "v0.1"
+
+
+#  Copyright (C) 2020-2025 Ivan Jakovac
+#
+#  This program is free software: you can redistribute it and/or modify it under the terms of the GNU General Public
+#  License as published by the Free Software Foundation, either version 3 of the License, or (at your option) any
+#  later version.
+#
+#  This program is distributed in the hope that it will be useful, but WITHOUT ANY WARRANTY; without even the implied
+#  warranty of MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License along with this program. If not,
+#  see <https://www.gnu.org/licenses/>.
+
+import unittest
+import sys
+import time
+sys.path.append('../src/flaskr/modules')
+from pyStateShadow import StateShadow
+from pyLakeshore336 import Lakeshore336
+from pyKeysightE5080A import KeysightE5080A
+
+class RecordingResource:
+    # Records writes and answers queries from a fixed table
+    def __init__(self, responses):
+        self.responses = responses
+        self.writes = []
+        self.queries = []
+
+    def write(self, command):
+        self.writes.append(command)
+
+    def query(self, command):
+        self.queries.append(command)
+        return self.responses.get(command, '0')
+
+class TestStateShadow(unittest.TestCase):
+    """
+    Test known values, skipped commands and expiry
+    """
+    def setUp(self):
+        self.shadow = StateShadow('test')
+        self.writes = []
+
+    def test_apply(self):
+        self.assertTrue(self.shadow.apply('format', 'MLIN', self.writes.append, 'FORM MLIN'))
+        self.assertFalse(self.shadow.apply('format', 'MLIN', self.writes.append, 'FORM MLIN'))
+        self.assertTrue(self.shadow.apply('format', 'MLOG', self.writes.append, 'FORM MLOG'))
+        self.assertEqual(self.writes, ['FORM MLIN', 'FORM MLOG'])
+
+    def test_failed_write(self):
+        def failing_write(command):
+            raise IOError('timeout')
+        self.shadow.update('format', 'MLOG')
+        with self.assertRaises(IOError):
+            self.shadow.apply('format', 'MLIN', failing_write, 'FORM MLIN')
+        # Setting is unknown after a failed write
+        self.assertIsNone(self.shadow.get('format'))
+
+    def test_max_age(self):
+        self.shadow.max_age = 0.01
+        self.shadow.update('format', 'MLOG')
+        self.assertEqual(self.shadow.get('format'), 'MLOG')
+        time.sleep(0.05)
+        self.assertIsNone(self.shadow.get('format'))
+
+class TestLakeshore336PID(unittest.TestCase):
+    """
+    Test that set_PID queries and writes only what it has to
+    """
+    def setUp(self):
+        self.ls336 = Lakeshore336()
+        self.resource = RecordingResource({'PID? 2': '+0050.0,+0020.0,+0000.0'})
+        self.ls336.ls336 = self.resource
+        self.ls336.adaptive_delay = None
+
+    def test_known_pid(self):
+        self.ls336.set_PID(P=60)
+        self.assertEqual(self.resource.queries, ['PID? 2'])
+        self.ls336.set_PID(I=30)
+        # PID is known after the first set_PID: no more queries
+        self.assertEqual(self.resource.queries, ['PID? 2'])
+        self.assertEqual(self.resource.writes, ['PID 2,60.0,20.0,0.0', 'PID 2,60.0,30.0,0.0'])
+        self.ls336.set_PID(60, 30, 0)
+        self.assertEqual(len(self.resource.writes), 2)
+
+    def test_raw_write(self):
+        self.ls336.set_PID(50, 20, 0)
+        self.ls336.write('PID 2,1,1,1')
+        # Raw command invalidates the shadow, the same PID is sent again
+        self.ls336.set_PID(50, 20, 0)
+        self.assertEqual(self.resource.writes, ['PID 2,50.0,20.0,0.0', 'PID 2,1,1,1', 'PID 2,50.0,20.0,0.0'])
+
+class TestKeysightE5080AShadow(unittest.TestCase):
+    """
+    Test that markers and display format are set only once
+    """
+    def setUp(self):
+        self.VNA = KeysightE5080A()
+        self.resource = RecordingResource({':CALC1:MARK1:X?': '1.2E+07', ':CALC1:MARK1:Y?': '-3.5,0'})
+        self.VNA.VNA = self.resource
+
+    def test_markers(self):
+        for _ in range(3):
+            self.assertEqual(self.VNA.get_marker_X(1), 12.0)
+            self.assertEqual(self.VNA.get_marker_Y(1), -3.5)
+        self.assertEqual(self.resource.writes, [':CALC1:MARK1 ON', ':CALC1:FORM MLOG'])
+        # Raw queries keep the shadow, reconnecting resets it
+        self.VNA.query(':CALC1:FORM?')
+        self.VNA.get_marker_Y(1)
+        self.assertEqual(len(self.resource.writes), 2)
+        self.VNA.shadow.invalidate()
+        self.VNA.get_marker_Y(1)
+        self.assertEqual(self.resource.writes[2:], [':CALC1:FORM MLOG', ':CALC1:MARK1 ON'])
+
+if __name__=="__main__":
+    unittest.main()
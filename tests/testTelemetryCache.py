@@ -0,0 +1,122 @@
+#!/usr/bin/env python
+
+"""
+
+Tests for the shared telemetry cache.
+
+"""
+
+__author__ = "Ivan Jakovac"
+__email__ = "ivan.jakovac2@gmail.com"
+__version__ = "v0.1"
+
+
+#  Copyright (C) 2020-2025 Ivan Jakovac
+#
+#  This program is free software: you can redistribute it and/or modify it under the terms of the GNU General Public
+#  License as published by the Free Software Foundation, either version 3 of the License, or (at your option) any
+#  later version.
+#
+#  This program is distributed in the hope that it will be useful, but WITHOUT ANY WARRANTY; without even the implied
+#  warranty of MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License along with this program. If not,
+#  see <https://www.gnu.org/licenses/>.
+
+import unittest
+import sys
+import time
+from threading import Thread
+sys.path.append('../src/flaskr/modules')
+from pyTelemetryCache import TelemetryCache, cached
+from pyExecutor import DeviceExecutor, execute
+
+class Device:
+    def __init__(self, max_entries: int = 256):
+        self.executor = DeviceExecutor('test_cache')
+        self.cache = TelemetryCache(max_entries)
+        self.executor.add_state_listener(self.cache.invalidate)
+        self.queries = 0
+
+    @cached
+    @execute(DeviceExecutor.READ)
+    def get_temperature(self, control_channel: str = 'A'):
+        self.queries += 1
+        return float(self.queries)
+
+    @execute(DeviceExecutor.WRITE)
+    def write(self, command):
+        pass
+
+class TestTelemetryCache(unittest.TestCase):
+    """
+    Test cached values, their age and cache keys
+    """
+    def setUp(self):
+        self.device = Device()
+
+    def test_max_age(self):
+        self.assertEqual(self.device.get_temperature('A'), 1.0)
+        # Without max_age the device is always queried
+        self.assertEqual(self.device.get_temperature('A'), 2.0)
+        self.assertEqual(self.device.get_temperature('A', max_age=10), 2.0)
+        time.sleep(0.05)
+        self.assertEqual(self.device.get_temperature('A', max_age=0.01), 3.0)
+
+    def test_age(self):
+        self.device.get_temperature('A')
+        time.sleep(0.05)
+        value, age = self.device.cache.fetch(self.device.get_temperature, 10, 'A')
+        self.assertEqual(value, 1.0)
+        self.assertGreaterEqual(age, 0.05)
+        value, age = self.device.cache.fetch(self.device.get_temperature, None, 'A')
+        self.assertEqual((value, age), (2.0, 0.0))
+
+    def test_keys(self):
+        # Positional, keyword and default arguments share a cache entry, other channels do not
+        self.device.get_temperature()
+        self.assertEqual(self.device.get_temperature(control_channel='A', max_age=10), 1.0)
+        self.assertEqual(self.device.get_temperature('B', max_age=10), 2.0)
+        self.device.cache.invalidate()
+        self.assertEqual(self.device.get_temperature('A', max_age=10), 3.0)
+
+    def test_list_arguments(self):
+        # Lists (e.g. from JSON) are hashable cache keys equal to tuples
+        self.device.get_temperature(['A', 'B'])
+        self.assertEqual(self.device.get_temperature(('A', 'B'), max_age=10), 1.0)
+
+    def test_write_invalidates(self):
+        self.device.get_temperature('A')
+        self.device.write('SETP 2,10')
+        self.assertEqual(self.device.get_temperature('A', max_age=10), 2.0)
+
+    def test_setter_during_read(self):
+        # Setter submitted while a read runs: its invalidation is not overwritten by the value read before it
+        class RacingDevice(Device):
+            @cached
+            @execute(DeviceExecutor.READ)
+            def get_setpoint(self):
+                self.queries += 1
+                self.setter = Thread(target=self.write, args=('SETP 2,10',))
+                self.setter.start()
+                time.sleep(0.05)
+                return float(self.queries)
+
+        device = RacingDevice()
+        self.assertEqual(device.get_setpoint(), 1.0)
+        device.setter.join()
+        self.assertEqual(device.get_setpoint(max_age=10), 2.0)
+
+    def test_max_entries(self):
+        device = Device(max_entries=2)
+        device.get_temperature('A')
+        device.get_temperature('B')
+        # Reading A makes B the least recently used entry
+        device.get_temperature('A', max_age=10)
+        device.get_temperature('C')
+        self.assertEqual(len(device.cache.values), 2)
+        self.assertEqual(device.get_temperature('A', max_age=10), 1.0)
+        self.assertEqual(device.get_temperature('B', max_age=10), 4.0)
+
+if __name__ == '__main__':
+    unittest.main()
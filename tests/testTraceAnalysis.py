@@ -0,0 +1,135 @@
+#!/usr/bin/env python
+
+"""
+
+Tests for the server-side VNA trace analysis.
+
+"""
+
+__author__ = "Ivan Jakovac"
+__email__ = "ivan.jakovac2@gmail.com"
+__version__ = "v0.1"
+
+
+#  Copyright (C) 2020-2025 Ivan Jakovac
+#
+#  This program is free software: you can redistribute it and/or modify it under the terms of the GNU General Public
+#  License as published by the Free Software Foundation, either version 3 of the License, or (at your option) any
+#  later version.
+#
+#  This program is distributed in the hope that it will be useful, but WITHOUT ANY WARRANTY; without even the implied
+#  warranty of MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License along with this program. If not,
+#  see <https://www.gnu.org/licenses/>.
+
+import unittest
+import sys
+import numpy as np
+sys.path.append('../src/flaskr/modules')
+from pyTraceAnalysis import TraceAnalysis, stitch
+from pyKeysightE5080A import KeysightE5080A
+
+# Resonance dip at 100.3 MHz: S11 = 1 - 0.9/(1 + 2jQ(f - f0)/f0), -20 dB at the center
+CENTER, Q = 100.3, 50
+
+def resonance(frequencies):
+    return 1 - 0.9/(1 + 2j*Q*(frequencies - CENTER)/CENTER)
+
+class TestTraceAnalysis(unittest.TestCase):
+    """
+    Test figures of merit of a synthetic resonance
+    """
+    def setUp(self):
+        self.frequencies = np.linspace(90, 110, 401)
+        self.analysis = TraceAnalysis(self.frequencies, resonance(self.frequencies))
+
+    def test_minimum(self):
+        # Minimum between sweep points is found by the parabolic fit
+        analysis = TraceAnalysis(self.frequencies + 0.02, resonance(self.frequencies + 0.02))
+        minimum = analysis.minimum()
+        self.assertAlmostEqual(minimum['frequency'], CENTER, delta=0.01)
+        self.assertAlmostEqual(minimum['value'], -20, delta=0.2)
+
+    def test_notch(self):
+        notch = self.analysis.notch(-13)
+        self.assertAlmostEqual(notch['center'], CENTER, places=3)
+        self.assertAlmostEqual(notch['Q'], notch['center']/notch['bandwidth'])
+        # Edges are 13 dB below the peak of the trace
+        edge = notch['center'] - notch['bandwidth']/2
+        level = np.max(self.analysis.magnitude_dB) - 13
+        self.assertAlmostEqual(20*np.log10(abs(resonance(edge))), level, delta=0.05)
+
+    def test_filter(self):
+        filter_data = self.analysis.filter(0.5)
+        edge = filter_data['center'] + filter_data['bandwidth']/2
+        self.assertAlmostEqual(abs(resonance(edge)), 0.55, delta=0.002)
+
+    def test_not_reached(self):
+        # Level above the trace: no bandwidth
+        self.assertIsNone(self.analysis.notch(10)['bandwidth'])
+
+    def test_markers(self):
+        values = self.analysis.markers([CENTER, 95.05])
+        self.assertAlmostEqual(values[0], -20, places=6)
+        self.assertAlmostEqual(values[1], 20*np.log10(abs(resonance(95.05))), places=3)
+
+class TestStitch(unittest.TestCase):
+    """
+    Test joining sweep segments
+    """
+    def test_overlaps(self):
+        segments = [np.linspace(20, 30, 11), np.linspace(10, 20, 11), np.linspace(25, 35, 11)]
+        frequencies, data = stitch([(segment, resonance(segment)) for segment in segments])
+        # Shared edge (20 MHz) and the overlap 25-30 MHz are counted once, in order
+        np.testing.assert_allclose(frequencies, np.linspace(10, 35, 26))
+        np.testing.assert_allclose(data, resonance(frequencies))
+
+class TestKeysightE5080AAnalysis(unittest.TestCase):
+    """
+    Test that analyses of a cached trace do not read a new one
+    """
+    class ResonanceResource:
+        # Mock VNA with a resonance on a 401-point sweep 90-110 MHz, counts trace reads
+        def __init__(self):
+            self.reads = 0
+
+        def write(self, command):
+            pass
+
+        def query(self, command):
+            if command == ':CALC1:MEAS1:DATA:SDAT?':
+                self.reads += 1
+                data = resonance(np.linspace(90, 110, 401))
+                return ','.join(str(value) for value in data.view(np.float64))
+            return {':SENS1:FREQ:STAR?': '9.0E+07', ':SENS1:FREQ:STOP?': '1.1E+08', ':SENS1:SWE:POIN?': '401'}[command]
+
+    def setUp(self):
+        self.VNA = KeysightE5080A()
+        self.resource = self.ResonanceResource()
+        self.VNA.VNA = self.resource
+
+    def test_cached_trace(self):
+        first = self.VNA.analyze_trace([100], max_age=60)
+        second = self.VNA.analyze_trace(notch_threshold=-3, max_age=60)
+        self.assertEqual(self.resource.reads, 1)
+        self.assertAlmostEqual(first['minimum']['frequency'], CENTER, places=3)
+        # Results of the same trace are shared
+        self.assertIs(first['minimum'], second['minimum'])
+        # Without max_age a new trace is read
+        self.VNA.analyze_trace()
+        self.assertEqual(self.resource.reads, 2)
+
+    def test_sweep_change(self):
+        self.VNA.analyze_trace(max_age=60)
+        self.VNA.set_sweep_points(401)
+        self.assertEqual(self.VNA.analysis, (None, None))
+        # Trace of the old sweep is not reused
+        self.VNA.analyze_trace(max_age=60)
+        self.assertEqual(self.resource.reads, 2)
+        self.VNA.set_sweep_range(90, 110)
+        self.VNA.analyze_trace(max_age=60)
+        self.assertEqual(self.resource.reads, 3)
+
+if __name__=="__main__":
+    unittest.main()
@@ -0,0 +1,105 @@
+#!/usr/bin/env python
+
+"""
+
+Tests for SCPI write coalescing.
+
+"""
+
+__author__ = "Ivan Jakovac"
+__email__ = "ivan.jakovac2@gmail.com"
+__version__ = "v0.1"
+
+
+#  Copyright (C) 2020-2025 Ivan Jakovac
+#
+#  This program is free software: you can redistribute it and/or modify it under the terms of the GNU General Public
+#  License as published by the Free Software Foundation, either version 3 of the License, or (at your option) any
+#  later version.
+#
+#  This program is distributed in the hope that it will be useful, but WITHOUT ANY WARRANTY; without even the implied
+#  warranty of MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License along with this program. If not,
+#  see <https://www.gnu.org/licenses/>.
+
+import unittest
+import sys
+sys.path.append('../src/flaskr/modules')
+from pyWritePipeline import WritePipeline
+from pyKeysightE5080A import KeysightE5080A
+
+class MessageResource:
+    # Records every message written to the instrument
+    def __init__(self):
+        self.messages = []
+
+    def write(self, message):
+        self.messages.append(message)
+
+    def query(self, message):
+        self.messages.append(message)
+        return '1.2E+07' if message.endswith(':X?') else '1,2,3'
+
+class TestWritePipeline(unittest.TestCase):
+    """
+    Test joined writes, flushing and the *OPC? barrier
+    """
+    def setUp(self):
+        self.resource = MessageResource()
+        self.pipeline = WritePipeline(self.resource, 'test')
+
+    def test_unbuffered(self):
+        # Outside pipelined() blocks writes are sent immediately
+        self.pipeline.write(':SENS1:SWE:POIN 201')
+        self.assertEqual(self.resource.messages, [':SENS1:SWE:POIN 201'])
+
+    def test_joined_query(self):
+        with self.pipeline.pipelined():
+            self.pipeline.write(':CALC1:MARK1 ON')
+            self.pipeline.write(':CALC1:FORM MLOG')
+            self.assertEqual(self.resource.messages, [])
+            self.pipeline.query(':CALC1:MARK1:Y?')
+            self.pipeline.write(':CALC1:FORM MLIN')
+        self.assertEqual(self.resource.messages, [':CALC1:MARK1 ON;:CALC1:FORM MLOG;:CALC1:MARK1:Y?',
+                                                  ':CALC1:FORM MLIN'])
+
+    def test_not_joinable(self):
+        with self.pipeline.pipelined():
+            self.pipeline.write(':CALC1:MARK1 ON')
+            # Relative header would be resolved against the previous command
+            self.pipeline.write('SENS1:SWE:POIN 201')
+        self.assertEqual(self.resource.messages, [':CALC1:MARK1 ON', 'SENS1:SWE:POIN 201'])
+
+    def test_max_length(self):
+        self.pipeline.max_length = 40
+        with self.pipeline.pipelined():
+            for index in range(1, 4):
+                self.pipeline.write(f':CALC1:MARK{index} ON')
+        self.assertEqual(self.resource.messages, [':CALC1:MARK1 ON;:CALC1:MARK2 ON', ':CALC1:MARK3 ON'])
+
+    def test_opc_barrier(self):
+        self.pipeline.opc_barrier = True
+        with self.pipeline.pipelined():
+            self.pipeline.write(':SENS1:FREQ:STAR 10000000')
+            self.pipeline.write(':SENS1:FREQ:STOP 20000000')
+        self.assertEqual(self.resource.messages, [':SENS1:FREQ:STAR 10000000;:SENS1:FREQ:STOP 20000000;*OPC?'])
+
+class TestKeysightE5080APipeline(unittest.TestCase):
+    """
+    Test round trips of a Q measurement with write pipelining
+    """
+    def setUp(self):
+        self.VNA = KeysightE5080A()
+        self.resource = MessageResource()
+        self.VNA.VNA = WritePipeline(self.resource, 'KeysightE5080A')
+
+    def test_get_Q(self):
+        self.VNA.get_Q(1)
+        # Minimum search, notch search and the final notch off (instead of 8 writes and 2 queries)
+        self.assertEqual(len(self.resource.messages), 3)
+        self.assertTrue(self.resource.messages[1].endswith(':CALC1:MEAS1:MARK1:NOTC:DATA?'))
+        self.assertEqual(self.resource.messages[2], ':CALC1:MEAS1:MARK1:NOTC OFF')
+
+if __name__=="__main__":
+    unittest.main()